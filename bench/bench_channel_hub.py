@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_channel_hub.py
+-----------------------------------
+同一個 mood 有 N 個 listener 時的 server 成本：每個 /prompt 一條 pipeline（舊版）vs 共享頻道（ChannelHub）
+ - 離線替身：沒有 ffmpeg / yt-dlp，「解碼」換成 numpy 即時合成 PCM（每個封包做一次，成本與真解碼同樣只跟 pipeline 數有關），
+   照樣經過 Pacer + PacketSender 以即時速率送出
+ - listener 在另一個 process 裡（N 個 UDP socket + selectors），不算進 server 的 CPU
+ - 量 --seconds 秒內 server process 的 CPU 使用率、pipeline 數、每個 listener 收到的封包比例
+ - late：頻道播到一半才加入的 listener 收到的第一個封包 seq > 0（從直播位置開始，不重播）
+ - verify：同一個 mood 的 pcm / opus / 加密頻道各拿到不同的 multicast group，crc32 撞在一起的頻道也會錯開
+
+用法：
+    python bench/bench_channel_hub.py
+    python bench/bench_channel_hub.py --listeners 1 10 50 100 --seconds 3
+"""
+import argparse
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+import numpy as np
+
+from channel_hub import ChannelHub
+from pacer import Pacer, PACKET_SIZE, SAMPLE_RATE
+from streamer import PacketSender, StreamStopped
+from utils import multicast
+from utils.packet import unpack_header
+
+
+def synth_track(sender, url, packet_size=PACKET_SIZE, codec="pcm"):
+    """離線替身：每個封包即時合成一段 PCM 再送出（取代 ffmpeg 解碼）"""
+    samples = packet_size // 2
+    total = int(float(url.rsplit("=", 1)[1]) * SAMPLE_RATE / samples)
+    t = np.arange(samples) / SAMPLE_RATE
+    for i in range(total):
+        phase = 2 * np.pi * 440 * (t + i * samples / SAMPLE_RATE)
+        pcm = (np.sin(phase) * 0.3 * 32767).astype("<i2").tobytes()
+        sender.send(pcm)
+
+
+class SynthSource:
+    """ChannelHub 用的離線來源：每次 read 即時合成一段 PCM（取代 ffmpeg 解碼）"""
+
+    def __init__(self, url, codec="pcm"):
+        self.codec = codec
+        self.remaining = int(float(url.rsplit("=", 1)[1]) * SAMPLE_RATE)
+        self.position = 0
+
+    def read(self, n):
+        samples = min(n // 2, self.remaining)
+        if samples <= 0:
+            return b""
+        t = (np.arange(samples) + self.position) / SAMPLE_RATE
+        self.position += samples
+        self.remaining -= samples
+        return (np.sin(2 * np.pi * 440 * t) * 0.3 * 32767).astype("<i2").tobytes()
+
+    def close(self):
+        pass
+
+
+def listener_process(n, seconds, conn):
+    """N 個 socket 收到 seconds + 1 秒；回報每個 socket 的 (封包數, 第一個 seq)"""
+    sel = selectors.DefaultSelector()
+    socks = []
+    for _ in range(n):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(("127.0.0.1", 0))
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ, len(socks))
+        socks.append(s)
+    conn.send([s.getsockname()[1] for s in socks])
+    counts = [0] * n
+    first = [None] * n
+    deadline = time.monotonic() + seconds + 1.0
+    while time.monotonic() < deadline:
+        for key, _ in sel.select(timeout=0.1):
+            i = key.data
+            try:
+                while True:
+                    data = key.fileobj.recv(2048)
+                    counts[i] += 1
+                    if first[i] is None:
+                        first[i] = unpack_header(data)[2]
+            except BlockingIOError:
+                pass
+    conn.send((counts, first))
+
+
+def run(mode, n, seconds, late_at):
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=listener_process, args=(n, seconds, child), daemon=True)
+    proc.start()
+    ports = parent.recv()
+    url = f"synth://tone?seconds={seconds}"
+    late = ports[-1] if n > 1 else None   # 最後一個 listener 晚 late_at 秒才加入
+    threads, stop = [], threading.Event()
+
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    if mode == "legacy":
+        def legacy(port):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                synth_track(PacketSender(sock, ("127.0.0.1", port), Pacer(), stop=stop), url)
+            except StreamStopped:
+                pass
+            finally:
+                sock.close()
+        for port in ports:
+            if port == late:
+                continue
+            threads.append(threading.Thread(target=legacy, args=(port,), daemon=True))
+            threads[-1].start()
+        pipelines = len(threads)
+    else:
+        hub = ChannelHub(lambda mood: url, open_source=SynthSource)
+        for port in ports:
+            if port != late:
+                hub.subscribe(("client", port), "happy", "pcm", ("127.0.0.1", port), url)
+    if late is not None:
+        time.sleep(late_at)
+        if mode == "legacy":
+            # 舊版的 late joiner：自己的 pipeline 從頭播
+            threads.append(threading.Thread(target=legacy, args=(late,), daemon=True))
+            threads[-1].start()
+            pipelines += 1
+        else:
+            hub.subscribe(("client", late), "happy", "pcm", ("127.0.0.1", late), url)
+    time.sleep(max(0.0, seconds - (time.monotonic() - wall0)))
+    cpu = time.process_time() - cpu0
+    wall = time.monotonic() - wall0
+    if mode == "hub":
+        pipelines = hub.stats()["pipelines_started"]
+        for port in ports:
+            hub.unsubscribe(("client", port))
+    stop.set()
+    counts, first = parent.recv()
+    proc.join()
+    expected = int(seconds * SAMPLE_RATE * 2 / PACKET_SIZE)
+    on_time = [c for p, c in zip(ports, counts) if p != late]
+    late_seq = first[-1] if late is not None else None
+    return pipelines, cpu / wall, min(on_time) / expected, late_seq
+
+
+def verify():
+    hub = ChannelHub(lambda mood: None)
+    keys = [(mood, codec, secure) for mood in ("happy", "sad", "calm", "energetic", "chill", "focus")
+            for codec in ("pcm", "opus") for secure in (False, True)]
+    groups = {key: hub.group_for(*key) for key in keys}
+    assert len(set(groups.values())) == len(keys), groups
+    assert all(multicast.is_multicast(group) for group in groups.values())
+    assert groups[("happy", "pcm", False)] == multicast.group_for("happy")
+    assert hub.group_for("happy", "opus", True) == groups[("happy", "opus", True)]
+    print(f"verify: {len(keys)} channels on {len(set(groups.values()))} distinct multicast groups")
+
+
+def main():
+    verify()
+    parser = argparse.ArgumentParser(description="Shared mood channels vs one pipeline per listener")
+    parser.add_argument("--listeners", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--late-at", type=float, default=1.0, help="最後一個 listener 幾秒後才加入")
+    args = parser.parse_args()
+
+    print(f"{'listeners':>10}{'mode':>8}{'pipelines':>11}{'server cpu':>12}{'min recv':>10}{'late 1st seq':>14}")
+    for n in args.listeners:
+        for mode in ("legacy", "hub"):
+            pipelines, cpu, recv, late_seq = run(mode, n, args.seconds, args.late_at)
+            late = "-" if late_seq is None else str(late_seq)
+            print(f"{n:>10}{mode:>8}{pipelines:>11}{cpu:>12.1%}{recv:>10.1%}{late:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_codec.py
+-----------------------------------
+比較各 codec 模式（pcm / opus）：
+ - 每位 listener 的頻寬（含 12-byte 封包 header 與 28-byte IPv4/UDP header）
+ - client 端解碼 CPU 成本（每秒音訊花多少 CPU 秒）
+
+音源：--input 指定的本機檔案，否則用 ffmpeg lavfi 產生的 pink noise（比正弦波難壓）。
+需要 ffmpeg；opus 模式另需 ffmpeg 有 libopus（預設只跑 server_codecs() 探測到的）與 opuslib（沒有就跳過解碼那欄）。
+
+用法：
+    python bench/bench_codec.py --seconds 30
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+from pacer import PACKET_SIZE, BYTE_RATE
+from utils.codec import CODEC_IDS, ffmpeg_output_args, iter_ogg_packets, make_decoder, server_codecs
+from utils.packet import HEADER_SIZE
+
+UDP_IP_OVERHEAD = 28
+
+
+def transcode(source, codec, seconds):
+    if source:
+        inp = ["-i", source]
+    else:
+        inp = ["-f", "lavfi", "-i", "anoisesrc=color=pink:sample_rate=44100:amplitude=0.3"]
+    cmd = ["ffmpeg", "-v", "error", "-t", str(seconds)] + inp + ffmpeg_output_args(codec)
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    if codec == "opus":
+        return list(iter_ogg_packets(io.BytesIO(out)))
+    return [out[i:i + PACKET_SIZE] for i in range(0, len(out), PACKET_SIZE)]
+
+
+def decode_cost(codec, packets):
+    try:
+        decoder = make_decoder(CODEC_IDS[codec])
+    except Exception as e:
+        return None, str(e)
+    t0 = time.process_time()
+    pcm = 0
+    for p in packets:
+        pcm += len(decoder.decode(p))
+    return time.process_time() - t0, pcm
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-listener bandwidth and decode CPU per codec")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--input", default=None)
+    parser.add_argument("--codecs", nargs="+", default=None, help="預設：ffmpeg 能產生的（沒有 libopus 時只有 pcm）")
+    args = parser.parse_args()
+    codecs = args.codecs or sorted(server_codecs(), key=["pcm", "opus"].index)
+
+    print(f"{'codec':<6}{'packets':>9}{'payload kbit/s':>16}{'wire kbit/s':>13}{'decode cpu %':>14}")
+    for codec in codecs:
+        packets = transcode(args.input, codec, args.seconds)
+        payload = sum(len(p) for p in packets)
+        wire = payload + len(packets) * (HEADER_SIZE + UDP_IP_OVERHEAD)
+        cpu, pcm = decode_cost(codec, packets)
+        audio_s = (pcm / BYTE_RATE) if cpu is not None else args.seconds
+        cpu_col = f"{cpu / audio_s * 100:>14.3f}" if cpu is not None else f"{'n/a':>14}"
+        print(f"{codec:<6}{len(packets):>9}{payload * 8 / 1000 / audio_s:>16.1f}"
+              f"{wire * 8 / 1000 / audio_s:>13.1f}{cpu_col}")
+        if cpu is None:
+            print(f"       decoder unavailable: {pcm}")
+
+
+if __name__ == "__main__":
+    main()
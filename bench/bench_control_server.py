@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_control_server.py
+-----------------------------------
+比較「一條連線一個 thread + busy polling」舊版 server（含舊的 10-byte ASCII 訊框）與 asyncio server：
+ - 連線容量：N 條控制連線同時在線時，能回覆的比例
+ - /prompt round-trip：送出 prompt 到收到 "[server] Mood: ..." 的 p50 / p99
+
+search_youtube_music 與 mood 頻道（channel_hub）以 stub 取代（不連 YouTube、不開 ffmpeg），
+量到的是控制面本身的成本。
+
+用法：
+    python bench/bench_control_server.py --clients 100 500 1000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+import server
+from utils.encryptor import encrypt_message, decrypt_message
+from utils.framing import encode_frame, read_frame
+
+PROMPT = "/prompt I feel happy today"
+
+
+def _stub_search(mood):
+    return f"http://stub/{mood}"
+
+
+async def _stub_search_async(mood, timeout=None):
+    return _stub_search(mood)
+
+
+class StubHub:
+    """不開串流的 channel_hub"""
+
+    def endpoint_for(self, unicast, group=None, port=None):
+        return unicast
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+    def unsubscribe(self, client):
+        pass
+
+
+server.search_youtube_music = _stub_search
+server.search_youtube_music_async = _stub_search_async
+server.channel_hub = StubHub()
+
+
+# ------------------------------------------------------------
+# 舊版 threaded server（baseline 的 handle_client / start_server 邏輯，
+# 以及它使用的 10-byte ASCII header send_large / recv_large）
+# ------------------------------------------------------------
+def send_large(sock, data):
+    sock.sendall(f"{len(data):<10}".encode() + data)
+
+
+def recv_large(sock, buffer_size=1024):
+    header = sock.recv(10)
+    if not header:
+        return b""
+    total_len = int(header.decode().strip())
+    data = b""
+    while len(data) < total_len:
+        chunk = sock.recv(buffer_size)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+async def legacy_read_reply(reader):
+    header = await reader.readexactly(10)
+    return await reader.readexactly(int(header.decode().strip()))
+
+
+def legacy_handle_client(conn, addr):
+    conn.settimeout(60)
+    conn.setblocking(False)
+    try:
+        while True:
+            try:
+                encrypted_data = recv_large(conn, server.BUFFER_SIZE)
+            except BlockingIOError:
+                time.sleep(0.05)
+                continue
+            if not encrypted_data:
+                break
+            data = decrypt_message(encrypted_data)
+            while True:
+                try:
+                    send_large(conn, encrypt_message(f"[server] Mood processed: {data}"))
+                    break
+                except BlockingIOError:
+                    time.sleep(0.05)
+            if data.startswith("/prompt "):
+                mood = server.analyze_text(data.replace("/prompt ", "", 1))
+                server.search_youtube_music(mood)
+                encrypted_response = encrypt_message(f"[server] Mood: {mood}")
+                sent = 0
+                while sent < len(encrypted_response):
+                    try:
+                        sent += conn.send(encrypted_response[sent:])
+                    except BlockingIOError:
+                        time.sleep(0.05)
+    except Exception:
+        pass
+    finally:
+        conn.close()
+
+
+def legacy_start_server(port, ready):
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", port))
+    srv.listen(5)
+    srv.setblocking(False)
+    ready.set()
+    while True:
+        try:
+            conn, addr = srv.accept()
+            threading.Thread(target=legacy_handle_client, args=(conn, addr), daemon=True).start()
+        except BlockingIOError:
+            time.sleep(0.05)
+
+
+def asyncio_start_server(port, ready):
+    asyncio.run(server.serve("127.0.0.1", port, ready=ready, heartbeat_port=None))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ------------------------------------------------------------
+# client 端：N 條連線同時在線，各送一次 prompt
+# ------------------------------------------------------------
+MOOD_REPLY_LEN = len(encrypt_message("[server] Mood: happy"))
+
+
+async def legacy_exchange(reader, writer):
+    writer.write(f"{len(PROMPT_TOKEN):<10}".encode() + PROMPT_TOKEN)
+    await writer.drain()
+    await legacy_read_reply(reader)
+    return await reader.readexactly(MOOD_REPLY_LEN)   # 舊版的 Mood 回覆沒有 header
+
+
+async def framed_exchange(reader, writer):
+    writer.write(encode_frame(PROMPT_TOKEN))
+    await writer.drain()
+    await read_frame(reader)
+    return await read_frame(reader)
+
+
+PROMPT_TOKEN = encrypt_message(PROMPT)
+
+
+async def one_client(port, start_evt, timeout, exchange):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except Exception:
+        return None
+    try:
+        await start_evt.wait()
+        t0 = time.perf_counter()
+        mood_reply = await asyncio.wait_for(exchange(reader, writer), timeout)
+        rtt = time.perf_counter() - t0
+        decrypt_message(mood_reply)
+        return rtt
+    except Exception:
+        return None
+    finally:
+        writer.close()
+
+
+async def run_clients(port, n, timeout, exchange):
+    start_evt = asyncio.Event()
+    tasks = [asyncio.create_task(one_client(port, start_evt, timeout, exchange)) for _ in range(n)]
+    await asyncio.sleep(0.5 + n / 1000)  # 讓連線都建立完成
+    start_evt.set()
+    return await asyncio.gather(*tasks)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def bench(mode, n, timeout):
+    port = free_port()
+    ready = threading.Event()
+    target = legacy_start_server if mode == "threaded" else asyncio_start_server
+    exchange = legacy_exchange if mode == "threaded" else framed_exchange
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=target, args=(port, ready), daemon=True).start()
+        ready.wait(5)
+        cpu0 = time.process_time()
+        rtts = asyncio.run(run_clients(port, n, timeout, exchange))
+        cpu = time.process_time() - cpu0
+    ok = [r for r in rtts if r is not None]
+    return {
+        "mode": mode,
+        "clients": n,
+        "served": len(ok),
+        "p50_ms": percentile(ok, 50) * 1000,
+        "p99_ms": percentile(ok, 99) * 1000,
+        "cpu_s": cpu,
+        "threads": threading.active_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control server capacity / latency benchmark")
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--modes", nargs="+", default=["threaded", "asyncio"])
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'clients':>8}{'served':>8}{'p50 ms':>10}{'p99 ms':>10}{'cpu s':>8}{'threads':>9}")
+    for n in args.clients:
+        for mode in args.modes:
+            r = bench(mode, n, args.timeout)
+            print(f"{r['mode']:<10}{r['clients']:>8}{r['served']:>8}{r['p50_ms']:>10.1f}"
+                  f"{r['p99_ms']:>10.1f}{r['cpu_s']:>8.2f}{r['threads']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_control_session.py
+-----------------------------------
+GUI 送 prompt 的控制面成本：每個 prompt 開一條新連線（舊版 send_prompt_to_server）
+vs 常駐 ControlSession（client/control_session.py）
+ - per-conn：connect → /codec → /prompt → close，一次一個
+ - session：同一條連線，一次一個
+ - pipelined：同一條連線，同時 --inflight 個 prompt 在路上
+量每個 prompt 的 round-trip p50 / p99、整體 prompts/s，以及 server 端看到的新連線數。
+
+search_youtube_music 以 stub 取代（--search-ms 模擬 yt-dlp 延遲），mood 頻道不送音訊。
+
+用法：
+    python bench/bench_control_session.py
+    python bench/bench_control_session.py --prompts 500 --search-ms 20 --inflight 16
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+sys.path.append(os.path.join(ROOT, "client"))
+
+import server
+from control_session import ControlSession
+from utils.encryptor import encrypt_message, decrypt_message
+from utils.framing import FrameDecoder, send_frame, recv_frame
+
+CODEC_CMD = "/codec pcm"
+PROMPT = "/prompt I feel happy today"
+
+
+def stub_search(delay):
+    async def search(mood, timeout=None):
+        await asyncio.sleep(delay)
+        return f"http://stub/{mood}"
+    return search
+
+
+class StubHub:
+    """不開串流的 channel_hub"""
+
+    def endpoint_for(self, unicast, group=None, port=None):
+        return unicast
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+    def unsubscribe(self, client):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port):
+    ready = threading.Event()
+    serve = server.serve("127.0.0.1", port, ready=ready, heartbeat_port=None)
+    threading.Thread(target=asyncio.run, args=(serve,), daemon=True).start()
+    ready.wait(5)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+# ------------------------------------------------------------
+# 三種送法；各回傳每個 prompt 的 round-trip（秒）
+# ------------------------------------------------------------
+def run_per_connection(port, n, inflight):
+    rtts = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            decoder = FrameDecoder()
+            send_frame(sock, encrypt_message(CODEC_CMD))
+            recv_frame(sock, decoder)
+            recv_frame(sock, decoder)
+            send_frame(sock, encrypt_message(PROMPT))
+            replies = [decrypt_message(recv_frame(sock, decoder)) for _ in range(2)]
+        assert replies[1].startswith("[server] Mood:"), replies
+        rtts.append(time.perf_counter() - t0)
+    return rtts
+
+
+def run_session(port, n, inflight):
+    session = ControlSession("127.0.0.1", port)
+    rtts = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        session.submit(CODEC_CMD)
+        reply = session.request(PROMPT)
+        assert "[server] Mood:" in reply, reply
+        rtts.append(time.perf_counter() - t0)
+    session.close()
+    return rtts
+
+
+def run_pipelined(port, n, inflight):
+    session = ControlSession("127.0.0.1", port)
+    session.request(CODEC_CMD)
+    rtts = []
+    window = []
+    for _ in range(n):
+        future = session.submit(PROMPT)
+        window.append((time.perf_counter(), future))
+        if len(window) >= inflight:
+            t0, f = window.pop(0)
+            f.result(30)
+            rtts.append(time.perf_counter() - t0)
+    for t0, f in window:
+        f.result(30)
+        rtts.append(time.perf_counter() - t0)
+    session.close()
+    return rtts
+
+
+MODES = {"per-conn": run_per_connection, "session": run_session, "pipelined": run_pipelined}
+
+
+def bench(mode, port, n, inflight):
+    accepted0 = server.connection_stats["accepted"]
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        rtts = MODES[mode](port, n, inflight)
+        time.sleep(0.05)   # 讓 server 的斷線訊息也落在 redirect 裡
+    elapsed = time.perf_counter() - t0
+    return {
+        "mode": mode,
+        "prompts": len(rtts),
+        "p50_ms": percentile(rtts, 50) * 1000,
+        "p99_ms": percentile(rtts, 99) * 1000,
+        "rate": len(rtts) / elapsed,
+        "connections": server.connection_stats["accepted"] - accepted0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-prompt connection vs persistent control session")
+    parser.add_argument("--prompts", type=int, default=300)
+    parser.add_argument("--search-ms", type=float, default=0.0, help="stub yt-dlp 延遲")
+    parser.add_argument("--inflight", type=int, default=8, help="pipelined 模式同時在路上的 prompt 數")
+    parser.add_argument("--modes", nargs="+", default=list(MODES))
+    args = parser.parse_args()
+
+    server.search_youtube_music_async = stub_search(args.search_ms / 1000)
+    server.channel_hub = StubHub()
+    port = free_port()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_server(port)
+
+    print(f"{'mode':<11}{'prompts':>8}{'p50 ms':>10}{'p99 ms':>10}{'prompt/s':>10}{'new conns':>11}")
+    for mode in args.modes:
+        r = bench(mode, port, args.prompts, args.inflight)
+        print(f"{r['mode']:<11}{r['prompts']:>8}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['rate']:>10.0f}{r['connections']:>11}")
+
+
+if __name__ == "__main__":
+    main()
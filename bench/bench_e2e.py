@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_e2e.py
+-----------------------------------
+端對端負載 / 延遲測試：N 個模擬 client 走真的加密控制協定連 server/server.py，量整條路徑
+ - server 在子 process 裡跑（真的 serve() + ChannelHub + streamer），只換掉外部依賴：
+     search_youtube_music → stub，回傳本機產生的 WAV（每個 mood 一個音高）
+     ffmpeg 有裝就照常轉碼本機檔（之後命中 PCM 快取，快取放暫存目錄）；沒裝就直接讀 WAV 送出
+ - client 分散在 --procs 個 process 裡（避免 client 自己變成瓶頸），每個 client：
+     TCP 連線 → "#1 /setudp <port>" → "#2 /prompt <text>"，UDP 收到的封包只記時間與 seq（null audio sink）
+ - 每個 level（client 數）量：
+     prompt → 第一個音訊封包的延遲 p50 / p99 / max
+     pacing：封包到達間隔跟理想間隔（1024 B / 88200 B/s ≈ 11.6 ms）的偏差 p50 / p99，收到的 bytes / 應收 bytes
+     loss：seq 缺口
+     server CPU（/proc/<pid>/stat）與 RSS（/proc/<pid>/status），總量與每個 client 的增量
+ - sustainable：所有 client 都收到第一個封包、最差 client 的收包率 ≥ --min-recv、pacing p99 ≤ --max-jitter-ms；
+   --ramp 時 client 數加倍直到不符合（或到 --max-clients），回報最大可持續的 client 數
+ - --secure：client 先握手（每條連線自己的 AEAD key）、送 /secure on，音訊封包由 server 加密、client 解密
+   （不加時走舊版共用 key 的 Fernet 控制協定、明文音訊），比較加密對 server CPU 與延遲的影響
+ - --json <檔案>（或 -）輸出機器可讀的結果，方便追蹤 regression
+
+用法：
+    python bench/bench_e2e.py
+    python bench/bench_e2e.py --clients 10 50 100 --seconds 5 --json e2e.json
+    python bench/bench_e2e.py --ramp --max-clients 1600 --json -
+    python bench/bench_e2e.py --clients 100 --secure
+"""
+import argparse
+import array
+import asyncio
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+from utils.encryptor import PacketOpener, client_hello, decrypt_message, encrypt_message, finish_hello, parse_stream_key
+from utils.framing import encode_frame, read_frame
+from utils.packet import unpack_header
+
+SAMPLE_RATE = 44100
+PACKET_BYTES = 1024
+PACKET_INTERVAL = PACKET_BYTES / (SAMPLE_RATE * 2)
+MOODS = {"happy": 440.0, "sad": 220.0, "calm": 330.0, "energetic": 550.0}
+PROMPTS = ["I feel happy today", "I am so sad", "feeling calm and relaxed", "lets party dance"]
+RCVBUF = 1024 * 1024
+
+
+# ------------------------------------------------------------
+# 離線素材
+# ------------------------------------------------------------
+def write_tone(path, freq, seconds):
+    """44.1 kHz mono s16 的正弦波 WAV（ffmpeg 的輸入 / 沒有 ffmpeg 時直接送）"""
+    step = 2 * math.pi * freq / SAMPLE_RATE
+    one = array.array("h", (int(0.3 * 32767 * math.sin(step * i)) for i in range(SAMPLE_RATE)))
+    if sys.byteorder != "little":
+        one.byteswap()
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        for _ in range(int(seconds)):      # 整數 Hz 的音高，一秒的波形可以直接接續
+            w.writeframes(one.tobytes())
+
+
+class WavSource:
+    """沒有 ffmpeg 時的 TrackSource 替身：WAV 本身就是 server 要送的 s16le PCM"""
+
+    def __init__(self, url, codec="pcm"):
+        self.codec = codec
+        self.wav = wave.open(url, "rb")
+
+    def duration(self):
+        return self.wav.getnframes() / SAMPLE_RATE
+
+    def read(self, n):
+        return self.wav.readframes(n // 2)
+
+    def close(self):
+        self.wav.close()
+
+
+# ------------------------------------------------------------
+# server 子 process
+# ------------------------------------------------------------
+def run_server(port, tracks, use_ffmpeg):
+    """MOODDJ_PCM_CACHE 由父 process 的環境變數帶進來（import server 之前）；server 的 log 丟掉"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import server
+
+        async def search(mood, timeout=None):
+            return tracks[mood if mood in tracks else "happy"]
+
+        server.search_youtube_music_async = search
+        server.channel_hub.resolve = lambda mood: tracks[mood if mood in tracks else "happy"]
+        server.channel_hub.resolve_next = lambda mood, index: server.channel_hub.resolve(mood)
+        if not use_ffmpeg:
+            server.channel_hub.open_source = WavSource
+
+        asyncio.run(server.serve("127.0.0.1", port, heartbeat_port=None))
+
+
+def proc_usage(pid):
+    """(user + system CPU 秒數, RSS bytes)；沒有 /proc 時回傳 nan"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        return cpu, rss
+    except (OSError, StopIteration, ValueError):
+        return float("nan"), float("nan")
+
+
+# ------------------------------------------------------------
+# 模擬 client
+# ------------------------------------------------------------
+class NullSink(asyncio.DatagramProtocol):
+    """收到的封包只記到達時間與 seq，不解碼不播放；opener 有 key 時先解密（跟 player 一樣）"""
+
+    def __init__(self):
+        self.first = None
+        self.arrivals = []
+        self.seqs = []
+        self.bytes = 0
+        self.opener = None
+
+    def datagram_received(self, data, addr):
+        now = time.perf_counter()
+        if self.opener is not None:
+            if self.opener.aead is None:
+                self.opener.hold(data)      # key 還在控制連線上（同 player.push_datagram）
+                return
+            self.release(now)
+        self._record(data, now)
+
+    def release(self, now=None):
+        """key 到了：先前留著的封包這時才算收到（可以播）"""
+        now = time.perf_counter() if now is None else now
+        for held in self.opener.release():
+            self._record(held, now)
+
+    def _record(self, data, now):
+        try:
+            if self.opener is not None:
+                data = self.opener.open(data)
+            _, _, seq, _, payload = unpack_header(data)
+        except ValueError:
+            return
+        if self.first is None:
+            self.first = now
+        self.arrivals.append(now)
+        self.seqs.append(seq)
+        self.bytes += len(payload)
+
+
+async def request(reader, writer, tag, command, timeout, seal=encrypt_message, open_=decrypt_message):
+    writer.write(encode_frame(seal(f"#{tag} {command}")))
+    await writer.drain()
+    return open_(await asyncio.wait_for(read_frame(reader), timeout))
+
+
+async def handshake(reader, writer, timeout):
+    """control_session 的握手（asyncio 版），回傳 SessionCipher"""
+    private, hello = client_hello()
+    writer.write(encode_frame(hello))
+    await writer.drain()
+    return finish_hello(private, hello, await asyncio.wait_for(read_frame(reader), timeout))
+
+
+async def one_client(i, port, seconds, timeout, secure=False):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+    sock.bind(("127.0.0.1", 0))
+    transport, sink = await loop.create_datagram_endpoint(NullSink, sock=sock)
+    result = {"latency": None, "arrivals": [], "seqs": [], "bytes": 0, "error": None}
+    writer = None
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+        codec = {}
+        if secure:
+            cipher = await handshake(reader, writer, timeout)
+            codec = {"seal": cipher.seal, "open_": cipher.open}
+            await request(reader, writer, 0, "/secure on", timeout, **codec)
+            sink.opener = PacketOpener()
+        await request(reader, writer, 1, f"/setudp {sock.getsockname()[1]}", timeout, **codec)
+        t0 = time.perf_counter()
+        reply = await request(reader, writer, 2, f"/prompt {PROMPTS[i % len(PROMPTS)]}", timeout, **codec)
+        if "Mood:" not in reply:
+            raise RuntimeError(reply)
+        for line in reply.splitlines():
+            if parse_stream_key(line):
+                sink.opener.set_key(*parse_stream_key(line))
+                sink.release()
+        deadline = t0 + seconds
+        while sink.first is None and time.perf_counter() < deadline:
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+        if sink.first is not None:
+            result["latency"] = sink.first - t0
+    except Exception as e:
+        result["error"] = repr(e)
+    finally:
+        if writer is not None:
+            writer.close()
+        transport.close()
+    result.update(arrivals=sink.arrivals, seqs=sink.seqs, bytes=sink.bytes)
+    return result
+
+
+def client_process(indices, port, seconds, timeout, conn, secure=False):
+    async def main():
+        return await asyncio.gather(*(one_client(i, port, seconds, timeout, secure) for i in indices))
+    conn.send(asyncio.run(main()))
+    conn.close()
+
+
+def summarize_client(res):
+    """單一 client 的 pacing 偏差 (ms)、收包率、遺失數"""
+    arrivals, seqs = res["arrivals"], res["seqs"]
+    if len(arrivals) < 2:
+        return [], 0.0, 0
+    deviations = [abs(b - a - PACKET_INTERVAL) * 1000 for a, b in zip(arrivals, arrivals[1:])]
+    span = arrivals[-1] - arrivals[0] + PACKET_INTERVAL
+    recv = res["bytes"] / (span * SAMPLE_RATE * 2)
+    lost = 0
+    for a, b in zip(seqs, seqs[1:]):
+        if b > a + 1:
+            lost += b - a - 1
+    return deviations, recv, lost
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+# ------------------------------------------------------------
+# 一個 level
+# ------------------------------------------------------------
+def run_level(n, port, server_pid, args):
+    procs = max(1, min(args.procs, n))
+    shares = [list(range(k, n, procs)) for k in range(procs)]
+    cpu0, rss0 = proc_usage(server_pid)
+    wall0 = time.perf_counter()
+    workers = []
+    for share in shares:
+        parent, child = multiprocessing.Pipe(duplex=False)
+        p = multiprocessing.Process(target=client_process,
+                                    args=(share, port, args.seconds, args.timeout, child, args.secure), daemon=True)
+        p.start()
+        workers.append((p, parent))
+
+    # 量測窗的後半取樣 RSS（所有 client 都已訂閱、pipeline 都在跑）
+    time.sleep(args.seconds * 0.75)
+    _, rss_peak = proc_usage(server_pid)
+    results = []
+    for p, parent in workers:
+        results.extend(parent.recv())
+        p.join()
+    cpu1, _ = proc_usage(server_pid)
+    wall = time.perf_counter() - wall0
+    time.sleep(0.5)   # 讓 server 收掉斷線、停下頻道
+
+    latencies = [r["latency"] * 1000 for r in results if r["latency"] is not None]
+    deviations, recvs, lost = [], [], 0
+    for r in results:
+        d, recv, l = summarize_client(r)
+        deviations.extend(d)
+        recvs.append(recv)
+        lost += l
+    errors = [r["error"] for r in results if r["error"]]
+    cpu = (cpu1 - cpu0) / wall
+    level = {
+        "clients": n,
+        "connected": n - len(errors),
+        "first_packet": len(latencies),
+        "latency_ms": {"p50": percentile(latencies, 50), "p99": percentile(latencies, 99),
+                       "max": max(latencies, default=float("nan"))},
+        "pacing_ms": {"p50": percentile(deviations, 50), "p99": percentile(deviations, 99)},
+        "recv_ratio": {"min": min(recvs, default=0.0), "mean": sum(recvs) / len(recvs) if recvs else 0.0},
+        "lost_packets": lost,
+        "server_cpu": cpu,
+        "server_cpu_per_client": cpu / n,
+        "server_rss_mb": rss_peak / 2 ** 20,
+        "server_rss_per_client_kb": (rss_peak - rss0) / n / 1024,
+        "errors": errors[:5],
+    }
+    level["sustainable"] = (
+        level["first_packet"] == n
+        and level["recv_ratio"]["min"] >= args.min_recv
+        and level["pacing_ms"]["p99"] <= args.max_jitter_ms
+    )
+    return level
+
+
+def print_level(level):
+    lat, pacing, recv = level["latency_ms"], level["pacing_ms"], level["recv_ratio"]
+    print(f"{level['clients']:>8}{level['first_packet']:>7}{lat['p50']:>8.1f}{lat['p99']:>8.1f}"
+          f"{pacing['p50']:>8.2f}{pacing['p99']:>8.2f}{recv['min']:>8.1%}{level['lost_packets']:>7}"
+          f"{level['server_cpu']:>8.1%}{level['server_cpu_per_client'] * 1000:>9.2f}"
+          f"{level['server_rss_mb']:>8.1f}{level['server_rss_per_client_kb']:>9.1f}"
+          f"{'yes' if level['sustainable'] else 'NO':>6}")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load / latency benchmark with offline stand-ins")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--ramp", action="store_true", help="從 --clients 第一個值開始加倍，直到不可持續")
+    parser.add_argument("--max-clients", type=int, default=1600)
+    parser.add_argument("--seconds", type=float, default=4.0, help="每個 client 從 /prompt 起收多久")
+    parser.add_argument("--procs", type=int, default=min(4, os.cpu_count() or 1), help="client process 數")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--track-seconds", type=float, default=20.0)
+    parser.add_argument("--min-recv", type=float, default=0.98)
+    parser.add_argument("--max-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--no-ffmpeg", action="store_true", help="有 ffmpeg 也直接送 WAV")
+    parser.add_argument("--secure", action="store_true", help="AEAD 控制連線 + 加密音訊（/secure on）")
+    parser.add_argument("--json", help="結果寫到這個檔案（- 表示 stdout）")
+    args = parser.parse_args()
+
+    use_ffmpeg = shutil.which("ffmpeg") is not None and not args.no_ffmpeg
+    workdir = tempfile.mkdtemp(prefix="mooddj-e2e-")
+    tracks = {}
+    for mood, freq in MOODS.items():
+        tracks[mood] = os.path.join(workdir, f"{mood}.wav")
+        write_tone(tracks[mood], freq, args.track_seconds)
+
+    port = free_port()
+    os.environ["MOODDJ_PCM_CACHE"] = os.path.join(workdir, "pcm_cache")
+    ctx = multiprocessing.get_context("spawn")   # server 子 process 不繼承父 process 的狀態
+    server_proc = ctx.Process(target=run_server, args=(port, tracks, use_ffmpeg), daemon=True)
+    server_proc.start()
+    deadline = time.monotonic() + 15
+    while not _listening(port):
+        if time.monotonic() > deadline or not server_proc.is_alive():
+            sys.exit("[bench_e2e] server did not start")
+        time.sleep(0.05)
+
+    log = sys.stderr if args.json == "-" else sys.stdout
+    source = "ffmpeg (local wav, then pcm cache)" if use_ffmpeg else "wav direct (no ffmpeg)"
+    print(f"server pid {server_proc.pid} on :{port}, decoder: {source}, {args.seconds:g} s per level, "
+          f"{args.procs} client procs, {'AEAD session + sealed audio' if args.secure else 'Fernet + plaintext audio'}",
+          file=log)
+    print(f"{'clients':>8}{'first':>7}{'lat50':>8}{'lat99':>8}{'pace50':>8}{'pace99':>8}{'minrecv':>8}"
+          f"{'lost':>7}{'cpu':>8}{'cpu/cl':>9}{'rss MB':>8}{'rss/cl':>9}{'ok':>6}", file=log)
+    print(f"{'':>8}{'':>7}{'ms':>8}{'ms':>8}{'ms':>8}{'ms':>8}{'':>8}{'':>7}{'':>8}{'ms/s':>9}{'':>8}{'KB':>9}",
+          file=log)
+
+    if args.ramp:
+        levels_to_run = []
+        n = args.clients[0]
+        while n <= args.max_clients:
+            levels_to_run.append(n)
+            n *= 2
+    else:
+        levels_to_run = args.clients
+
+    levels = []
+    with contextlib.redirect_stdout(log):
+        for n in levels_to_run:
+            level = run_level(n, port, server_proc.pid, args)
+            levels.append(level)
+            print_level(level)
+            if args.ramp and not level["sustainable"]:
+                break
+    server_proc.terminate()
+    server_proc.join(5)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    sustainable = [lv["clients"] for lv in levels if lv["sustainable"]]
+    max_ok = max(sustainable, default=0)
+    print(f"max sustainable clients: {max_ok}" + (" (ramp not exhausted)" if args.ramp and
+                                                    levels[-1]["sustainable"] else ""), file=log)
+
+    report = {
+        "benchmark": "e2e",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "decoder": "ffmpeg" if use_ffmpeg else "wav",
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "levels": levels,
+        "max_sustainable_clients": max_ok,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=1, allow_nan=True)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1, allow_nan=True)
+        print(f"results written to {args.json}", file=log)
+
+
+def _listening(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+if __name__ == "__main__":
+    main()
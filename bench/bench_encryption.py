@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_encryption.py
+-----------------------------------
+加密的成本：舊的共用 key Fernet vs 每條連線 / 每個頻道的 AEAD（utils/encryptor.py）
+ - control：控制指令 / 回覆（幾十 ~ 幾百 bytes）與一個 4 KB frame，seal + open 每則幾 µs、多幾 bytes
+ - audio：一個 UDP 封包的 payload（PCM 1024 bytes / Opus ~160 bytes）加密 + 解密；
+   Fernet 那一列是「如果拿 Fernet 來加密每個 datagram」的對照（舊版音訊是明文）
+   另外換算：1 Gbit/s 的封包率下要吃掉幾顆核心
+ - sendmsg：loopback 上連送 --packets 個封包（不 pace），明文 vs 加密，量 sender 端每個封包的時間
+ - handshake：每條控制連線一次 X25519 + HKDF 的成本
+ - 正確性：seal → open 還原、竄改任何一個 byte（header 或密文）都驗不過
+
+用法：
+    python bench/bench_encryption.py
+    python bench/bench_encryption.py --packets 200000 --seconds 1
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from utils.encryptor import (ALGORITHMS, PacketOpener, PacketSealer, accept_hello, client_hello, cipher as fernet,
+                             finish_hello)
+from utils.packet import HEADER_SIZE, SEALED_VERSION, pack_header, send_packet, unpack_header
+
+PCM_PAYLOAD = 1024          # pacer.PACKET_SIZE
+OPUS_PAYLOAD = 160          # 64 kbit/s、20 ms 的 Opus frame
+GIGABIT = 1e9 / 8
+
+
+def rate(fn, seconds):
+    """fn 重複跑 seconds 秒，回傳每次的 ns"""
+    n, t0 = 0, time.perf_counter()
+    deadline = t0 + seconds
+    while True:
+        for _ in range(200):
+            fn()
+        n += 200
+        now = time.perf_counter()
+        if now >= deadline:
+            return (now - t0) / n * 1e9
+
+
+def session_pair(algorithm):
+    private, hello = client_hello(algorithm)
+    server, reply = accept_hello(hello)
+    return finish_hello(private, hello, reply), server
+
+
+def bench_control(seconds):
+    messages = {
+        "command": "#12 /prompt I feel happy today",
+        "reply": "#12 [server] Mood processed: /prompt I feel happy today\n[server] Mood: happy",
+        "4 KB": "#13 " + "x" * 4092,
+    }
+    print("control frames (seal + open per message)")
+    print(f"{'cipher':>10}{'message':>9}{'bytes':>7}{'wire':>7}{'overhead':>10}{'ns/msg':>10}{'MB/s':>9}")
+    for name in ("fernet", *ALGORITHMS):
+        if name == "fernet":
+            seal, open_ = (lambda m: fernet.encrypt(m.encode())), (lambda f: fernet.decrypt(f).decode())
+        else:
+            client, server = session_pair(name)
+            seal, open_ = client.seal, server.open
+        for label, message in messages.items():
+            wire = len(seal(message))
+            if name != "fernet":
+                client, server = session_pair(name)   # 計數重新對齊（上面試算過一則）
+                seal, open_ = client.seal, server.open
+            ns = rate(lambda: open_(seal(message)), seconds)
+            print(f"{name:>10}{label:>9}{len(message):>7}{wire:>7}{wire - len(message):>10}{ns:>10.0f}"
+                  f"{len(message) / ns * 1e3:>9.1f}")
+
+
+def bench_audio(seconds):
+    print("\naudio datagrams (seal + open per packet; Fernet = if it were used per datagram)")
+    print(f"{'cipher':>10}{'payload':>9}{'overhead':>10}{'seal ns':>9}{'open ns':>9}{'MB/s':>9}"
+          f"{'cores @1Gbit/s':>16}")
+    for size in (PCM_PAYLOAD, OPUS_PAYLOAD):
+        payload = memoryview(bytearray(os.urandom(size)))
+        header = pack_header(1234, 1, 512, version=SEALED_VERSION)
+        token = fernet.encrypt(bytes(payload))
+        rows = [("fernet", len(token) - size,
+                 rate(lambda: fernet.encrypt(bytes(payload)), seconds),
+                 rate(lambda: fernet.decrypt(token), seconds))]
+        for name in ALGORITHMS:
+            sealer = PacketSealer(algorithm=name)
+            opener = PacketOpener()
+            opener.set_key(name, sealer.key)
+            datagram = header + bytes(sealer.seal(header, payload))
+            rows.append((name, len(datagram) - HEADER_SIZE - size,
+                         rate(lambda: sealer.seal(header, payload), seconds),
+                         rate(lambda: opener.open(datagram), seconds)))
+        for name, overhead, seal_ns, open_ns in rows:
+            wire = HEADER_SIZE + size + overhead
+            # 1 Gbit/s 全部是這種封包時，每秒要 seal（server）的核心數
+            cores = GIGABIT / wire * seal_ns / 1e9
+            print(f"{name:>10}{size:>9}{overhead:>10}{seal_ns:>9.0f}{open_ns:>9.0f}"
+                  f"{size / (seal_ns + open_ns) * 1e3:>9.1f}{cores:>16.2f}")
+
+
+def bench_sendmsg(packets):
+    """loopback 連送：PacketSender 的送出路徑（header + payload 用 sendmsg），明文 vs 先 seal"""
+    print(f"\nloopback sendmsg, {packets} x {PCM_PAYLOAD}-byte packets, sender side")
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(("127.0.0.1", 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = rx.getsockname()
+    payload = memoryview(bytearray(os.urandom(PCM_PAYLOAD)))
+    results = {}
+    for name in ("plain", *ALGORITHMS):
+        sealer = PacketSealer(algorithm=name) if name != "plain" else None
+        version = SEALED_VERSION if sealer else 1
+        t0 = time.perf_counter()
+        for seq in range(packets):
+            header = pack_header(1, seq, seq * 512, version=version)
+            body = sealer.seal(header, payload) if sealer else payload
+            try:
+                send_packet(tx, header, body, target)
+            except OSError:
+                pass   # 接收端 buffer 滿（沒有人在讀）只影響 kernel，不影響 sender 的量測
+        ns = (time.perf_counter() - t0) / packets * 1e9
+        results[name] = ns
+        extra = f"  (+{ns - results['plain']:.0f} ns)" if name != "plain" else ""
+        print(f"{name:>10}{ns:>9.0f} ns/packet{PCM_PAYLOAD / ns * 1e3:>9.1f} MB/s{extra}")
+    tx.close()
+    rx.close()
+
+
+def bench_handshake(seconds):
+    ns = rate(lambda: session_pair("aes-gcm"), seconds)
+    print(f"\nhandshake (client hello + server accept + client finish, one process): {ns / 1000:.0f} µs")
+
+
+def verify():
+    """seal → open 還原；改 header / 密文 / tag 任何一個 byte 都驗不過；明文封包照舊可以解析"""
+    for name in ALGORITHMS:
+        client, server = session_pair(name)
+        assert server.open(client.seal("#1 /ping")) == "#1 /ping"
+        sealer, opener = PacketSealer(algorithm=name), PacketOpener()
+        opener.set_key(name, sealer.key)
+        payload = os.urandom(PCM_PAYLOAD)
+        header = pack_header(7, 42, 42 * 512, version=SEALED_VERSION)
+        datagram = header + bytes(sealer.seal(header, payload))
+        codec, stream_id, seq, timestamp, plain = unpack_header(opener.open(datagram))
+        assert (stream_id, seq, bytes(plain)) == (7, 42, payload)
+        for i in (2, 6, HEADER_SIZE, len(datagram) - 1):
+            tampered = bytearray(datagram)
+            tampered[i] ^= 1
+            try:
+                opener.open(tampered)
+            except ValueError:
+                continue
+            raise AssertionError(f"{name}: byte {i} tampered but packet accepted")
+        try:
+            unpack_header(datagram)
+            raise AssertionError("sealed datagram parsed as plaintext")
+        except ValueError:
+            pass
+    print("verified: round trip, tamper detection (header / ciphertext / tag), sealed packets never parsed as PCM")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fernet vs per-session AEAD: control frames and audio datagrams")
+    parser.add_argument("--seconds", type=float, default=0.3, help="每個量測跑幾秒")
+    parser.add_argument("--packets", type=int, default=100000)
+    args = parser.parse_args()
+    verify()
+    print()
+    bench_control(args.seconds)
+    bench_audio(args.seconds)
+    bench_sendmsg(args.packets)
+    bench_handshake(args.seconds)
+
+
+if __name__ == "__main__":
+    main()
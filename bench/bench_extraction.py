@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_extraction.py
+-----------------------------------
+yt-dlp 解析的負載測試（stub extractor：固定睡 --extract-ms 並計數，不連 YouTube）
+ - burst：N 個 client 同時連上真的 asyncio server，各送一個 pipelined /prompt（四種 mood 平均分配），
+   快取是冷的；量 server 實際跑了幾次 extractor、每個 prompt 的 round-trip p50 / p99 / max
+     legacy：舊版，每個 prompt 在 default executor 裡各自解析（同一個 mood 並行的請求各跑一次）
+     pool  ：music_manager 的 SingleFlight worker pool，同一個 query 同時只解析一次
+ - cancel：worker 全被慢解析佔住時，排隊中的請求的 client 斷線（task 被 cancel），
+   量排隊中的解析有多少被取消、沒有白跑；以及 --timeout 逾時的請求數
+
+用法：
+    python bench/bench_extraction.py
+    python bench/bench_extraction.py --clients 500 --extract-ms 800
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+import music_manager
+import server
+from utils.encryptor import encrypt_message, decrypt_message
+from utils.framing import encode_frame, read_frame
+
+PROMPTS = ["I feel happy today", "I am so sad", "feeling calm and relaxed", "lets party dance"]
+
+
+class StubExtractor:
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, query):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return music_manager.Track(f"http://stub/{query}", query, time.time() + 3600)
+
+
+class StubHub:
+    """不開串流的 channel_hub"""
+
+    def endpoint_for(self, unicast, group=None, port=None):
+        return unicast
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+    def unsubscribe(self, client):
+        pass
+
+
+class LegacyCache:
+    """舊版 TrackCache.get：沒命中就在呼叫端 thread 直接解析，並行的相同 query 各跑一次"""
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.entries = {}
+
+    def get(self, query):
+        track = self.entries.get(query)
+        if track is None:
+            track = self.entries[query] = self.extractor(query)
+        return track
+
+
+def install(mode, extractor):
+    if mode == "legacy":
+        cache = LegacyCache(extractor)
+
+        async def search(mood, timeout=None):
+            query = music_manager.YOUTUBE_PLAYLISTS.get(mood, music_manager.DEFAULT_QUERY)
+            loop = asyncio.get_running_loop()
+            return (await loop.run_in_executor(None, cache.get, query)).url
+        server.search_youtube_music_async = search
+    else:
+        music_manager.track_cache = music_manager.TrackCache(extractor=extractor)
+        server.search_youtube_music_async = music_manager.search_youtube_music_async
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+async def one_client(port, i, start_evt, timeout):
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return None
+    try:
+        await start_evt.wait()
+        t0 = time.perf_counter()
+        writer.write(encode_frame(encrypt_message(f"#1 /prompt {PROMPTS[i % len(PROMPTS)]}")))
+        await writer.drain()
+        reply = decrypt_message(await asyncio.wait_for(read_frame(reader), timeout))
+        return time.perf_counter() - t0 if "Mood:" in reply else None
+    except Exception:
+        return None
+    finally:
+        writer.close()
+
+
+async def run_clients(port, n, timeout):
+    start_evt = asyncio.Event()
+    tasks = [asyncio.create_task(one_client(port, i, start_evt, timeout)) for i in range(n)]
+    await asyncio.sleep(0.5 + n / 1000)   # 讓連線都建立完成
+    start_evt.set()
+    return await asyncio.gather(*tasks)
+
+
+def bench_burst(mode, n, delay, port):
+    extractor = StubExtractor(delay)
+    install(mode, extractor)
+    with contextlib.redirect_stdout(io.StringIO()):
+        rtts = asyncio.run(run_clients(port, n, timeout=60))
+        time.sleep(0.2)   # 等 server 印完斷線訊息
+    ok = [r * 1000 for r in rtts if r is not None]
+    print(f"{mode:>8}{n:>9}{len(ok):>8}{extractor.calls:>13}"
+          f"{percentile(ok, 50):>9.0f}{percentile(ok, 99):>9.0f}{max(ok, default=float('nan')):>9.0f}")
+
+
+async def cancel_scenario(workers, queued, delay, timeout):
+    """workers 個慢解析佔住 pool，再排 queued 個不同 query；一半的 client 斷線、另一半等到逾時"""
+    extractor = StubExtractor(delay)
+    cache = music_manager.TrackCache(extractor=extractor, workers=workers)
+    busy = [asyncio.create_task(cache.get_async(f"busy {i}")) for i in range(workers)]
+    await asyncio.sleep(0.05)
+    waiting = [asyncio.create_task(cache.get_async(f"queued {i}", timeout)) for i in range(queued)]
+    await asyncio.sleep(0.05)
+    for task in waiting[:queued // 2]:
+        task.cancel()                       # client 斷線：server 會 cancel 該連線的 task
+    results = await asyncio.gather(*waiting, return_exceptions=True)
+    await asyncio.gather(*busy)
+    await asyncio.sleep(delay * 2)          # 讓還沒被取消的排隊解析跑完
+    timeouts = sum(isinstance(r, asyncio.TimeoutError) for r in results)
+    return timeouts, cache.flights.stats()["cancelled"], extractor.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="yt-dlp extraction pool / single-flight load test")
+    parser.add_argument("--clients", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--extract-ms", type=float, default=800.0, help="stub extractor 的解析時間")
+    parser.add_argument("--timeout", type=float, default=0.5, help="cancel 情境的單一請求逾時（秒）")
+    args = parser.parse_args()
+    delay = args.extract_ms / 1000
+
+    port = free_port()
+    ready = threading.Event()
+    server.channel_hub = StubHub()
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=lambda: asyncio.run(server.serve("127.0.0.1", port, ready=ready,
+                                                                  heartbeat_port=None)),
+                         daemon=True).start()
+        ready.wait(5)
+
+    print(f"burst: cold cache, {len(PROMPTS)} moods, stub extraction {args.extract_ms:.0f} ms")
+    print(f"{'mode':>8}{'prompts':>9}{'served':>8}{'extractions':>13}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for n in args.clients:
+        for mode in ("legacy", "pool"):
+            bench_burst(mode, n, delay, port)
+
+    print(f"\ncancel: pool saturated, queued requests disconnect or time out after {args.timeout:g} s")
+    print(f"{'workers':>8}{'queued':>8}{'disconnected':>14}{'timeouts':>10}{'cancelled':>11}{'extractions':>13}")
+    workers, queued = music_manager.EXTRACT_WORKERS, 40
+    with contextlib.redirect_stdout(io.StringIO()):
+        timeouts, cancelled, calls = asyncio.run(cancel_scenario(workers, queued, delay, args.timeout))
+    print(f"{workers:>8}{queued:>8}{queued // 2:>14}{timeouts:>10}{cancelled:>11}{calls:>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_feedback.py
+-----------------------------------
+receiver report 的回饋迴路（server/feedback.py）：loopback 上製造掉包，看串流能不能自己恢復
+ - 同一個 process：ChannelHub（離線的合成 PCM 來源）+ liveness 的 UDP endpoint（收 receiver report）+ 一個模擬 player
+ - 中間夾一個 impairment proxy：server → player 的音訊依目前階段的機率隨機丟掉，player → server 的回報也走 proxy
+   （同樣的機率丟），所以 server 看到的回報來源位址就是頻道訂閱的 endpoint（proxy）
+ - player：跟 client/player.py 同一套（push_datagram → JitterBuffer → feed_loop → RingBuffer），音效卡換成一條
+   以即時速度讀 ring 的 thread；feed_loop 裡的 ReceiverReporter 每 --interval 秒回報
+ - 階段：乾淨 --clean 秒 → 掉包 --loss（--impaired 秒）→ 乾淨 --recover 秒；
+   adaptive（server 處理回報）與 fixed（回報只算存活，送法不變 = 舊版）各跑一次
+ - 每秒一列：網路掉包率（proxy 丟的比例）、播放掉包率（jitter buffer 補償掉的比例）、server 每秒送出的封包數、
+   補送級數、封包大小、lead
+ - 最後停掉 player（不再回報），量 server 多久之後停止對這個 endpoint 送（adaptive：--timeout 秒；fixed：一直送）
+ - verify：共用頻道裡一個 listener 掉包只替它補送、封包大小不變，多數掉包才改小封包（有遲滯）；
+   不是訂閱者送來的回報不收
+
+用法：
+    python bench/bench_feedback.py
+    python bench/bench_feedback.py --loss 0.2 --impaired 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+sys.path.append(os.path.join(ROOT, "client"))
+
+import liveness
+import player as player_module
+from audio_output import FRAMES_PER_BUFFER
+from channel_hub import Channel, ChannelHub
+from feedback import SMALL_PACKET, Feedback
+from pacer import PACKET_SIZE, SAMPLE_RATE
+from heartbeat import ReceiverReporter
+from jitter_buffer import JitterBuffer
+from player import BUFFER_SIZE, RING_BYTES, feed_loop, push_datagram
+from ring_buffer import RingBuffer
+from udp_receiver import UdpReceiver
+from utils.codec import DecoderSet
+
+player_module.STATS_INTERVAL = float("inf")   # feed_loop 每 5 秒的狀態列在這裡只是雜訊
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ToneSource:
+    """ChannelHub 用的離線來源：一段 100-sample 的 s16le 鋸齒波一直重複（不會播完）"""
+
+    PERIOD = bytes(b for i in range(100) for b in int(8000 * ((i % 100) / 50 - 1)).to_bytes(2, "little", signed=True))
+
+    def __init__(self, url, codec="pcm"):
+        self.codec = codec
+        self.offset = 0
+
+    def read(self, n):
+        n -= n % 2
+        period = self.PERIOD
+        start = self.offset % len(period)
+        out = (period[start:] + period * (n // len(period) + 1))[:n]
+        self.offset += n
+        return out
+
+    def close(self):
+        pass
+
+
+class Proxy:
+    """server ↔ player 中間的 UDP 轉送；loss 是目前的單向丟包機率（兩個方向各自擲骰）"""
+
+    def __init__(self, player_addr, report_addr, seed=1):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.2)
+        self.endpoint = self.sock.getsockname()
+        self.player_addr = player_addr
+        self.report_addr = report_addr
+        self.loss = 0.0
+        self.random = random.Random(seed)
+        self.forwarded = 0        # 音訊封包
+        self.dropped = 0
+        self.reports_dropped = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            lost = self.random.random() < self.loss
+            if addr == self.player_addr:
+                if lost:
+                    self.reports_dropped += 1
+                else:
+                    self.sock.sendto(data, self.report_addr)
+            elif lost:
+                self.dropped += 1
+            else:
+                self.forwarded += 1
+                self.sock.sendto(data, self.player_addr)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+class Player:
+    """收包 thread + feed_loop + 以即時速度讀 ring 的「音效卡」thread；回報送到 proxy，由 proxy 轉給 server"""
+
+    def __init__(self, interval):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.addr = self.sock.getsockname()
+        self.jbuf = JitterBuffer()
+        self.ring = RingBuffer(RING_BYTES)
+        self.interval = interval
+        self.stop = threading.Event()
+        self.threads = []
+
+    def start(self, proxy_endpoint):
+        self.reporter = ReceiverReporter(self.sock, proxy_endpoint[0], self.jbuf, self.ring, port=proxy_endpoint[1],
+                                         interval=self.interval)
+        for target in (self._receive, self._feed, self._output):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _receive(self):
+        receiver, decoders = UdpReceiver(self.sock, slot_size=BUFFER_SIZE), DecoderSet()
+        while not self.stop.is_set():
+            try:
+                data = receiver.recv()
+            except OSError:
+                break
+            push_datagram(data, decoders, self.jbuf)
+
+    def _feed(self):
+        feed_loop(self.jbuf, self.ring, self.stop, self.reporter)
+
+    def _output(self):
+        """音效卡的 callback：每 FRAMES_PER_BUFFER 個 sample 讀一次 ring"""
+        block = bytearray(FRAMES_PER_BUFFER * 2)
+        period = FRAMES_PER_BUFFER / SAMPLE_RATE
+        due = time.monotonic()
+        while not self.stop.is_set():
+            self.ring.read_into(block)
+            due += period
+            time.sleep(max(0.0, due - time.monotonic()))
+
+    def close(self):
+        self.stop.set()
+        self.sock.close()
+        for thread in self.threads:
+            thread.join(1)
+
+
+def run(mode, args, loop):
+    """回傳每秒一列的 timeline 與停掉 player 後 server 停送所花的時間"""
+    hub = ChannelHub(lambda mood: "tone://440", open_source=ToneSource)
+    feedback = Feedback(hub, timeout=args.timeout) if mode == "adaptive" else None
+    table = liveness.LivenessTable()
+    hb_port = free_port()
+    transport, ticker = asyncio.run_coroutine_threadsafe(
+        liveness.start(table, "127.0.0.1", hb_port, feedback), loop).result()
+
+    player = Player(args.interval)
+    proxy = Proxy(player.addr, ("127.0.0.1", hb_port), seed=args.seed)
+    player.start(proxy.endpoint)
+    channel = hub.subscribe("player", "happy", "pcm", proxy.endpoint)
+
+    phases = [(args.clean, 0.0), (args.impaired, args.loss), (args.recover, 0.0)]
+    timeline, second = [], 0
+    last = (0, 0, 0, 0)
+    for seconds, loss in phases:
+        proxy.loss = loss
+        for _ in range(int(seconds)):
+            time.sleep(1.0)
+            second += 1
+            stats = player.jbuf.stats
+            now = (proxy.forwarded, proxy.dropped, stats["lost"], stats["played"])
+            forwarded, dropped, lost, played = (a - b for a, b in zip(now, last))
+            last = now
+            sender = channel.sender
+            timeline.append({
+                "t": second,
+                "induced": loss,
+                "network_loss": dropped / max(1, forwarded + dropped),
+                "residual": lost / max(1, lost + played),
+                "packets_sent": forwarded + dropped,
+                "redundancy": max(sender.redundancy.values(), default=0) if sender else 0,
+                "packet_size": channel.queue.packet_size if channel.queue else None,
+                "lead_ms": sender.pacer.lead * 1000 if sender else 0.0,
+            })
+
+    # player 消失（不再回報）：server 多久停送
+    player.close()
+    stopped_at, sent_before = time.monotonic(), proxy.forwarded + proxy.dropped
+    deadline = stopped_at + args.timeout + 3.0
+    stop_after = None
+    while time.monotonic() < deadline:
+        time.sleep(0.1)
+        if "player" not in hub.clients:
+            stop_after = time.monotonic() - stopped_at
+            break
+    sent_after = proxy.forwarded + proxy.dropped - sent_before
+
+    hub.unsubscribe("player")
+    proxy.close()
+    loop.call_soon_threadsafe(ticker.cancel)
+    loop.call_soon_threadsafe(transport.close)
+    return {"mode": mode, "timeline": timeline, "stop_after": stop_after, "sent_after_stop": sent_after,
+            "reports": player.reporter.sent, "reports_dropped": proxy.reports_dropped,
+            "summary": feedback.summary() if feedback else None}
+
+
+def print_timeline(result):
+    print(f"\n{result['mode']}")
+    print(f"{'t':>4}{'induced':>9}{'net loss':>10}{'residual':>10}{'pkts/s':>8}{'redund':>8}{'size':>6}{'lead ms':>9}")
+    for row in result["timeline"]:
+        print(f"{row['t']:>4}{row['induced']:>9.0%}{row['network_loss']:>10.1%}{row['residual']:>10.1%}"
+              f"{row['packets_sent']:>8}{row['redundancy']:>8}{row['packet_size'] or '-':>6}{row['lead_ms']:>9.0f}")
+
+
+def phase_rows(result, args, phase):
+    start = {"clean": 0, "impaired": int(args.clean), "recover": int(args.clean + args.impaired)}[phase]
+    length = {"clean": args.clean, "impaired": args.impaired, "recover": args.recover}[phase]
+    return result["timeline"][start:start + int(length)]
+
+
+def summarize(result, args):
+    impaired = phase_rows(result, args, "impaired")
+    recover = phase_rows(result, args, "recover")
+    clean = phase_rows(result, args, "clean")
+    settle = impaired[3:] or impaired          # 前幾秒是回報 + 升級的反應時間
+    avg = lambda rows, key: sum(r[key] for r in rows) / max(1, len(rows))
+    recovered = next((r["t"] - impaired[0]["t"] + 1 for r in impaired if r["residual"] < 0.01), None)
+    adapted = any(r["redundancy"] for r in impaired)
+    relaxed = next((r["t"] - recover[0]["t"] + 1 for r in recover if r["redundancy"] == 0), None) if adapted else None
+    return {
+        "residual_impaired": avg(impaired, "residual"),
+        "residual_settled": avg(settle, "residual"),
+        "pkts_clean": avg(clean, "packets_sent"),
+        "pkts_impaired": avg(settle, "packets_sent"),
+        "recovered_s": recovered,
+        "relaxed_s": relaxed,
+    }
+
+
+def verify():
+    channel = Channel("happy", "pcm")
+    channel.sender = SimpleNamespace(redundancy={}, pacer=SimpleNamespace(lead=0.0), failures={})
+    channel.queue = SimpleNamespace(packet_size=PACKET_SIZE)
+    endpoints = [("127.0.0.1", 7000 + i) for i in range(4)]
+    for endpoint in endpoints:
+        channel.subscribers.add(endpoint)
+        channel.reporters.add(endpoint)
+    hub = SimpleNamespace(channel_for_stream={7: channel}.get, channels={}, drop_endpoint=lambda endpoint: 0)
+    feedback = Feedback(hub, clock=lambda: 0.0)
+
+    def report(endpoint, seq, received):
+        return feedback.receive(("c", 7, seq, received, 0, 0, 0.0, 100.0), endpoint)
+
+    assert report(("10.0.0.9", 7000), 0, 0) is None and report(endpoints[0], 0, 0) is not None
+    assert feedback.receive(("c", 8, 0, 0, 0, 0, 0.0, 100.0), endpoints[0]) is None
+    assert len(feedback) == 1
+    for endpoint in endpoints[1:]:
+        report(endpoint, 0, 0)
+    report(endpoints[0], 100, 50)                 # 一個 listener 掉一半
+    assert channel.sender.redundancy == {endpoints[0]: 1}, channel.sender.redundancy
+    assert channel.queue.packet_size == PACKET_SIZE
+    report(endpoints[1], 100, 50)                 # 2 / 4：還沒超過一半
+    assert channel.queue.packet_size == PACKET_SIZE
+    report(endpoints[2], 100, 50)                 # 3 / 4
+    assert channel.queue.packet_size == SMALL_PACKET
+    feedback.forget(endpoints[2])                 # 2 / 3
+    feedback.forget(endpoints[1])                 # 1 / 2：遲滯，維持小封包
+    assert channel.queue.packet_size == SMALL_PACKET
+    feedback.forget(endpoints[0])                 # 0 / 1
+    assert channel.queue.packet_size == PACKET_SIZE and channel.sender.redundancy == {}
+    print("verify: per-listener redundancy, majority packet size with hysteresis, reports only from subscribers")
+
+
+def main():
+    verify()
+    parser = argparse.ArgumentParser(description="Receiver-report feedback under induced loss on loopback")
+    parser.add_argument("--loss", type=float, default=0.1, help="掉包階段的單向丟包機率")
+    parser.add_argument("--clean", type=float, default=3)
+    parser.add_argument("--impaired", type=float, default=8)
+    parser.add_argument("--recover", type=float, default=8)
+    parser.add_argument("--interval", type=float, default=0.5, help="receiver report 間隔（秒；player 預設 1）")
+    parser.add_argument("--timeout", type=float, default=3.0, help="Feedback 的回報逾時（秒；server 預設 10）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mode", choices=["adaptive", "fixed", "both"], default="both")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    modes = ["fixed", "adaptive"] if args.mode == "both" else [args.mode]
+    results = [run(mode, args, loop) for mode in modes]
+    for result in results:
+        print_timeline(result)
+
+    print(f"\n{args.loss:.0%} induced loss for {args.impaired:g} s "
+          f"(reports every {args.interval:g} s, same drop probability on the report path)")
+    print(f"{'mode':>10}{'residual':>10}{'settled':>9}{'pkts/s clean':>14}{'pkts/s lossy':>14}"
+          f"{'<1% after':>11}{'relaxed after':>15}{'stop after':>12}")
+    for result in results:
+        s = summarize(result, args)
+        fmt = lambda v: "-" if v is None else f"{v:.0f} s"
+        stop = "never" if result["stop_after"] is None else f"{result['stop_after']:.1f} s"
+        print(f"{result['mode']:>10}{s['residual_impaired']:>10.1%}{s['residual_settled']:>9.1%}"
+              f"{s['pkts_clean']:>14.0f}{s['pkts_impaired']:>14.0f}{fmt(s['recovered_s']):>11}"
+              f"{fmt(s['relaxed_s']):>15}{stop:>12}")
+    print("residual = 播放時補償掉的封包比例；settled = 掉包開始 3 秒後；stop after = player 停止回報到 server 停送")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_framing.py
+-----------------------------------
+控制訊框吞吐量：舊版 send_large / recv_large（10-byte ASCII header、data += chunk）
+vs utils/framing.py（4-byte 長度、bytearray + recv_into）
+在 socketpair 上送 1 KB ~ 10 MB 的訊息，量接收端 MB/s。
+開始前先驗證：長度 0 的 frame 不會被當成 EOF、握手上限會擋掉大 frame。
+
+用法：
+    python bench/bench_framing.py
+    python bench/bench_framing.py --sizes 1024 1048576 --total-mb 64
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from utils.framing import (HANDSHAKE_FRAME_SIZE, FrameDecoder, FrameError, encode_frame, read_frame,
+                           recv_frame, send_frame)
+
+LEGACY_BUFFER_SIZE = 4096   # server.py 舊版傳給 recv_large 的值
+
+
+def legacy_send_large(sock, data):
+    sock.sendall(f"{len(data):<10}".encode() + data)
+
+
+def legacy_recv_large(sock, buffer_size=1024):
+    header = sock.recv(10)
+    if not header:
+        return b""
+    total_len = int(header.decode().strip())
+    data = b""
+    while len(data) < total_len:
+        chunk = sock.recv(buffer_size)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def run(mode, size, count):
+    a, b = socket.socketpair()
+    payload = os.urandom(size)
+
+    # 舊版 recv_large 會把下一則訊息的開頭讀進來（不支援 pipelining），
+    # 所以兩種模式都用「送一則、等 1-byte ack」的方式，比較才公平
+    def sender():
+        for _ in range(count):
+            if mode == "legacy":
+                legacy_send_large(a, payload)
+            else:
+                send_frame(a, payload)
+            a.recv(1)
+
+    t = threading.Thread(target=sender)
+    t0 = time.perf_counter()
+    t.start()
+    decoder = FrameDecoder()
+    for _ in range(count):
+        if mode == "legacy":
+            got = legacy_recv_large(b, LEGACY_BUFFER_SIZE)
+        else:
+            got = recv_frame(b, decoder)
+        assert len(got) == size
+        b.sendall(b"k")
+    elapsed = time.perf_counter() - t0
+    t.join()
+    a.close()
+    b.close()
+    return size * count / elapsed / 1e6, count / elapsed
+
+
+def verify():
+    """長度 0 的 frame 回傳 b""、EOF 回傳 None（blocking 與 asyncio 兩種）；超過上限丟出 FrameError"""
+    a, b = socket.socketpair()
+    send_frame(a, b"")
+    send_frame(a, b"x")
+    a.close()
+    decoder = FrameDecoder()
+    assert recv_frame(b, decoder) == b""
+    assert recv_frame(b, decoder) == b"x"
+    assert recv_frame(b, decoder) is None
+    b.close()
+
+    a, b = socket.socketpair()
+    a.sendall(encode_frame(bytes(HANDSHAKE_FRAME_SIZE + 1)))
+    try:
+        recv_frame(b, FrameDecoder(max_frame_size=HANDSHAKE_FRAME_SIZE))
+        raise AssertionError("oversized handshake frame accepted")
+    except FrameError:
+        pass
+    a.close()
+    b.close()
+
+    async def stream():
+        reader = asyncio.StreamReader()
+        reader.feed_data(encode_frame(b"") + encode_frame(bytes(HANDSHAKE_FRAME_SIZE + 1)))
+        reader.feed_eof()
+        assert await read_frame(reader, HANDSHAKE_FRAME_SIZE) == b""
+        try:
+            await read_frame(reader, HANDSHAKE_FRAME_SIZE)
+            raise AssertionError("oversized handshake frame accepted")
+        except FrameError:
+            pass
+        reader = asyncio.StreamReader()
+        reader.feed_eof()
+        assert await read_frame(reader) is None
+
+    asyncio.run(stream())
+    print("verified: empty frame != EOF, handshake frame limit enforced")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control-channel framing throughput")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1024, 16 * 1024, 256 * 1024, 1024 * 1024, 10 * 1024 * 1024])
+    parser.add_argument("--total-mb", type=float, default=64, help="每個 size 傳輸的總量")
+    parser.add_argument("--legacy-max", type=int, default=10 * 1024 * 1024,
+                        help="舊版超過這個大小只送一則（二次方成本太慢）")
+    args = parser.parse_args()
+    verify()
+    print()
+
+    print(f"{'size':>10}{'legacy MB/s':>14}{'framed MB/s':>14}{'legacy msg/s':>14}{'framed msg/s':>14}")
+    for size in args.sizes:
+        count = max(1, int(args.total_mb * 1e6 // size))
+        legacy_count = 1 if size >= args.legacy_max else count
+        l_mb, l_msg = run("legacy", size, legacy_count)
+        f_mb, f_msg = run("framed", size, count)
+        print(f"{size:>10}{l_mb:>14.1f}{f_mb:>14.1f}{l_msg:>14.1f}{f_msg:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_gapless.py
+-----------------------------------
+換歌時的空檔：舊版頻道（每首播完才 resolve + 開解碼器、每首新的 stream id）vs play_queue（預取、無縫接軌）
+ - 本機產生 --tracks 個 WAV（不同音高）；resolve 跟 track cache 一樣永遠回傳第一首，
+   第 n 首由 resolve_next(mood, n) 給（依序輪流）
+ - 開始前先驗證：play_queue 預取的下一首跟正在播的不是同一首，換歌時關上一首（--close-ms）不會卡住送封包
+ - 離線替身：resolve 睡 --resolve-ms（yt-dlp / track cache），開解碼器睡 --startup-ms（ffmpeg 啟動到第一個 byte），
+   關來源睡 --close-ms（結束 ffmpeg + commit 快取）；
+   --ffmpeg 且有裝 ffmpeg 時改用真的 streamer.TrackSource 轉碼本機檔（快取放暫存目錄）
+ - 接收端在同一個 process 的 thread 裡收 UDP，記錄到達時間 / stream id / seq / payload
+ - 量每個換歌點的空檔：換歌後第一個封包的到達時間 − 前一個封包 − 一個封包的理想間隔（11.6 ms）
+   stream id 換了的次數（client 的 jitter buffer 每次都會丟掉緩衝、重新 prefill ≥ 40 ms，另外再加上空檔）
+ - exact：收到的 PCM 串起來是否跟各首 WAV 依序串起來一模一樣（sample 邊界接軌、沒有插入靜音）；
+   crossfade 時跟「各接點用 play_queue.crossfade 混好」的預期結果比
+
+用法：
+    python bench/bench_gapless.py
+    python bench/bench_gapless.py --tracks 5 --track-seconds 1.5 --crossfade-ms 50
+"""
+import argparse
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+from bench_e2e import write_tone
+from pacer import Pacer, PACKET_SIZE, SAMPLE_RATE
+from streamer import PacketSender, StreamStopped, send_source
+from play_queue import PlayQueue
+from utils.packet import unpack_header
+
+PACKET_INTERVAL = PACKET_SIZE / (SAMPLE_RATE * 2)
+TONES = [440, 494, 523, 587, 659, 698, 784]
+
+
+class DelayedWav:
+    """TrackSource 替身：開檔前先睡 startup 秒（ffmpeg 啟動 + 第一個 byte），close 睡 close_cost 秒"""
+
+    startup = 0.0
+    close_cost = 0.1
+
+    def __init__(self, url, codec="pcm"):
+        time.sleep(self.startup)
+        self.codec = codec
+        self.wav = wave.open(url, "rb")
+
+    def duration(self):
+        return self.wav.getnframes() / SAMPLE_RATE
+
+    def read(self, n):
+        return self.wav.readframes(n // 2)
+
+    def close(self):
+        time.sleep(self.close_cost)
+        self.wav.close()
+
+
+class Resolver:
+    """music_manager 替身：resolve(mood) 是快取裡的第一個結果，next(mood, n) 是第 n 個"""
+
+    def __init__(self, paths, delay):
+        self.paths = paths
+        self.delay = delay
+
+    def __call__(self, mood):
+        time.sleep(self.delay)
+        return self.paths[0]
+
+    def next(self, mood, index):
+        time.sleep(self.delay)
+        return self.paths[(index - 1) % len(self.paths)]
+
+
+class Receiver:
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.2)
+        self.packets = []          # (到達時間, stream id, seq, payload)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                continue
+            now = time.perf_counter()
+            _, stream_id, seq, _, payload = unpack_header(data)
+            self.packets.append((now, stream_id, seq, bytes(payload)))
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+def legacy_channel(sender_sock, target, resolve, open_source, stop, tracks):
+    """舊版 ChannelHub._run：每首播完才 resolve、開解碼器，每首新的 PacketSender（新 stream id、新 Pacer）"""
+    for i in range(tracks):
+        url = resolve.next("happy", i + 1)
+        sender = PacketSender(sender_sock, target, Pacer(), stop=stop)
+        source = open_source(url)
+        try:
+            send_source(sender, source, PACKET_SIZE)
+        finally:
+            source.close()
+
+
+def queue_channel(sender_sock, target, resolve, open_source, stop, tracks, crossfade_ms):
+    queue = PlayQueue(resolve, "happy", "pcm", crossfade_ms, open_source=open_source, resolve_next=resolve.next)
+    sender = PacketSender(sender_sock, target, Pacer(), stop=stop)
+
+    def watch():
+        # 第 tracks 首播完（第 tracks + 1 首開始）就停
+        while queue.tracks <= tracks and not stop.is_set():
+            time.sleep(0.005)
+        stop.set()
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        queue.play(sender)
+    except StreamStopped:
+        pass
+    return queue
+
+
+def expected_pcm(tracks, fade):
+    """各首依序串起來；fade > 0 時每個接點用 play_queue.crossfade 混合"""
+    if not fade:
+        return b"".join(tracks)
+    from play_queue import crossfade
+    out = bytearray(tracks[0])
+    for track in tracks[1:]:
+        out[-fade:] = crossfade(out[-fade:], track[:fade])
+        out += track[fade:]
+    return bytes(out)
+
+
+def run(mode, paths, pcm, args, open_source):
+    receiver = Receiver()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = receiver.sock.getsockname()
+    resolve = Resolver(paths, args.resolve_ms / 1000)
+    stop = threading.Event()
+    t0 = time.perf_counter()
+    if mode == "legacy":
+        legacy_channel(sock, target, resolve, open_source, stop, args.tracks)
+    else:
+        crossfade = args.crossfade_ms if mode == "crossfade" else 0
+        queue_channel(sock, target, resolve, open_source, stop, args.tracks, crossfade)
+    wall = time.perf_counter() - t0
+    time.sleep(0.1)
+    receiver.close()
+    sock.close()
+
+    packets = receiver.packets
+    resets = len({p[1] for p in packets}) - 1
+    received = b"".join(p[3] for p in packets)
+    fade = int(args.crossfade_ms / 1000 * SAMPLE_RATE) * 2 if mode == "crossfade" else 0
+    expected = expected_pcm([pcm[i % len(pcm)] for i in range(args.tracks)], fade)
+
+    # 換歌點：legacy 看 stream id 換掉的地方；queue 看輸出位置跨過各首結尾（減 crossfade）的封包附近
+    if mode == "legacy":
+        boundaries = [i for i in range(1, len(packets)) if packets[i][1] != packets[i - 1][1]]
+    else:
+        starts, offset = [], 0
+        for p in packets:
+            starts.append(offset)
+            offset += len(p[3])
+        boundaries, cut = [], 0
+        for i in range(args.tracks - 1):
+            cut += len(pcm[i % len(pcm)]) - fade
+            near = [j for j in range(1, len(packets)) if abs(starts[j] - cut) <= 2 * PACKET_SIZE]
+            if near:
+                boundaries.append(max(near, key=lambda j: packets[j][0] - packets[j - 1][0]))
+    gaps = [(packets[i][0] - packets[i - 1][0] - PACKET_INTERVAL) * 1000 for i in boundaries]
+    # queue 停下時最後不滿一個封包（+ crossfade 尾巴）還在 pending 裡等下一首，不算缺
+    n = min(len(received), len(expected))
+    exact = received[:n] == expected[:n] and n >= len(expected) - PACKET_SIZE - fade
+    return {"gaps": gaps, "resets": resets, "exact": exact, "wall": wall,
+            "audio": len(received) / (SAMPLE_RATE * 2)}
+
+
+class Sink:
+    """PacketSender 替身：不送、不 pace，收到 limit bytes 就停；記下兩次 send 之間最長的空檔"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.sent = 0
+        self.last = None
+        self.max_stall = 0.0
+
+    def send(self, chunk):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.max_stall = max(self.max_stall, now - self.last)
+        self.last = now
+        self.sent += len(chunk)
+        if self.sent >= self.limit:
+            raise StreamStopped()
+
+
+def verify(paths, pcm):
+    """resolve 永遠回傳同一首（快取）時，頻道換歌仍然往下一首播，而不是一直重播同一首；
+    關上一首（close_cost）不卡住送封包的 thread"""
+    opened = []
+
+    def open_source(url, codec="pcm"):
+        opened.append(url)
+        return DelayedWav(url, codec)
+
+    startup, DelayedWav.startup = DelayedWav.startup, 0.0
+    queue = PlayQueue(Resolver(paths, 0), "happy", "pcm", open_source=open_source, resolve_next=Resolver(paths, 0).next)
+    sink = Sink(sum(len(p) for p in pcm) * 2)
+    try:
+        queue.play(sink)
+    except StreamStopped:
+        pass
+    DelayedWav.startup = startup
+    assert sink.max_stall < DelayedWav.close_cost / 2, f"send stalled {sink.max_stall * 1000:.0f} ms at a track switch"
+    assert len(opened) > len(paths), opened
+    assert all(a != b for a, b in zip(opened, opened[1:])), opened
+    assert opened[:len(paths)] == paths, opened
+    print(f"verified: {len(opened)} tracks opened, each prefetched URL differs from the one playing, "
+          f"longest send stall {sink.max_stall * 1000:.1f} ms with {DelayedWav.close_cost * 1000:g} ms close")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gap between tracks: legacy channel vs gapless play queue")
+    parser.add_argument("--tracks", type=int, default=4)
+    parser.add_argument("--track-seconds", type=float, default=2.0)
+    parser.add_argument("--resolve-ms", type=float, default=150.0, help="resolve 的延遲（track cache 命中約 0）")
+    parser.add_argument("--startup-ms", type=float, default=300.0, help="開解碼器到第一個 byte 的延遲")
+    parser.add_argument("--crossfade-ms", type=float, default=50.0)
+    parser.add_argument("--close-ms", type=float, default=100.0, help="關來源的成本（結束 ffmpeg + commit 快取）")
+    parser.add_argument("--ffmpeg", action="store_true", help="用真的 ffmpeg 轉碼本機 WAV（需要有裝）")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="mooddj-gapless-")
+    paths, pcm = [], []
+    for i in range(args.tracks):
+        path = os.path.join(workdir, f"track{i}.wav")
+        write_tone(path, TONES[i % len(TONES)], args.track_seconds)
+        with wave.open(path, "rb") as w:
+            pcm.append(w.readframes(w.getnframes()))
+        paths.append(path)
+
+    DelayedWav.close_cost = args.close_ms / 1000
+    verify(paths, pcm)
+    if args.ffmpeg and shutil.which("ffmpeg"):
+        os.environ["MOODDJ_PCM_CACHE"] = os.path.join(workdir, "pcm_cache")
+        from streamer import TrackSource
+        open_source, source_name = TrackSource, "ffmpeg"
+    else:
+        DelayedWav.startup = args.startup_ms / 1000
+        open_source, source_name = DelayedWav, f"wav + {args.startup_ms:g} ms startup"
+
+    print(f"{args.tracks} tracks x {args.track_seconds:g} s, resolve {args.resolve_ms:g} ms, decoder: {source_name}")
+    print(f"{'mode':>10}{'switches':>10}{'gap avg ms':>12}{'gap max ms':>12}{'resets':>8}{'exact':>7}"
+          f"{'audio s':>9}{'wall s':>8}")
+    for mode in ("legacy", "gapless", "crossfade"):
+        r = run(mode, paths, pcm, args, open_source)
+        gaps = r["gaps"] or [float("nan")]
+        print(f"{mode:>10}{len(r['gaps']):>10}{sum(gaps) / len(gaps):>12.1f}{max(gaps):>12.1f}"
+              f"{r['resets']:>8}{'yes' if r['exact'] else 'NO':>7}{r['audio']:>9.2f}{r['wall']:>8.2f}")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
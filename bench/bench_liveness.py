@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_liveness.py
+-----------------------------------
+存活追蹤負載測試
+ - table：模擬時鐘下 N 個 client 每 5 秒 ping 一次、部分 client 中途斷線，
+   量 touch 成本、每個 tick 的成本，並檢查到期是否正確（死的都在 timeout + tick 內清掉、活的沒被誤殺）
+ - udp：真的開 server 的 UDP ping endpoint，用少數幾個 socket 模擬 N 個 client 送 ping，
+   量 pong 回收率、RTT p50 / p99，以及 server 存活表的大小
+ - legacy：舊版 5690 TCP 心跳（一條連線一個 thread），N 條連線各 ping 一次，量 RTT 與 thread 數
+ - verify：不是頻道訂閱者送來的 receiver report 不會讓 client 算活著，也不會記成它的 endpoint
+
+用法：
+    python bench/bench_liveness.py
+    python bench/bench_liveness.py --clients 10000 50000 --udp-clients 10000 --legacy-clients 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+import liveness
+from channel_hub import Channel
+from feedback import Feedback
+from utils import heartbeat
+
+INTERVAL = 5.0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+# ------------------------------------------------------------
+# table：模擬時鐘
+# ------------------------------------------------------------
+def bench_table(n, duration=60.0, die_at=20.0, dead_ratio=0.1):
+    now = [0.0]
+    table = liveness.LivenessTable(clock=lambda: now[0])
+    rng = random.Random(1)
+    # 每個 client 的下一次 ping 時間；死掉的 client 在 die_at 之後不再 ping
+    next_ping = {i: rng.uniform(0, INTERVAL) for i in range(n)}
+    dead = set(rng.sample(range(n), int(n * dead_ratio)))
+    death_time = {}
+    touch_s = 0.0
+    touches = 0
+    tick_ms = []
+    wrong = late = 0
+
+    t = 0.0
+    while t < duration:
+        t += table.tick_seconds
+        due = [(ts, i) for i, ts in next_ping.items() if ts <= t]
+        due.sort()
+        t0 = time.perf_counter()
+        for ts, i in due:
+            now[0] = ts
+            table.touch(i, rtt_ms=20)
+            touches += 1
+            if i in dead and ts + INTERVAL > die_at:
+                death_time[i] = ts
+                del next_ping[i]
+            else:
+                next_ping[i] = ts + INTERVAL + rng.uniform(-0.5, 0.5)
+        touch_s += time.perf_counter() - t0
+
+        now[0] = t
+        t0 = time.perf_counter()
+        expired = table.tick()
+        tick_ms.append((time.perf_counter() - t0) * 1000)
+        for state in expired:
+            i = state.client_id
+            if i not in death_time:
+                wrong += 1                      # 活著的被誤判到期
+            elif t - death_time[i] > table.timeout + 2 * table.tick_seconds:
+                late += 1                       # 太晚才清掉
+    missed = sum(1 for i, ts in death_time.items()
+                 if duration - ts > table.timeout + 2 * table.tick_seconds and table.get(i) is not None)
+    return {
+        "clients": n,
+        "touch_us": touch_s / max(touches, 1) * 1e6,
+        "tick_p99_ms": percentile(tick_ms, 99),
+        "tick_max_ms": max(tick_ms),
+        "alive": len(table),
+        "expired": table.expired_total,
+        "wrong": wrong,
+        "late": late,
+        "missed": missed,
+    }
+
+
+# ------------------------------------------------------------
+# udp：真的 server endpoint
+# ------------------------------------------------------------
+def start_udp_server(table, port):
+    ready = threading.Event()
+
+    async def run():
+        await liveness.start(table, "127.0.0.1", port)
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=asyncio.run, args=(run(),), daemon=True).start()
+    ready.wait(5)
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_udp(n, rounds, interval, senders=8):
+    table = liveness.LivenessTable(timeout=3600)   # 測的是 ping 路徑，不要在 bench 期間到期
+    port = free_udp_port()
+    start_udp_server(table, port)
+    socks = []
+    for _ in range(senders):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        s.settimeout(0.2)
+        socks.append(s)
+    rtts = []
+    sent = received = 0
+    threads0 = threading.active_count()
+
+    def receiver(sock, stop):
+        nonlocal received
+        while not stop.is_set():
+            try:
+                data = sock.recv(64)
+            except socket.timeout:
+                continue
+            _, _, _, ts, _ = heartbeat.unpack(data)
+            rtts.append((time.monotonic() - ts) * 1000)
+            received += 1
+
+    stop = threading.Event()
+    workers = [threading.Thread(target=receiver, args=(s, stop), daemon=True) for s in socks]
+    for w in workers:
+        w.start()
+
+    for r in range(rounds):
+        t0 = time.monotonic()
+        # 每一輪把 n 個 ping 平均撒在 interval 內
+        for i in range(n):
+            socks[i % senders].sendto(heartbeat.pack(heartbeat.PING, i, r, time.monotonic()), ("127.0.0.1", port))
+            sent += 1
+            if i % 200 == 199:
+                lag = t0 + interval * (i + 1) / n - time.monotonic()
+                if lag > 0:
+                    time.sleep(lag)
+        time.sleep(max(0.0, t0 + interval - time.monotonic()))
+    time.sleep(0.5)
+    stop.set()
+    for w in workers:
+        w.join()
+    return {
+        "clients": n,
+        "sent": sent,
+        "pong_pct": received / max(sent, 1) * 100,
+        "rtt_p50_ms": percentile(rtts, 50),
+        "rtt_p99_ms": percentile(rtts, 99),
+        "table": len(table),
+        "server_threads": 1,   # 整個 liveness 跑在 server 既有的 event loop thread 上
+        "client_threads": threading.active_count() - threads0,
+    }
+
+
+# ------------------------------------------------------------
+# legacy：舊版 TCP 心跳（baseline 的 heartbeat_server / handle_heartbeat）
+# ------------------------------------------------------------
+def legacy_handle_heartbeat(conn, addr):
+    conn.setblocking(True)
+    try:
+        while True:
+            data = conn.recv(32)
+            if not data:
+                break
+            if data.decode(errors="replace").strip() == "ping":
+                conn.sendall(b"pong")
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        conn.close()
+
+
+def legacy_heartbeat_server(hb_sock):
+    while True:
+        try:
+            conn, addr = hb_sock.accept()
+            threading.Thread(target=legacy_handle_heartbeat, args=(conn, addr), daemon=True).start()
+        except BlockingIOError:
+            time.sleep(0.3)
+
+
+def bench_legacy(n):
+    hb_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    hb_sock.bind(("127.0.0.1", 0))
+    hb_sock.listen(5)
+    hb_sock.setblocking(False)
+    port = hb_sock.getsockname()[1]
+    threads0 = threading.active_count()
+    threading.Thread(target=legacy_heartbeat_server, args=(hb_sock,), daemon=True).start()
+    conns = []
+    t0 = time.perf_counter()
+    for _ in range(n):
+        try:
+            c = socket.create_connection(("127.0.0.1", port), timeout=5)
+            conns.append(c)
+        except OSError:
+            break
+    connect_s = time.perf_counter() - t0
+    time.sleep(1.0)   # 等 accept 迴圈把連線收完
+    rtts = []
+    for c in conns:
+        t = time.perf_counter()
+        try:
+            c.sendall(b"ping")
+            if c.recv(32):
+                rtts.append((time.perf_counter() - t) * 1000)
+        except OSError:
+            pass
+    threads = threading.active_count() - threads0
+    for c in conns:
+        c.close()
+    hb_sock.close()
+    return {"clients": n, "connected": len(conns), "answered": len(rtts), "connect_s": connect_s,
+            "rtt_p50_ms": percentile(rtts, 50), "rtt_p99_ms": percentile(rtts, 99), "server_threads": threads}
+
+
+def verify():
+    channel = Channel("happy", "pcm")
+    channel.sender = SimpleNamespace(redundancy={}, pacer=SimpleNamespace(lead=0.0), failures={})
+    subscriber, stranger = ("127.0.0.1", 7000), ("10.0.0.9", 7000)
+    channel.subscribers.add(subscriber)
+    channel.reporters.add(subscriber)
+    hub = SimpleNamespace(channel_for_stream={7: channel}.get, channels={}, drop_endpoint=lambda endpoint: 0)
+    table = liveness.LivenessTable()
+    protocol = liveness.PingProtocol(table, Feedback(hub))
+    protocol.datagram_received(heartbeat.pack_report(41, 7, 0, 0, 0, 0, 0.0, 100.0), stranger)
+    assert table.get(41) is None and len(table) == 0
+    protocol.datagram_received(heartbeat.pack_report(42, 7, 0, 0, 0, 0, 0.0, 100.0), subscriber)
+    assert table.get(42) is not None and table.get(42).endpoint == subscriber
+    protocol.datagram_received(heartbeat.pack_report(42, 7, 0, 0, 0, 0, 0.0, 100.0), stranger)
+    assert table.get(42).endpoint == subscriber
+    print("verify: receiver reports count as liveness only from the channel's subscribers")
+
+
+def main():
+    verify()
+    parser = argparse.ArgumentParser(description="Liveness tracking load test")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10000, 50000], help="table 模擬的 client 數")
+    parser.add_argument("--udp-clients", type=int, default=10000)
+    parser.add_argument("--udp-rounds", type=int, default=3)
+    parser.add_argument("--udp-interval", type=float, default=1.0, help="udp 模式每輪秒數（壓縮過的 ping 週期）")
+    parser.add_argument("--legacy-clients", type=int, default=300, help="舊版 accept 每 0.3 秒輪詢一次，1000 條要數分鐘")
+    args = parser.parse_args()
+
+    print("== table (simulated clock, 60 s, 10% die at t=20 s) ==")
+    print(f"{'clients':>8}{'touch us':>10}{'tick p99 ms':>13}{'tick max ms':>13}{'alive':>8}"
+          f"{'expired':>9}{'wrong':>7}{'late':>6}{'missed':>8}")
+    for n in args.clients:
+        r = bench_table(n)
+        print(f"{r['clients']:>8}{r['touch_us']:>10.2f}{r['tick_p99_ms']:>13.3f}{r['tick_max_ms']:>13.3f}"
+              f"{r['alive']:>8}{r['expired']:>9}{r['wrong']:>7}{r['late']:>6}{r['missed']:>8}")
+
+    if args.udp_clients:
+        print("\n== udp ping endpoint ==")
+        r = bench_udp(args.udp_clients, args.udp_rounds, args.udp_interval)
+        print(f"{'clients':>8}{'sent':>9}{'pong %':>9}{'rtt p50 ms':>12}{'rtt p99 ms':>12}{'table':>8}{'srv threads':>13}")
+        print(f"{r['clients']:>8}{r['sent']:>9}{r['pong_pct']:>9.2f}{r['rtt_p50_ms']:>12.2f}"
+              f"{r['rtt_p99_ms']:>12.2f}{r['table']:>8}{r['server_threads']:>13}")
+
+    if args.legacy_clients:
+        print("\n== legacy TCP heartbeat (thread per connection) ==")
+        r = bench_legacy(args.legacy_clients)
+        print(f"{'clients':>8}{'connected':>11}{'answered':>10}{'connect s':>11}{'rtt p50 ms':>12}"
+              f"{'rtt p99 ms':>12}{'srv threads':>13}")
+        print(f"{r['clients']:>8}{r['connected']:>11}{r['answered']:>10}{r['connect_s']:>11.2f}"
+              f"{r['rtt_p50_ms']:>12.2f}{r['rtt_p99_ms']:>12.2f}{r['server_threads']:>13}")
+
+
+if __name__ == "__main__":
+    main()
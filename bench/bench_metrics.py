@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_metrics.py
+-----------------------------------
+metrics 的熱路徑成本 vs 舊版每個封包 print 一行
+ - 收包迴圈的替身：--packets 次 unpack_header，分別
+     none   ：什麼都不做（基準）
+     print  ：舊版 player，每個封包 print 一行（stdout 換成 line-buffered 的暫存檔，
+              跟終端機 / journal 一樣每行一次 write；不含終端機本身渲染的成本）
+     metrics：Counter.inc 兩次（server 每個封包的記錄量：封包數、bytes）
+     observe：再加一次 Histogram.observe（只在每首第一個封包 / 每個請求做，這裡當上限）
+     sampled：錯誤路徑的 log_sampled（同一個 key，5 秒內只印一次）
+ - scrape：註冊 server + client 規模的 metric 後，render_text / snapshot 一次的耗時
+ - endpoint：serve() 開在隨機 port 上，實際 GET /metrics 一次確認輸出
+ - verify：log_sampled 的 key 帶 endpoint（每個 sendto 目的地一個）時，記錄的 key 數不會跟著見過的 endpoint 一直長
+
+用法：
+    python bench/bench_metrics.py
+    python bench/bench_metrics.py --packets 200000
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from utils import metrics
+from utils.packet import pack_header, unpack_header
+
+DATAGRAM = pack_header(1, 1234, 567890) + bytes(1024)
+
+
+def loop_none(n, registry):
+    for _ in range(n):
+        unpack_header(DATAGRAM)
+
+
+def loop_print(n, registry):
+    with tempfile.TemporaryFile("w", buffering=1) as log, contextlib.redirect_stdout(log):
+        for _ in range(n):
+            _, _, seq, _, payload = unpack_header(DATAGRAM)
+            print(f"[player] Received {len(payload)} bytes (seq {seq})")
+
+
+def loop_metrics(n, registry):
+    packets = registry.counter("bench_packets_total")
+    size = registry.counter("bench_bytes_total")
+    for _ in range(n):
+        _, _, seq, _, payload = unpack_header(DATAGRAM)
+        packets.inc()
+        size.inc(len(payload))
+
+
+def loop_observe(n, registry):
+    packets = registry.counter("bench_packets_total")
+    size = registry.counter("bench_bytes_total")
+    latency = registry.histogram("bench_latency_seconds")
+    for i in range(n):
+        _, _, seq, _, payload = unpack_header(DATAGRAM)
+        packets.inc()
+        size.inc(len(payload))
+        latency.observe(i * 1e-7)
+
+
+def loop_sampled(n, registry):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(n):
+            _, _, seq, _, payload = unpack_header(DATAGRAM)
+            metrics.log_sampled("bench", f"[player] Decode failed (seq {seq})")
+
+
+def per_packet(fn, n):
+    registry = metrics.Registry()
+    t0 = time.perf_counter()
+    fn(n, registry)
+    return (time.perf_counter() - t0) / n
+
+
+def populate(registry):
+    """大約 server + player 的 metric 數量：20 個 counter、6 個 histogram、20 個 gauge"""
+    for i in range(20):
+        registry.counter(f"bench_counter_{i}_total", "counter").inc(i)
+    for i in range(6):
+        hist = registry.histogram(f"bench_hist_{i}_seconds", "histogram")
+        for k in range(1000):
+            hist.observe(k * 1e-4)
+    for i in range(20):
+        registry.gauge(f"bench_gauge_{i}", lambda i=i: i * 2, "gauge")
+
+
+def verify():
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for port in range(20 * metrics.SAMPLED_MAX):
+            metrics.log_sampled(("sendto", ("127.0.0.1", port)), "[streamer] OSError during sendto", interval=0)
+        assert len(metrics._sampled) <= 2 * metrics.SAMPLED_MAX, len(metrics._sampled)
+        assert metrics.log_sampled("verify", "first") and not metrics.log_sampled("verify", "second")
+    print(f"verify: {20 * metrics.SAMPLED_MAX} sampled keys seen, {len(metrics._sampled)} kept")
+
+
+def main():
+    verify()
+    parser = argparse.ArgumentParser(description="Per-packet cost of metrics vs printing")
+    parser.add_argument("--packets", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{args.packets} packets, per-packet cost")
+    print(f"{'mode':>9}{'ns/pkt':>10}{'overhead':>11}")
+    base = per_packet(loop_none, args.packets)
+    for name, fn in (("none", loop_none), ("print", loop_print),
+                     ("metrics", loop_metrics), ("observe", loop_observe), ("sampled", loop_sampled)):
+        cost = base if fn is loop_none else per_packet(fn, args.packets)
+        print(f"{name:>9}{cost * 1e9:>10.0f}{(cost - base) * 1e9:>11.0f}")
+
+    registry = metrics.Registry()
+    populate(registry)
+    runs = 200
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        text = registry.render_text()
+    render = (time.perf_counter() - t0) / runs
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        registry.snapshot()
+    snap = (time.perf_counter() - t0) / runs
+    print(f"\nscrape: {len(registry.metrics)} metrics, {len(text)} bytes of text")
+    print(f"render_text {render * 1000:.2f} ms, snapshot {snap * 1000:.2f} ms")
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        httpd = metrics.serve(0, registry=registry)
+    if httpd is None:
+        print("endpoint: unavailable")
+        return
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/metrics"
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=5) as resp:
+        body = resp.read().decode()
+    elapsed = time.perf_counter() - t0
+    httpd.shutdown()
+    samples = [line for line in body.splitlines() if line and not line.startswith("#")]
+    print(f"endpoint: GET /metrics {resp.status}, {len(samples)} samples in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
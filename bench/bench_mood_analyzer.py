@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_mood_analyzer.py
+-----------------------------------
+心情分類基準：舊版四次 any(k in prompt) 子字串掃描 vs 編譯索引的 MoodClassifier
+ - 單一 prompt 延遲（µs / prompt）
+ - 批次吞吐量：逐一 analyze_text vs analyze_many 一次處理 N 個 prompt（預設 100k）
+ - 開始前先驗證 analyze_many 與逐一 analyze_text 結果相同（含標點、空字串、帶分隔字元的 prompt、
+   多個 thread 同時查、快取換新）
+
+用法：
+    python bench/bench_mood_analyzer.py --count 100000
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "server"))
+
+import mood_analyzer
+from mood_analyzer import analyze_text, analyze_many
+
+WORDS = ("i feel so today tonight with my friends after work the music something need want "
+         "really very a bit kind of sad lonely tired crying down happy excited love good "
+         "relaxing calm focus quiet party energetic running dance goodbye downtown sadly").split()
+
+
+def legacy_analyze_text(prompt: str) -> str:
+    prompt = (prompt or "").lower()
+    if any(k in prompt for k in ["sad", "lonely", "tired", "cry", "down"]):
+        return "sad"
+    if any(k in prompt for k in ["happy", "excited", "love", "good"]):
+        return "happy"
+    if any(k in prompt for k in ["relax", "calm", "focus", "quiet"]):
+        return "calm"
+    if any(k in prompt for k in ["party", "energetic", "run", "dance"]):
+        return "energetic"
+    return "calm"
+
+
+def make_prompts(n, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 15))) for _ in range(n)]
+
+
+def per_prompt_us(fn, prompts):
+    t0 = time.perf_counter()
+    for p in prompts:
+        fn(p)
+    return (time.perf_counter() - t0) / len(prompts) * 1e6
+
+
+def verify(prompts):
+    """analyze_many 與逐一 analyze_text 一致；快取上限很小（一直換新）時多個 thread 同時跑也一致"""
+    edge = ["", None, "Good!", "sad,tired but dancing", "so \x00 happy", "\x00", "crying running loved dances"]
+    expected = [analyze_text(p) for p in edge + prompts]
+    assert analyze_many(edge + prompts) == expected
+    assert analyze_many([]) == []
+
+    limit, mood_analyzer.TOKEN_CACHE_MAX = mood_analyzer.TOKEN_CACHE_MAX, 50
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(200):
+            batch = [p + f" w{rng.randrange(10 ** 6)}" for p in rng.sample(prompts, 20)]
+            if analyze_many(batch) != [analyze_text(p) for p in batch]:
+                errors.append(seed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    mood_analyzer.TOKEN_CACHE_MAX = limit
+    assert not errors, f"batch / single disagree under concurrent cache swaps: {errors}"
+    print("verified: analyze_many == analyze_text per prompt (edge cases, 4 threads with cache swaps)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mood classifier latency / batch throughput")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    prompts = make_prompts(args.count)
+    single = prompts[:10000]
+    analyze_text("warm up")
+    verify(prompts[:2000])
+
+    print(f"single prompt  legacy : {per_prompt_us(legacy_analyze_text, single):8.2f} µs")
+    print(f"single prompt  index  : {per_prompt_us(analyze_text, single):8.2f} µs")
+
+    t0 = time.perf_counter()
+    [legacy_analyze_text(p) for p in prompts]
+    legacy_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    [analyze_text(p) for p in prompts]
+    loop_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    results = analyze_many(prompts)
+    batch_s = time.perf_counter() - t0
+    print(f"batch {args.count}  legacy       : {args.count / legacy_s:10.0f} prompts/s")
+    print(f"batch {args.count}  analyze_text : {args.count / loop_s:10.0f} prompts/s")
+    print(f"batch {args.count}  analyze_many : {args.count / batch_s:10.0f} prompts/s")
+
+    changed = sum(1 for p, r in zip(prompts, results) if legacy_analyze_text(p) != r)
+    print(f"labels differing from legacy: {changed / len(prompts):.1%} (substring false positives, weighting)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_multicast.py
+-----------------------------------
+單機 multicast vs unicast：server 服務 N 個 listener 的傳送成本
+ - unicast：每個封包送 N 次（N 個 listener 各綁一個 port）
+ - multicast：每個封包只送一次到 mood 的 group（IP_MULTICAST_LOOP 讓本機 N 個 listener 都收到）
+送 --packets 個 1024-byte PCM 封包（不 pacing，量 sender 的極限），量：
+ - sender 的 sendto 次數、送出 bytes、CPU 時間
+ - 每個 listener 收到的比例（kernel buffer 足夠大時應為 100%）
+
+用法：
+    python bench/bench_multicast.py
+    python bench/bench_multicast.py --listeners 1 10 50 --packets 500
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+from streamer import open_stream_socket
+from utils import multicast
+from utils.packet import pack_header
+
+PAYLOAD = bytes(1024)
+PORT = 5790
+RCVBUF = 4 * 1024 * 1024
+
+
+def drain(sock):
+    count = 0
+    sock.setblocking(False)
+    while True:
+        try:
+            sock.recv(2048)
+        except BlockingIOError:
+            return count
+        count += 1
+
+
+def run(mode, n, packets, group):
+    if mode == "multicast":
+        listeners = [multicast.open_listener(group, PORT) for _ in range(n)]
+        sock, target = open_stream_socket("127.0.0.1", PORT, group)
+        targets = [target]
+    else:
+        listeners = []
+        for _ in range(n):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind(("127.0.0.1", 0))
+            listeners.append(s)
+        sock, _ = open_stream_socket("127.0.0.1", PORT)
+        targets = [s.getsockname() for s in listeners]
+    for s in listeners:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
+
+    calls = sent = 0
+    cpu0 = time.process_time()
+    for seq in range(packets):
+        datagram = pack_header(1, seq, seq * 512) + PAYLOAD
+        for target in targets:
+            sent += sock.sendto(datagram, target)
+            calls += 1
+    cpu = time.process_time() - cpu0
+    time.sleep(0.2)
+    received = [drain(s) for s in listeners]
+    for s in listeners:
+        s.close()
+    sock.close()
+    return calls, sent, cpu, min(received) / packets, sum(received) / (n * packets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multicast vs unicast fan-out on one box")
+    parser.add_argument("--listeners", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--packets", type=int, default=500)
+    parser.add_argument("--mood", default="happy")
+    args = parser.parse_args()
+
+    group = multicast.group_for(args.mood)
+    print(f"group {group}:{PORT} (mood {args.mood}), {args.packets} packets of {len(PAYLOAD)} bytes")
+    print(f"{'listeners':>10}{'mode':>11}{'sendto':>9}{'sent KB':>10}{'cpu ms':>9}{'min recv':>10}{'avg recv':>10}")
+    for n in args.listeners:
+        for mode in ("unicast", "multicast"):
+            try:
+                calls, sent, cpu, worst, avg = run(mode, n, args.packets, group)
+            except OSError as e:
+                print(f"{n:>10}{mode:>11}  unavailable: {e}")
+                continue
+            print(f"{n:>10}{mode:>11}{calls:>9}{sent / 1024:>10.0f}{cpu * 1000:>9.1f}{worst:>10.1%}{avg:>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_pacer.py
+-----------------------------------
+Pacer 節奏測試：以 44.1 kHz mono s16le 的 byte rate 經 loopback UDP 送 N 秒，
+接收端記錄抵達時間，回報：
+ - 送出誤差（實際送出 - 排程時間）的 p50 / p99 / max
+ - 抵達間隔 jitter（與理想間隔差的標準差）
+ - drift：最後一個封包抵達時間 vs 媒體時間
+--simulate 用虛擬時鐘（sleep 加上隨機 overshoot）在幾秒內跑完 10 分鐘。
+
+用法：
+    python bench/bench_pacer.py --seconds 600
+    python bench/bench_pacer.py --seconds 600 --simulate
+"""
+import argparse
+import os
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "server"))
+
+from pacer import Pacer, BYTE_RATE, PACKET_SIZE
+
+
+def run_real(seconds, packet_size, burst):
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    rx.bind(("127.0.0.1", 0))
+    rx.settimeout(2)
+    arrivals = []
+
+    def receiver():
+        try:
+            while True:
+                rx.recv(65536)
+                arrivals.append(time.monotonic())
+        except socket.timeout:
+            pass
+
+    t = threading.Thread(target=receiver)
+    t.start()
+
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    pacer = Pacer(burst=burst)
+    payload = bytes(packet_size)
+    total = int(seconds * BYTE_RATE)
+    sent = 0
+    while sent < total:
+        pacer.wait(packet_size)
+        tx.sendto(payload, rx.getsockname())
+        sent += packet_size
+    t.join()
+    tx.close()
+    rx.close()
+    return pacer, arrivals
+
+
+def run_simulated(seconds, packet_size, burst, overshoot_ms=1.0):
+    """虛擬時鐘：每次 sleep 多睡 0~overshoot_ms 的隨機時間（模擬 OS 排程延遲）"""
+    now = [0.0]
+    rng = random.Random(1)
+
+    def clock():
+        return now[0]
+
+    def sleep(dt):
+        now[0] += dt + rng.uniform(0, overshoot_ms / 1000)
+
+    pacer = Pacer(burst=burst, clock=clock, sleep=sleep)
+    arrivals = []
+    total = int(seconds * BYTE_RATE)
+    sent = 0
+    while sent < total:
+        pacer.wait(packet_size)
+        arrivals.append(now[0])
+        sent += packet_size
+    return pacer, arrivals
+
+
+def report(pacer, arrivals, packet_size, seconds):
+    s = pacer.stats.summary()
+    ideal = packet_size / BYTE_RATE
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    jitter = statistics.pstdev([g - ideal for g in gaps]) * 1000 if len(gaps) > 1 else 0.0
+    media = len(arrivals) * packet_size / BYTE_RATE
+    drift = (arrivals[-1] - arrivals[0] + ideal - media) * 1000 if arrivals else float("nan")
+    print(f"duration          : {seconds:.0f} s  ({len(arrivals)} packets of {packet_size} B)")
+    print(f"send error p50/p99: {s['p50_ms']:.3f} / {s['p99_ms']:.3f} ms  (max {s['max_ms']:.3f} ms)")
+    print(f"arrival jitter    : {jitter:.3f} ms (stdev vs ideal {ideal * 1000:.3f} ms gap)")
+    print(f"drift at end      : {drift:+.3f} ms")
+    print(f"resyncs           : {s['resyncs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Real-time UDP pacing benchmark")
+    parser.add_argument("--seconds", type=float, default=600)
+    parser.add_argument("--packet-size", type=int, default=PACKET_SIZE)
+    parser.add_argument("--burst", type=int, default=1)
+    parser.add_argument("--simulate", action="store_true")
+    args = parser.parse_args()
+
+    if args.simulate:
+        pacer, arrivals = run_simulated(args.seconds, args.packet_size, args.burst)
+    else:
+        pacer, arrivals = run_real(args.seconds, args.packet_size, args.burst)
+    report(pacer, arrivals, args.packet_size, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_peer_registry.py
+-----------------------------------
+peer registry 在 10k / 100k peers 下的表現
+ - register：handle_datagram 處理註冊 datagram 的速率（含 JSON 解析），
+   對照舊版 list + `peer not in peers`（O(n) 去重，只跑到 --legacy-max）
+ - renew：所有 peer 各續約一次的速率
+ - LIST：真的起 registry_server，用 PeerDiscovery.fetch_peers 翻完全部分頁 / 取一頁 mood 過濾結果的延遲，
+   對照舊版把整個清單塞進一個 JSON datagram 的大小（超過 65507 bytes 根本送不出去、超過 4096 client 收不完整）
+ - 開始前先驗證翻頁：翻到一半有 peer 續約、加入、離開（version 變了），
+   第一頁的 version 之後的增量補上去，replica 要跟 registry 一模一樣
+
+用法：
+    python bench/bench_peer_registry.py
+    python bench/bench_peer_registry.py --peers 10000 100000 --legacy-max 20000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+sys.path.append(os.path.join(ROOT, "client"))
+
+import peer_discovery
+import peer_registry
+
+MOODS = ("sad", "happy", "calm", "energetic")
+
+
+def make_messages(n):
+    return [json.dumps({"ip": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", "port": 5680 + i % 7,
+                        "mood": MOODS[i % len(MOODS)]}).encode() for i in range(n)]
+
+
+def bench_register(n, messages):
+    registry = peer_registry.PeerRegistry()
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        for msg in messages:
+            peer_registry.handle_datagram(registry, msg)
+        register_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for msg in messages:
+            peer_registry.handle_datagram(registry, msg)
+        renew_s = time.perf_counter() - t0
+    return registry, n / register_s, n / renew_s
+
+
+def bench_legacy_register(messages):
+    peers = []
+    t0 = time.perf_counter()
+    for msg in messages:
+        peer = json.loads(msg.decode())
+        if peer not in peers:
+            peers.append(peer)
+    return len(messages) / (time.perf_counter() - t0), len(json.dumps(peers).encode())
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_list(registry, repeats):
+    port = free_udp_port()
+    ready = threading.Event()
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=peer_registry.registry_server, args=(registry, "127.0.0.1", port, ready),
+                         daemon=True).start()
+        ready.wait(5)
+    peer_discovery.SERVER_PORT = port
+    discovery = peer_discovery.PeerDiscovery()
+
+    full = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        peers = discovery.fetch_peers()
+        full.append(time.perf_counter() - t0)
+        assert len(peers) == len(registry), (len(peers), len(registry))
+
+    one_page = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _ in range(repeats * 10):
+            t0 = time.perf_counter()
+            page = discovery._fetch_page(s, {"mood": "sad", "offset": 0})
+            one_page.append(time.perf_counter() - t0)
+            assert page is not None
+    return min(full), sorted(one_page)[len(one_page) // 2]
+
+
+def walk(registry, first_page_hook, cursor=True):
+    """用 LIST datagram 翻完所有分頁（第一頁之後呼叫 first_page_hook），回傳 (replica, 第一頁的 version)"""
+    replica, query, version = {}, {"req": 1}, None
+    while True:
+        replies = [json.loads(d) for d in peer_registry.handle_datagram(registry, ("LIST " + json.dumps(query)).encode())]
+        for reply in replies:
+            replica.update(((p["ip"], p["port"]), p) for p in reply["peers"])
+        if version is None:
+            version = replies[0]["version"]
+            first_page_hook()
+        if replies[0]["next"] is None:
+            return replica, version
+        if cursor:
+            query["after"] = replies[0]["after"]
+        else:
+            query["offset"] = replies[0]["next"]
+
+
+def verify():
+    """翻頁期間續約 + version 變動（新 peer 排在游標前面、前面的 peer 離開）不會漏掉 peer"""
+    for cursor in (True, False):
+        now = [0.0]
+        registry = peer_registry.PeerRegistry(clock=lambda: now[0])
+        for i in range(1200):
+            registry.register({"ip": f"10.0.{i // 250}.{i % 250}", "port": 1500 + i})
+
+        def churn():
+            now[0] += 1
+            registry.register({"ip": "10.0.0.0", "port": 1500})          # 第一頁的 peer 原樣續約
+            registry.register({"ip": "10.0.9.9", "port": 9999})          # version +1（排在最後）
+            if cursor:
+                registry.register({"ip": "10.0.0.1", "port": 1})         # 排在游標前面
+                registry.unregister("10.0.0.2", 1502)                    # 第一頁的 peer 離開
+
+        replica, version = walk(registry, churn, cursor)
+        added, removed, _ = registry.changes(version)
+        replica.update(((p["ip"], p["port"]), p) for p in added)
+        for ip, port in removed:
+            replica.pop((ip, port), None)
+        assert replica.keys() == registry.peers.keys(), (len(replica), len(registry))
+    print("verified: paged LIST + deltas == registry after a mid-walk renewal and version bump (cursor and offset)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peer registry benchmark")
+    parser.add_argument("--peers", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=20000, help="舊版 O(n^2) 註冊只跑到這個規模")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    verify()
+    print()
+
+    print(f"{'peers':>8}{'impl':>8}{'reg/s':>11}{'renew/s':>11}{'full LIST ms':>14}{'1 page ms':>11}"
+          f"{'datagrams':>11}{'legacy LIST bytes':>19}")
+    for n in args.peers:
+        messages = make_messages(n)
+        registry, reg_rate, renew_rate = bench_register(n, messages)
+        full_s, page_s = bench_list(registry, args.repeats)
+        pages = -(-n // peer_registry.PAGE_LIMIT)
+        datagrams = sum(len(peer_registry.encode_page(*registry.list(offset=i * peer_registry.PAGE_LIMIT)))
+                        for i in range(pages))
+        print(f"{n:>8}{'dict':>8}{reg_rate:>11.0f}{renew_rate:>11.0f}{full_s * 1000:>14.1f}{page_s * 1000:>11.2f}"
+              f"{datagrams:>11}{'':>19}")
+        if n <= args.legacy_max:
+            legacy_rate, legacy_bytes = bench_legacy_register(messages)
+            print(f"{n:>8}{'list':>8}{legacy_rate:>11.0f}{'-':>11}{'-':>14}{'-':>11}{'1':>11}{legacy_bytes:>19}")
+        else:
+            print(f"{n:>8}{'list':>8}{'(skipped)':>11}")
+
+
+if __name__ == "__main__":
+    main()
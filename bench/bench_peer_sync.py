@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_peer_sync.py
+-----------------------------------
+registry 流量（bytes / 分鐘）：整份清單輪詢 vs 增量同步
+以模擬時鐘跑 N 個 PeerDiscovery（每 10 秒續約、每 10 秒有 --churn 比例的 peer 離開並由新 peer 取代），
+client 的 socket 換成直接呼叫 peer_registry.handle_datagram 的假 socket，量 registry 進出的 bytes：
+ - legacy：舊版，每次續約 + LIST 回一整個 JSON（實際上超過 4096 bytes 就收不到）
+ - full：分頁 LIST，每次續約都翻完整份清單
+ - poll：續約時帶本地 version，只回增量
+ - push：續約時訂閱，變動由 registry 推播（合併 PUSH_INTERVAL 內的變動）
+先跑一個續約週期暖機（不計流量），最後檢查每個 client 的 replica 都與 registry 一致。
+
+用法：
+    python bench/bench_peer_sync.py
+    python bench/bench_peer_sync.py --swarm 100 1000 --churn 0.05 --minutes 1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+sys.path.append(os.path.join(ROOT, "client"))
+
+import peer_discovery
+import peer_registry
+
+STEP = 0.1
+REFRESH = peer_discovery.REFRESH_INTERVAL
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeSocket:
+    """client 端的 socket：送出去的 datagram 直接交給 registry，回覆立刻送回 client"""
+
+    def __init__(self, sim, addr):
+        self.sim = sim
+        self.addr = addr
+
+    def sendto(self, data, target):
+        self.sim.bytes_in += len(data)
+        for reply in peer_registry.handle_datagram(self.sim.registry, data, self.addr):
+            self.sim.deliver(self.addr, reply)
+
+
+class Simulation:
+    def __init__(self, mode, n, churn, seed=1):
+        self.mode = mode
+        self.clock = Clock()
+        self.registry = peer_registry.PeerRegistry(clock=self.clock)
+        self.rng = random.Random(seed)
+        self.churn = churn
+        self.clients = {}      # addr -> (PeerDiscovery, 下一次續約時間)
+        self.bytes_in = self.bytes_out = 0
+        self.next_id = 0
+        for _ in range(n):
+            self.join()
+
+    def join(self):
+        i = self.next_id
+        self.next_id += 1
+        addr = (f"10.0.{i >> 8 & 255}.{i & 255}", 40000 + i)
+        sync = self.mode if self.mode in ("poll", "push") else "full"
+        client = peer_discovery.PeerDiscovery(local_ip=addr[0], udp_port=addr[1], sync=sync)
+        if sync != "full":
+            client.sock = FakeSocket(self, addr)
+        self.clients[addr] = [client, self.clock.now + self.rng.uniform(0, REFRESH)]
+        client.register_self() if sync != "full" else self.refresh_full(addr, client)
+
+    def leave(self, addr):
+        client, _ = self.clients.pop(addr)
+        if client.sock is None:
+            client.sock = FakeSocket(self, addr)
+        client.unregister_self()
+
+    def deliver(self, addr, datagram):
+        self.bytes_out += len(datagram)
+        if addr in self.clients:
+            self.clients[addr][0].handle_reply(datagram)
+
+    def refresh_full(self, addr, client):
+        """legacy / full：續約 + 抓整份清單"""
+        register = json.dumps({"ip": client.local_ip, "port": client.udp_port}).encode()
+        self.bytes_in += len(register)
+        peer_registry.handle_datagram(self.registry, register, addr)
+        if self.mode == "legacy":
+            self.bytes_in += len(b"LIST")
+            self.bytes_out += len(json.dumps(list(self.registry.peers.values())).encode())
+            return
+        offset = 0
+        while offset is not None:
+            request = ("LIST " + json.dumps({"offset": offset, "req": 1})).encode()
+            self.bytes_in += len(request)
+            replies = peer_registry.handle_datagram(self.registry, request, addr)
+            self.bytes_out += sum(len(r) for r in replies)
+            offset = json.loads(replies[0])["next"]
+
+    def run(self, seconds):
+        next_churn = REFRESH
+        while self.clock.now < seconds:
+            self.clock.now += STEP
+            now = self.clock.now
+            for addr, entry in list(self.clients.items()):
+                if entry[1] <= now:
+                    entry[1] += REFRESH
+                    if self.mode in ("poll", "push"):
+                        entry[0].register_self()
+                    else:
+                        self.refresh_full(addr, entry[0])
+            if now >= next_churn:
+                next_churn += REFRESH
+                count = int(len(self.clients) * self.churn)
+                for addr in self.rng.sample(list(self.clients), count):
+                    self.leave(addr)
+                for _ in range(count):
+                    self.join()
+            self.registry.expire()
+            push = self.registry.push_due()
+            if push is not None:
+                datagrams, targets = push
+                for target in targets:
+                    for datagram in datagrams:
+                        self.deliver(target, datagram)
+
+    def consistent(self):
+        if self.mode not in ("poll", "push"):
+            return "-"
+        truth = set(self.registry.peers)
+        # poll 模式最多落後一個續約週期；先讓每個 client 再續約一次
+        if self.mode == "poll":
+            for client, _ in self.clients.values():
+                client.register_self()
+        bad = sum(1 for client, _ in self.clients.values() if set(client.replica) != truth)
+        return "ok" if bad == 0 else f"{bad} stale"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peer registry traffic: full list vs delta sync")
+    parser.add_argument("--swarm", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--churn", type=float, default=0.05, help="每 10 秒離開（並由新 peer 取代）的比例")
+    parser.add_argument("--minutes", type=float, default=1.0)
+    parser.add_argument("--modes", nargs="+", default=["legacy", "full", "poll", "push"])
+    args = parser.parse_args()
+
+    print(f"{'swarm':>6}{'mode':>8}{'in KB/min':>12}{'out KB/min':>12}{'total KB/min':>14}{'replicas':>10}")
+    for n in args.swarm:
+        for mode in args.modes:
+            with contextlib.redirect_stdout(io.StringIO()):
+                sim = Simulation(mode, n, args.churn)
+                sim.run(REFRESH)                   # 暖機：所有 client 都完成第一次同步
+                sim.bytes_in = sim.bytes_out = 0   # 不算初次加入的流量
+                sim.run(REFRESH + args.minutes * 60)
+                state = sim.consistent()
+            scale = 1 / 1024 / args.minutes
+            print(f"{n:>6}{mode:>8}{sim.bytes_in * scale:>12.1f}{sim.bytes_out * scale:>12.1f}"
+                  f"{(sim.bytes_in + sim.bytes_out) * scale:>14.1f}{state:>10}")
+
+
+if __name__ == "__main__":
+    main()
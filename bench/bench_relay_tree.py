@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_relay_tree.py
+-----------------------------------
+P2P 中繼樹模擬：source 直接送給每個 peer（舊版）vs k-ary 中繼樹
+在同一個 process 裡為每個 peer 建一個 relay_tree.Relay，socket 換成假的 socket，
+datagram 交給離散事件模擬送達：
+ - 每個節點的上行頻寬 --uplink-mbps，封包依序排隊送出（序列化延遲）
+ - 每一跳的單向延遲 --hop-ms，再加上 0 ~ --jitter-ms 的隨機抖動
+source 以 PCM 的速率送 --seconds 秒的封包，量：
+ - 端到端延遲（source 送出 → 每個 peer 收到）p50 / p99 / max
+ - source 上行負載、最忙的 relay 上行負載、樹深度、收不齊的封包數
+ - 每有一個 peer 加入 / 離開時 RelayTree.rebuild 的耗時
+開始前先驗證：加密頻道的封包（version 2）跟明文封包一樣轉送、去重
+
+用法：
+    python bench/bench_relay_tree.py
+    python bench/bench_relay_tree.py --peers 10 100 1000 --fanout 2 3 4 --uplink-mbps 10
+"""
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "client"))
+
+import relay_tree
+from utils.packet import HEADER_SIZE, SEALED_VERSION, pack_header
+
+SAMPLE_RATE = 44100
+PAYLOAD = 1024              # bytes / 封包（PCM s16le mono，與 server 一致）
+SOURCE = ("10.0.0.1", 5681)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float("nan")
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+class FakeSocket:
+    """Relay 送出的 datagram 交給模擬器排進上行佇列"""
+
+    def __init__(self, sim, addr):
+        self.sim = sim
+        self.addr = addr
+
+    def sendto(self, data, target):
+        self.sim.send(self.addr, target, bytes(data))
+
+
+class Simulation:
+    def __init__(self, n, fanout, uplink_mbps, hop_ms, jitter_ms, seed=1):
+        self.rng = random.Random(seed)
+        self.uplink = uplink_mbps * 1e6 / 8          # bytes / 秒
+        self.hop = hop_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.now = 0.0
+        self.events = []                              # (到達時間, 序號, 目的地, datagram)
+        self.counter = 0
+        self.busy_until = {}                          # addr -> 上行佇列清空的時間
+        self.uplink_bytes = {}                        # addr -> 送出的 bytes
+        self.sent_at = {}                             # seq -> source 送出時間
+        self.latency = []
+        self.received = {}                            # addr -> 收到的封包數
+        peers = [{"ip": f"10.1.{i >> 8 & 255}.{i & 255}", "port": 5681} for i in range(n)]
+        self.peers = peers
+        self.nodes = {}
+        for peer in [{"ip": SOURCE[0], "port": SOURCE[1]}] + peers:
+            addr = relay_tree.peer_key(peer)
+            self.nodes[addr] = relay_tree.Relay(addr, SOURCE, peers, fanout, FakeSocket(self, addr))
+            self.received[addr] = 0
+
+    def send(self, src, dst, data):
+        start = max(self.now, self.busy_until.get(src, 0.0))
+        done = start + len(data) / self.uplink
+        self.busy_until[src] = done
+        self.uplink_bytes[src] = self.uplink_bytes.get(src, 0) + len(data)
+        arrival = done + self.hop + self.rng.uniform(0, self.jitter)
+        self.counter += 1
+        heapq.heappush(self.events, (arrival, self.counter, dst, data))
+
+    def run(self, seconds):
+        interval = PAYLOAD / 2 / SAMPLE_RATE   # 秒 / 封包
+        packets = int(seconds / interval)
+        source = self.nodes[SOURCE]
+        payload = bytes(PAYLOAD)
+        next_send, seq = 0.0, 0
+        while seq < packets or self.events:
+            if seq < packets and (not self.events or next_send <= self.events[0][0]):
+                self.now = next_send
+                self.sent_at[seq] = self.now
+                source.forward(pack_header(1, seq, seq * PAYLOAD // 2) + payload)
+                seq += 1
+                next_send = seq * interval
+                continue
+            self.now, _, dst, data = heapq.heappop(self.events)
+            self.nodes[dst].relay(data)
+            self.received[dst] += 1
+            seq_no = int.from_bytes(data[4:8], "big")
+            self.latency.append(self.now - self.sent_at[seq_no])
+        return packets
+
+
+def bench(n, fanout, args):
+    sim = Simulation(n, fanout, args.uplink_mbps, args.hop_ms, args.jitter_ms)
+    packets = sim.run(args.seconds)
+    tree = sim.nodes[SOURCE].tree
+    depth = max(tree.depth(p) for p in sim.peers)
+    kbps = {addr: b * 8 / args.seconds / 1000 for addr, b in sim.uplink_bytes.items()}
+    source_kbps = kbps.get(SOURCE, 0.0)
+    relay_kbps = max((v for a, v in kbps.items() if a != SOURCE), default=0.0)
+    missing = sum(packets - sim.received[relay_tree.peer_key(p)] for p in sim.peers)
+
+    # 一個 peer 加入 / 離開：每個節點都要重建一次樹，這裡量單一節點的成本
+    peers = list(sim.peers)
+    t0 = time.perf_counter()
+    for i in range(20):
+        peers.append({"ip": "10.9.0.1", "port": 6000 + i})
+        tree.rebuild(peers)
+    rebuild_ms = (time.perf_counter() - t0) / 20 * 1000
+
+    lat = [x * 1000 for x in sim.latency]
+    label = "direct" if fanout >= n else str(fanout)
+    print(f"{n:>6}{label:>8}{depth:>7}{source_kbps:>12.0f}{relay_kbps:>12.0f}"
+          f"{percentile(lat, 50):>9.1f}{percentile(lat, 99):>9.1f}{max(lat):>9.1f}{missing:>9}{rebuild_ms:>11.3f}")
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, target):
+        self.sent.append((target, bytes(data)))
+
+
+def verify():
+    """Relay.relay：加密封包不解開照樣轉給每個子節點、重複的不轉；不認得的版本丟掉"""
+    peers = [{"ip": f"10.1.0.{i}", "port": 5681} for i in range(6)]
+    sock = RecordingSocket()
+    relay = relay_tree.Relay(("10.1.0.0", 5681), SOURCE, peers, 2, sock)
+    children = len(relay.children)
+    assert children == 2, relay.children
+    sealed = pack_header(7, 1, 0, version=SEALED_VERSION) + os.urandom(PAYLOAD + 16)
+    plain = pack_header(7, 2, 512) + bytes(PAYLOAD)
+    assert relay.relay(sealed) == children
+    assert relay.relay(sealed) == 0
+    assert relay.relay(plain) == children
+    assert relay.relay(b"\x09" + sealed[1:]) == 0
+    assert [data for _, data in sock.sent] == [sealed] * children + [plain] * children
+    print(f"verified: sealed and plain packets relayed to {children} children once each, unknown versions dropped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="P2P relay tree: latency and source uplink load")
+    parser.add_argument("--peers", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--fanout", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--uplink-mbps", type=float, default=10.0, help="每個節點的上行頻寬")
+    parser.add_argument("--hop-ms", type=float, default=20.0, help="每一跳的單向延遲")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--seconds", type=float, default=2.0, help="模擬幾秒的音訊")
+    args = parser.parse_args()
+    verify()
+    print()
+
+    stream_kbps = SAMPLE_RATE * 2 / PAYLOAD * (PAYLOAD + HEADER_SIZE) * 8 / 1000
+    print(f"stream {stream_kbps:.0f} kbps per copy, "
+          f"uplink {args.uplink_mbps:g} Mbps, hop {args.hop_ms:g} ms + 0~{args.jitter_ms:g} ms jitter")
+    print(f"{'peers':>6}{'fanout':>8}{'depth':>7}{'src kbps':>12}{'relay kbps':>12}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'missing':>9}{'rebuild ms':>11}")
+    for n in args.peers:
+        for fanout in [n] + [k for k in args.fanout if k < n]:
+            bench(n, fanout, args)
+
+
+if __name__ == "__main__":
+    main()
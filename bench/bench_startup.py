@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_startup.py
+-----------------------------------
+冷啟動的 import 成本（python -X importtime），附預算，可以在 CI 裡當檢查用
+ - 每個進入點在新的 python process 裡 import 一次（--runs 次取中位數），解析 stderr 的 importtime，
+   取進入點模組的 cumulative 時間；列出它直接 import 的模組中最重的幾個
+ - 同時檢查 import 完之後 sys.modules 裡不該出現的重量級依賴（延遲載入的 yt_dlp、NumPy、音訊 backend…）
+ - --check：任何進入點超過預算或載入了不該載入的模組就以 exit code 1 結束
+ - 預算是 ms，預設值約為開發機量到的 2～3 倍（CI 機器較慢）；gui 另外留了 tkinter 冷啟動（_tkinter + Tcl 約 85 ms）的空間；
+   --scale 可整體放寬
+
+用法：
+    python bench/bench_startup.py
+    python bench/bench_startup.py --check
+    python bench/bench_startup.py --runs 9 --scale 1.5 --check --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 名稱 -> (子目錄, 模組, 預算 ms, import 完之後不該載入的模組)
+ENTRY_POINTS = {
+    "server": ("server", "server", 75, ("yt_dlp", "numpy", "http.server")),
+    "player": ("client", "player", 20, ("pyaudio", "sounddevice", "numpy", "http.server")),
+    "client": ("client", "client", 60, ("pyaudio", "sounddevice", "numpy")),
+    "gui": ("client", "gui_tkinter", 150, ("control_session", "cryptography", "peer_discovery", "peer_streamer",
+                                           "pyaudio", "sounddevice", "numpy")),
+    "peer_streamer": ("client", "peer_streamer", 20, ("pyaudio", "sounddevice", "numpy", "http.server")),
+}
+
+PROBE = """
+import json, sys
+sys.path[:0] = [{root!r}, {subdir!r}]
+import {module}
+print(json.dumps([m for m in {forbidden!r} if m in sys.modules]))
+"""
+
+
+def parse_importtime(stderr, module):
+    """回傳 (進入點的 cumulative µs, [(直接 import 的模組, cumulative µs)])"""
+    lines = [line for line in stderr.splitlines() if line.startswith("import time:") and "|" in line]
+    rows = []
+    for line in lines[1:] if lines and "self [us]" in lines[0] else lines:
+        # "import time:  self | cumulative |   name"，name 前面每一層多兩個空白
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(cumulative), depth))
+    total, children = None, []
+    for i, (name, cumulative, depth) in enumerate(rows):
+        if name == module and depth == 0:
+            total = cumulative
+            # importtime 先印子模組：往回找到上一個 depth 0 為止，depth 1 的就是直接 import 的
+            j = i - 1
+            while j >= 0 and rows[j][2] > 0:
+                if rows[j][2] == 1:
+                    children.append((rows[j][0], rows[j][1]))
+                j -= 1
+    return total, sorted(children, key=lambda c: -c[1])
+
+
+def measure(name, runs):
+    subdir, module, budget, forbidden = ENTRY_POINTS[name]
+    code = PROBE.format(root=ROOT, subdir=os.path.join(ROOT, subdir), module=module, forbidden=forbidden)
+    totals, walls, children, loaded, error = [], [], [], [], None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                              capture_output=True, text=True, cwd=ROOT, timeout=60)
+        walls.append((time.perf_counter() - t0) * 1000)
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+            break
+        total, children = parse_importtime(proc.stderr, module)
+        totals.append(total / 1000)
+        loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {
+        "entry": name,
+        "module": module,
+        "import_ms": statistics.median(totals) if totals else None,
+        "process_ms": statistics.median(walls),
+        "budget_ms": budget,
+        "forbidden_loaded": loaded,
+        "heaviest": [{"module": m, "ms": us / 1000} for m, us in children[:5]],
+        "error": error,
+    }
+
+
+def baseline(runs):
+    """空的 python process（interpreter 本身的啟動時間，對照用）"""
+    walls = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        walls.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(walls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import time of the entry points, with budgets")
+    parser.add_argument("--entries", nargs="+", default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="預算整體乘上這個倍數")
+    parser.add_argument("--check", action="store_true", help="超過預算 / 載入不該載入的模組時 exit 1")
+    parser.add_argument("--json", help="結果寫到這個檔案")
+    args = parser.parse_args()
+
+    print(f"python {sys.version.split()[0]}, empty interpreter {baseline(args.runs):.1f} ms, median of {args.runs}")
+    print(f"{'entry':>14}{'import ms':>11}{'budget':>8}{'process ms':>12}  heaviest direct imports / problems")
+    results, failed = [], False
+    for name in args.entries:
+        r = measure(name, args.runs)
+        r["budget_ms"] *= args.scale
+        results.append(r)
+        if r["error"]:
+            # 沒裝 tkinter 的機器上 gui 只跳過；其他 import 失敗（例如沒有音訊 backend 就 import 不了）算失敗
+            skipped = "tkinter" in r["error"]
+            failed |= not skipped
+            print(f"{name:>14}{'-':>11}{r['budget_ms']:>8.0f}{r['process_ms']:>12.1f}  "
+                  f"{'skipped' if skipped else 'IMPORT FAILED'}: {r['error']}")
+            continue
+        over = r["import_ms"] > r["budget_ms"]
+        failed |= over or bool(r["forbidden_loaded"])
+        heaviest = ", ".join(f"{h['module']} {h['ms']:.1f}" for h in r["heaviest"][:3])
+        problems = ""
+        if over:
+            problems += "  OVER BUDGET"
+        if r["forbidden_loaded"]:
+            problems += f"  loaded: {', '.join(r['forbidden_loaded'])}"
+        print(f"{name:>14}{r['import_ms']:>11.1f}{r['budget_ms']:>8.0f}{r['process_ms']:>12.1f}  {heaviest}{problems}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": "startup", "python": sys.version.split()[0], "results": results}, f, indent=1)
+        print(f"results written to {args.json}")
+    if args.check:
+        print("startup check:", "FAILED" if failed else "ok")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_udp_receive.py
+-----------------------------------
+接收路徑微基準：舊版 recvfrom() + bytes 切片 + np.frombuffer  vs  UdpReceiver（recv_into 進 slab）
+ - 先把一批封包灌進 loopback socket 的 kernel buffer，再量純接收 + 解析的成本
+ - packets/s、每封包配置的 heap bytes（tracemalloc）、以及 GC gen-0 回收次數/s
+ - verify：每個封包補送 2 份（3 倍 datagram）、jitter buffer 積得比 slab 的 slot 數還深時，排隊中的音訊不會被之後收進來的覆寫
+
+用法：
+    python bench/bench_udp_receive.py --rounds 50 --batch 2000
+"""
+import argparse
+import gc
+import os
+import socket
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "client"))
+
+import numpy as np
+
+from jitter_buffer import JitterBuffer
+from udp_receiver import UdpReceiver
+from utils.packet import pack_header, unpack_header
+
+PAYLOAD = bytes(1024)
+
+
+def make_pair():
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024 * 1024)
+    rx.bind(("127.0.0.1", 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tx.connect(rx.getsockname())
+    return rx, tx
+
+
+def fill(tx, n, seq0):
+    for i in range(n):
+        tx.send(pack_header(1, seq0 + i, (seq0 + i) * 512) + PAYLOAD)
+
+
+def legacy_step(sock, _):
+    data, _ = sock.recvfrom(2048)
+    payload = unpack_header(data)[4]
+    return np.frombuffer(payload, dtype=np.int16)
+
+
+def slab_step(sock, receiver):
+    payload = unpack_header(receiver.recv())[4]
+    return np.frombuffer(payload, dtype=np.int16)
+
+
+def run(step, rounds, batch, traced=False):
+    rx, tx = make_pair()
+    receiver = UdpReceiver(rx)
+    gen0 = [0]
+
+    def on_gc(phase, info):
+        if phase == "start" and info["generation"] == 0:
+            gen0[0] += 1
+
+    gc.callbacks.append(on_gc)
+    elapsed = 0.0
+    allocated = 0
+    packets = 0
+    try:
+        for r in range(rounds):
+            fill(tx, batch, r * batch)
+            if traced:
+                for _ in range(batch):
+                    before = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                    out = step(rx, receiver)
+                    allocated += tracemalloc.get_traced_memory()[1] - before
+                    del out
+            else:
+                t0 = time.perf_counter()
+                for _ in range(batch):
+                    step(rx, receiver)
+                elapsed += time.perf_counter() - t0
+            packets += batch
+    finally:
+        gc.callbacks.remove(on_gc)
+        rx.close()
+        tx.close()
+    return packets, elapsed, allocated, gen0[0]
+
+
+def verify():
+    rx, tx = make_pair()
+    receiver = UdpReceiver(rx)
+    jbuf = JitterBuffer(min_delay=1.0, max_delay=1.0)    # 512-byte 封包約 173 包的目標延遲
+    depth = 200
+    try:
+        for seq in range(depth):
+            for _ in range(3):                             # 原本那份 + 補送 2 份
+                tx.send(pack_header(1, seq, seq * 256) + bytes([seq % 251]) * 512)
+                _, stream_id, seq_in, ts, payload = unpack_header(receiver.recv())
+                jbuf.push(stream_id, seq_in, ts, payload)
+        assert depth * 3 > receiver.slots and jbuf.depth() == depth, jbuf.snapshot()
+        for seq in range(depth):
+            payload = jbuf.pop(timeout=0)
+            assert payload == bytes([seq % 251]) * 512, f"seq {seq} overwritten"
+    finally:
+        rx.close()
+        tx.close()
+    print(f"verify: {depth} queued packets × 3 copies through {receiver.slots} slots intact")
+
+
+def main():
+    verify()
+    parser = argparse.ArgumentParser(description="UDP receive path allocation / throughput benchmark")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'path':<10}{'pkts/s':>12}{'alloc B/pkt':>13}{'alloc MB/s':>12}{'gen0 GC/s':>11}")
+    for name, step in (("legacy", legacy_step), ("slab", slab_step)):
+        packets, elapsed, _, gen0 = run(step, args.rounds, args.batch)
+        tracemalloc.start()
+        tpackets, _, allocated, _ = run(step, max(1, args.rounds // 10), args.batch, traced=True)
+        tracemalloc.stop()
+        pps = packets / elapsed
+        per_pkt = allocated / tpackets
+        print(f"{name:<10}{pps:>12.0f}{per_pkt:>13.0f}{per_pkt * pps / 1e6:>12.1f}{gen0 / elapsed:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
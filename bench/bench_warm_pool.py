@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+bench/bench_warm_pool.py
+-----------------------------------
+/prompt → 第一個音訊封包的延遲：預熱的 decoder pool 開 / 關
+ - 真的 asyncio server（同一個 process 的另一條 thread），search 換成 stub（回傳本機 WAV，--resolve-ms 延遲）
+ - 離線替身：開解碼器睡 --startup-ms（ffmpeg 啟動 + HTTP 連線 + probe），之後直接讀 WAV
+ - 每個 prompt：client 連線 → /setudp → /prompt（四種 mood 輪流）→ 等第一個封包 → 斷線（頻道停掉），
+   所以每個 prompt 都是該 mood 頻道冷開播；prompt 之間隔 --interval 秒（pool 在這段時間補貨）
+ - 同一個 mood 兩次冷開播的間隔比補貨時間（startup + 預讀）短時拿不到待命的來源（miss），延遲退回 pool off；
+   四種 mood 輪流、每個 prompt 收 startup + 0.3 秒時，補貨通常來得及
+ - verify（假時鐘）：沒人聽時待命不會定期重開，URL 快過期才重開；只預熱 server_codecs() 的 codec
+
+用法：
+    python bench/bench_warm_pool.py
+    python bench/bench_warm_pool.py --prompts 40 --startup-ms 600 --interval 0.2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "server"))
+
+import server
+from bench_e2e import MOODS, one_client, write_tone, percentile
+from bench_gapless import DelayedWav
+from decoder_pool import EXPIRY_MARGIN, DecoderPool
+from utils.codec import server_codecs
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run_prompts(port, prompts, interval, listen):
+    latencies = []
+    for i in range(prompts):
+        # 每個 prompt 只收 listen 秒就斷線：頻道沒有訂閱者而停掉，下一個同 mood 的 prompt 又是冷開播
+        result = await one_client(i, port, listen, timeout=10)
+        if result["latency"] is not None:
+            latencies.append(result["latency"] * 1000)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+def verify():
+    now = [1_000_000.0]
+    closed = []
+
+    class Stub:
+        def __init__(self, url, codec="pcm"):
+            self.url, self.codec = url, codec
+
+        def read(self, n):
+            return b""
+
+        def close(self):
+            closed.append(self.url)
+
+    ttl = 3600
+    pool = DecoderPool(lambda mood: f"https://example.invalid/{mood}?expire={int(now[0]) + ttl}", MOODS,
+                       open_source=Stub, clock=lambda: now[0])
+
+    def filled():
+        deadline = time.monotonic() + 5
+        while pool.stats()["standby"] < len(pool.keys) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return pool.stats()["standby"] == len(pool.keys)
+
+    pool.start()
+    try:
+        assert {codec for _, codec in pool.keys} == set(server_codecs()), pool.keys
+        assert filled(), pool.stats()
+        opened = pool.stats()["opened"]
+        now[0] += ttl - EXPIRY_MARGIN - 60          # 閒置將近一小時，URL 還沒快過期
+        pool._expire()
+        assert not closed and pool.stats()["opened"] == opened, closed
+        now[0] += 120                               # 剩不到 EXPIRY_MARGIN
+        pool._expire()
+        assert len(closed) == len(pool.keys), closed
+        pool.wake.set()
+        assert filled() and pool.stats()["opened"] == 2 * opened, pool.stats()
+    finally:
+        pool.stop()
+    print(f"verify: {len(pool.keys)} standbys ({', '.join(server_codecs())}) kept while idle, "
+          f"reopened only near URL expiry")
+
+
+def main():
+    verify()
+    parser = argparse.ArgumentParser(description="Prompt-to-first-packet latency with the warm decoder pool on / off")
+    parser.add_argument("--prompts", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=1.0, help="prompt 之間隔幾秒")
+    parser.add_argument("--resolve-ms", type=float, default=5.0, help="track cache 命中時的 resolve 延遲")
+    parser.add_argument("--startup-ms", type=float, default=400.0, help="開解碼器到第一個 byte 的延遲")
+    parser.add_argument("--buffer-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="mooddj-warm-")
+    tracks = {}
+    for mood, freq in MOODS.items():
+        tracks[mood] = os.path.join(workdir, f"{mood}.wav")
+        write_tone(tracks[mood], freq, 10)
+    DelayedWav.startup = args.startup_ms / 1000
+
+    def resolve(mood):
+        time.sleep(args.resolve_ms / 1000)
+        return tracks.get(mood, tracks["happy"])
+
+    async def search(mood, timeout=None):
+        return await asyncio.get_running_loop().run_in_executor(None, resolve, mood)
+
+    server.search_youtube_music_async = search
+    server.channel_hub.resolve = resolve
+    server.channel_hub.resolve_next = lambda mood, index: resolve(mood)
+    server.channel_hub.open_source = DelayedWav
+
+    port = free_port()
+    ready = threading.Event()
+    with contextlib.redirect_stdout(io.StringIO()):
+        threading.Thread(target=lambda: asyncio.run(server.serve("127.0.0.1", port, ready=ready,
+                                                                  heartbeat_port=None)),
+                         daemon=True).start()
+        ready.wait(5)
+
+    print(f"{args.prompts} prompts every {args.interval:g} s over {len(MOODS)} moods, "
+          f"decoder startup {args.startup_ms:g} ms, resolve {args.resolve_ms:g} ms")
+    print(f"{'pool':>5}{'served':>8}{'hits':>6}{'misses':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'standby':>9}")
+    for mode in ("off", "on"):
+        pool = None
+        if mode == "on":
+            pool = DecoderPool(resolve, MOODS, codecs=("pcm",), buffer_seconds=args.buffer_seconds,
+                               open_source=DelayedWav)
+            with contextlib.redirect_stdout(io.StringIO()):
+                pool.start()
+                deadline = time.monotonic() + 10
+                while pool.stats()["standby"] < len(MOODS) and time.monotonic() < deadline:
+                    time.sleep(0.05)
+        server.channel_hub.pool = pool
+        with contextlib.redirect_stdout(io.StringIO()):
+            listen = args.startup_ms / 1000 + 0.3
+            latencies = asyncio.run(run_prompts(port, args.prompts, args.interval, listen))
+            time.sleep(0.3)
+        stats = pool.stats() if pool else {"hits": 0, "misses": args.prompts, "standby": 0}
+        print(f"{mode:>5}{len(latencies):>8}{stats['hits']:>6}{stats['misses']:>8}"
+              f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 99):>9.1f}"
+              f"{max(latencies, default=float('nan')):>9.1f}{stats['standby']:>9}")
+        if pool is not None:
+            pool.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+client/audio_output.py
+-----------------------------------
+常駐的 callback 模式音訊輸出（每個 session 只開一次裝置）
+ - PyAudio / sounddevice 兩種 backend，都從 RingBuffer 取資料
+ - 音訊 callback 只做 ring buffer 複製，不碰網路、不會被 socket 卡住
+ - backend 在第一次開裝置時才探測、import（import 這個模組不會載入 PyAudio / sounddevice / NumPy）
+"""
+SAMPLE_RATE = 44100
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+FRAMES_PER_BUFFER = 512
+
+_backend = None
+
+
+def detect_backend() -> str:
+    """優先 PyAudio，不能用時改用 sounddevice；結果快取，整個 process 只探測一次"""
+    global _backend
+    if _backend is None:
+        try:
+            import pyaudio  # noqa: F401
+            _backend = "pyaudio"
+            print("[audio_output] ✅ Using PyAudio backend")
+        except Exception as e:
+            print("[audio_output] ⚠️ PyAudio unavailable, fallback to sounddevice:", e)
+            import sounddevice  # noqa: F401
+            _backend = "sounddevice"
+    return _backend
+
+
+class AudioOutput:
+    def __init__(self, backend, ring, rate=SAMPLE_RATE, frames_per_buffer=FRAMES_PER_BUFFER):
+        self.backend = backend
+        self.ring = ring
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.audio = None
+        self.stream = None
+
+    def start(self):
+        if self.backend == "pyaudio":
+            import pyaudio
+            self.pa_continue = pyaudio.paContinue
+            self.audio = pyaudio.PyAudio()
+            self.stream = self.audio.open(format=pyaudio.paInt16,
+                                          channels=CHANNELS,
+                                          rate=self.rate,
+                                          output=True,
+                                          frames_per_buffer=self.frames_per_buffer,
+                                          stream_callback=self._pyaudio_callback)
+            self.stream.start_stream()
+        else:
+            import sounddevice as sd
+            self.stream = sd.OutputStream(samplerate=self.rate, channels=CHANNELS, dtype="int16",
+                                          blocksize=self.frames_per_buffer,
+                                          callback=self._sounddevice_callback)
+            self.stream.start()
+
+    def _pyaudio_callback(self, in_data, frame_count, time_info, status):
+        return self.ring.read(frame_count * CHANNELS * SAMPLE_WIDTH), self.pa_continue
+
+    def _sounddevice_callback(self, outdata, frames, time_info, status):
+        # outdata 是 (frames, channels) 的 int16 NumPy 陣列，直接寫進它的記憶體
+        self.ring.read_into(outdata)
+
+    def close(self):
+        if self.stream is None:
+            return
+        if self.backend == "pyaudio":
+            self.stream.stop_stream()
+            self.stream.close()
+            self.audio.terminate()
+        else:
+            self.stream.stop()
+            self.stream.close()
+        self.stream = None
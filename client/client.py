@@ -4,9 +4,13 @@ client/client_secure.py
 -----------------------------------
 支援 Auto-Reconnect / Encryption 的安全版 Client
 功能：
-- 自動重新連線
-- TCP 加密傳輸
+- 自動重新連線（常駐控制連線，見 control_session.py）
+- 指令 pipelining：/setudp、/codec、/prompt 一次送出
+- TCP 加密傳輸（每條連線握手出自己的 AEAD key，見 utils/encryptor.py）
 - 接收加密回覆並解密顯示
+- 加密的 UDP 音訊：送 /secure on，收到 "[server] Stream key: ..." 後交給 player 解密（--plain 關閉）
+- 播放時每秒回報掉包 / 緩衝給 server（receiver report，id 同心跳），server 依此調整送法
+- --multicast：請 server 改送 multicast，收到 "[server] Multicast: ..." 後 join 該 group 播放
 """
 import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 加入專案根目錄
@@ -14,12 +18,16 @@ sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__f
 import socket
 import time
 import threading
-from utils.encryptor import encrypt_message, decrypt_message
-from player import play_stream
+from utils import multicast
+from utils.codec import available_codecs
+from utils.encryptor import parse_stream_key
+from control_session import ControlSession
+from heartbeat import Heartbeat
+from player import play_stream, set_stream_key
 
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 5678
-BUFFER_SIZE = 4096
+REPLY_TIMEOUT = 30   # /prompt 可能要等 yt-dlp 解析
 UDP_START_PORT = 5680
 
 def find_available_udp_port(start_port):
@@ -32,51 +40,33 @@ def find_available_udp_port(start_port):
             except OSError:
                 port += 1
 
-def heartbeat_thread():
-    while True:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as hb:
-                hb.connect((SERVER_IP, 5690))
-                hb.settimeout(10)
-                print("[Heartbeat] ✅ Connected to server.")
-                while True:
-                    try:
-                        hb.sendall(b"ping")
-                        resp = hb.recv(32)
-                        if not resp:
-                            raise ConnectionResetError("Empty response, server closed connection")
-                        print(f"[Heartbeat] {resp.decode().strip()}")
-                        time.sleep(5)
-                    except (socket.timeout, ConnectionResetError, BrokenPipeError) as e_inner:
-                        print(f"[Heartbeat] ⚠️ Lost heartbeat: {e_inner}")
-                        break
-        except Exception as e:
-            print(f"[Heartbeat] Retrying in 3s... ({e})")
-            time.sleep(3)
-            
+def start_playback(sock, url, client_id, report_sock=None):
+    """開一個播放 session 的 thread；回傳 (thread, stop Event)"""
+    stop = threading.Event()
+    thread = threading.Thread(target=play_stream, daemon=True,
+                              args=(sock, url, SERVER_IP, client_id, stop, report_sock))
+    thread.start()
+    return thread, stop
 
-def connect_to_server():
-    """自動重連機制"""
-    while True:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((SERVER_IP, SERVER_PORT))
-            sock.setblocking(False)
-            print("[client] ✅ Connected to server.")
-            return sock
-        except Exception as e:
-            print(f"[client] ⚠️ Connect failed ({e}), retrying in 3s...")
-            time.sleep(3)
+
+def stop_playback(playing, timeout=2.0):
+    """結束播放 session 並等它關掉音訊輸出與 sock（收包 thread 也會跟著離開）"""
+    if playing is None:
+        return
+    thread, stop = playing
+    stop.set()
+    thread.join(timeout)
 
 
-def main():
+def main(delivery="unicast", secure=True):
     udp_port = find_available_udp_port(UDP_START_PORT)
     print(f"[client] Using UDP port {udp_port} (to avoid conflict with server)")
 
-    heartbeat = threading.Thread(target=heartbeat_thread, daemon=True)
-    heartbeat.start()
+    # UDP 心跳：server 端據此維護存活表與 RTT
+    heartbeat = Heartbeat(SERVER_IP).start()
 
-    sock = connect_to_server()
+    # 常駐控制連線：斷線時下一個指令自動重連，並重送 /setudp、/codec
+    session = ControlSession(SERVER_IP, SERVER_PORT)
 
     # Setup UDP socket listener before sending commands
     udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -88,6 +78,9 @@ def main():
         udp_sock.close()
         return
 
+    joined = None     # multicast 模式下目前 join 的 (group, port)
+    playing = None    # 目前的播放 session：(thread, stop Event)
+
     while True:
         try:
             cmd = input("> ")
@@ -97,56 +90,62 @@ def main():
             if cmd.startswith("/text "):
                 msg = cmd.replace("/text ", "")
 
-                # Tell server which UDP port client listens on
-                try:
-                    setudp_msg = encrypt_message(f"/setudp {udp_port}")
-                    sock.sendall(setudp_msg)
-                except Exception as e:
-                    print(f"[client] Error sending /setudp command: {e}")
-
-                encrypted = encrypt_message(f"/prompt {msg}")
-                sock.sendall(encrypted)
-
-                # Receive response and decrypt
+                # UDP port、codec、prompt 一次送出（pipelined），依序等回覆
+                futures = [
+                    session.submit(f"/setudp {udp_port} {heartbeat.client_id}"),
+                    # 告訴 server 本機能解的 codec（依偏好排序，pcm 一定在最後當 fallback）
+                    session.submit(f"/codec {','.join(available_codecs())}"),
+                    session.submit(f"/delivery {delivery}"),
+                    session.submit(f"/secure {'on' if secure else 'off'}"),
+                    session.submit(f"/prompt {msg}"),
+                ]
                 try:
-                    data = sock.recv(BUFFER_SIZE)
-                    if not data:
-                        print("[client] No data received from server.")
-                        continue
-                    try:
-                        response = decrypt_message(data)
-                    except Exception as e_dec:
-                        print(f"[client] Decryption failed: {e_dec}")
-                        continue
-                    print(response)
-
-                    # If response includes stream URL, start UDP listener thread for playback
-                    if "http" in response or "udp://" in response:
-                        # Extract URL (simple heuristic)
-                        url_start = response.find("http")
-                        if url_start == -1:
-                            url_start = response.find("udp://")
-                        if url_start != -1:
-                            url = response[url_start:].split()[0]
-                            print(f"[client] Starting audio stream playback from URL: {url}")
-                            # Start streamer playback thread
-                            threading.Thread(target=streamer.play_stream, args=(udp_sock, url), daemon=True).start()
-                except BlockingIOError:
-                    # No data available yet
-                    pass
-                except Exception as e_recv:
-                    print(f"[client] Error receiving or processing server response: {e_recv}")
+                    for future in futures:
+                        for response in future.result(REPLY_TIMEOUT).splitlines():
+                            print(response)
+
+                            # 加密頻道的 key（換 mood / 頻道重開時會換）
+                            stream_key = parse_stream_key(response)
+                            if stream_key:
+                                set_stream_key(*stream_key)
+                                continue
+
+                            # multicast 模式：join server 公告的 group（換 mood 時換 group）
+                            announced = multicast.parse_announcement(response)
+                            if announced and announced != joined:
+                                # 換 group：先停掉舊的 session（收包 thread、音訊輸出）再開新的
+                                stop_playback(playing)
+                                group_sock = multicast.open_listener(*announced)
+                                joined = announced
+                                print(f"[client] Joined multicast group {announced[0]}:{announced[1]}")
+                                # receiver report 從 unicast socket 送
+                                playing = start_playback(group_sock, announced[0], heartbeat.client_id, udp_sock)
+                                continue
+
+                            # If response includes stream URL, start UDP listener thread for playback
+                            if "http" in response or "udp://" in response:
+                                # Extract URL (simple heuristic)
+                                url_start = response.find("http")
+                                if url_start == -1:
+                                    url_start = response.find("udp://")
+                                if url_start != -1:
+                                    url = response[url_start:].split()[0]
+                                    if playing is not None and playing[0].is_alive():
+                                        # 同一個 UDP port 上的 session 還在播：server 換頻道後直接收到新的串流
+                                        print(f"[client] Switching stream to: {url}")
+                                    else:
+                                        print(f"[client] Starting audio stream playback from URL: {url}")
+                                        playing = start_playback(udp_sock, url, heartbeat.client_id)
+                except TimeoutError:
+                    print("[client] No data received from server.")
 
             else:
                 print("Usage: /text <your mood>")
             time.sleep(0.05)
         except (ConnectionResetError, BrokenPipeError, OSError) as e:
-            print(f"[client] ⚠️ Connection lost, auto reconnecting... Detail: {e}")
-            try:
-                sock.close()
-            except Exception as e_close:
-                print(f"[client] Error closing socket: {e_close}")
-            sock = connect_to_server()
+            # session 會在下一個指令自動重連
+            print(f"[client] ⚠️ Connection lost, will reconnect on next command. Detail: {e}")
+            time.sleep(1)
         except KeyboardInterrupt:
             print("\n[client] Exiting.")
             break
@@ -154,10 +153,8 @@ def main():
             print(f"[client] Unexpected error: {e}")
             time.sleep(0.05)
 
-    try:
-        sock.close()
-    except Exception as e:
-        print(f"[client] Error closing socket on exit: {e}")
+    session.close()
+    stop_playback(playing)
     try:
         udp_sock.close()
     except Exception as e:
@@ -165,4 +162,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main("multicast" if "--multicast" in sys.argv[1:] else "unicast", secure="--plain" not in sys.argv[1:])
\ No newline at end of file
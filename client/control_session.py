@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+client/control_session.py
+-----------------------------------
+常駐的控制連線（GUI / CLI 共用）
+ - 整個 client 只連一次 server，之後每個指令都走同一條 TCP 連線
+ - 每個指令帶 request id（"#<id> <command>"），server 並行處理、回覆帶同一個 id，
+   可以同時有多個指令在路上（pipelining），回覆順序不必跟送出順序一樣
+ - 背景 reader thread 解碼 frame，依 id 完成對應的 Future
+ - 連線斷掉時：還在等的 Future 直接失敗；下一個指令自動重連，
+   並重送 session 狀態指令（/codec、/setudp、/delivery、/secure），server 端的設定不會因重連而遺失
+ - 每次連線先握手（utils/encryptor.py）：這條連線自己的 AES-GCM / ChaCha20-Poly1305 key，
+   每個 frame 只多 16-byte tag；任何 frame 驗不過就斷線重連
+"""
+import itertools
+import socket
+import threading
+from concurrent.futures import Future
+
+from utils.encryptor import DEFAULT_ALGORITHM, client_hello, finish_hello
+from utils.framing import HANDSHAKE_FRAME_SIZE, MAX_FRAME_SIZE, FrameDecoder, send_frame, recv_frame
+
+CONNECT_TIMEOUT = 5
+REPLY_TIMEOUT = 30            # /prompt 可能要等 yt-dlp 解析
+STICKY_COMMANDS = ("/codec ", "/setudp ", "/delivery ", "/secure ")   # 重連後要重送的 session 狀態
+
+
+class ControlSession:
+    def __init__(self, host, port, connect_timeout=CONNECT_TIMEOUT, algorithm=DEFAULT_ALGORITHM):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.algorithm = algorithm
+        self.cipher = None
+        self.lock = threading.Lock()     # 保護 sock / pending，並讓 send 不會交錯
+        self.sock = None
+        self.pending = {}                # request id -> Future
+        self.sticky = {}                 # 指令前綴 -> 最後一次送出的指令
+        self.ids = itertools.count(1)
+        self.connects = 0
+
+    # --------------------------------------------------------
+    # 連線管理
+    # --------------------------------------------------------
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        decoder = FrameDecoder(max_frame_size=HANDSHAKE_FRAME_SIZE)
+        try:
+            # 握手（還在 connect_timeout 內）：HELLO → server HELLO + 確認碼
+            private, hello = client_hello(self.algorithm)
+            send_frame(sock, hello)
+            reply = recv_frame(sock, decoder)
+            if reply is None:
+                raise ConnectionResetError("server closed connection during handshake")
+            self.cipher = finish_hello(private, hello, reply)
+            decoder.max_frame_size = MAX_FRAME_SIZE
+        except (OSError, ValueError):
+            sock.close()
+            raise
+        sock.settimeout(None)            # reader thread 用 blocking 讀
+        self.sock = sock
+        self.connects += 1
+        threading.Thread(target=self._reader, args=(sock, self.cipher, decoder), daemon=True).start()
+        # 重送 session 狀態；回覆不需要等
+        for command in self.sticky.values():
+            self._send(self._register(Future()), command)
+        print(f"[control] ✅ Connected to {self.host}:{self.port}")
+
+    def _drop(self, sock, error):
+        """連線失效：關掉 socket，讓所有還在等的 request 失敗"""
+        with self.lock:
+            if self.sock is not sock:
+                return
+            self.sock = None
+            pending, self.pending = self.pending, {}
+        try:
+            sock.close()
+        except OSError:
+            pass
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self):
+        sock = self.sock
+        if sock is not None:
+            self._drop(sock, ConnectionResetError("control session closed"))
+
+    # --------------------------------------------------------
+    # 送出 / 接收
+    # --------------------------------------------------------
+    def _register(self, future):
+        request_id = next(self.ids)
+        self.pending[request_id] = future
+        return request_id
+
+    def _send(self, request_id, command):
+        send_frame(self.sock, self.cipher.seal(f"#{request_id} {command}"))
+
+    def submit(self, command) -> Future:
+        """送出指令，立即回傳 Future（結果為 server 回覆的文字，多行以 \\n 分隔）"""
+        future = Future()
+        for attempt in range(2):
+            with self.lock:
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    for prefix in STICKY_COMMANDS:
+                        if command.startswith(prefix):
+                            self.sticky[prefix] = command
+                    request_id = self._register(future)
+                    self._send(request_id, command)
+                    return future
+                except (OSError, ValueError) as e:
+                    self.pending = {k: f for k, f in self.pending.items() if f is not future}
+                    sock, error = self.sock, e
+                    if sock is None or attempt:
+                        future.set_exception(e)
+                        return future
+            # 送出時才發現連線已斷（例如 server 重啟）：清掉後重連一次
+            self._drop(sock, error)
+        return future
+
+    def request(self, command, timeout=REPLY_TIMEOUT) -> str:
+        return self.submit(command).result(timeout)
+
+    def _reader(self, sock, cipher, decoder):
+        try:
+            while True:
+                data = recv_frame(sock, decoder)
+                if data is None:
+                    raise ConnectionResetError("server closed connection")
+                # 驗不過就斷線（訊息計數已經對不上），下一個指令會重連
+                text = cipher.open(data)
+                tag, _, reply = text.partition(" ")
+                if not tag.startswith("#") or not tag[1:].isdigit():
+                    continue   # 舊版 server 的未標記回覆
+                with self.lock:
+                    future = self.pending.pop(int(tag[1:]), None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except (OSError, ValueError) as e:
+            self._drop(sock, e if isinstance(e, OSError) else ConnectionResetError(str(e)))
@@ -7,38 +7,41 @@ MoodDJ Pro - Tkinter GUI Client
 - 將輸入透過 TCP 傳送到 Server（127.0.0.1:5678）
 - 即時顯示伺服器回應（情緒分析結果與歌曲名稱）
 - 可與 player.py 同時運作（UDP 播放音樂）
+- 視窗先畫出來：控制連線（cryptography）、P2P 模組、背景 player 都在第一次用到 / 視窗顯示後才載入
 """
 import os, sys
 # ✅ 讓 Python 找到上層的 utils 模組
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from utils.encryptor import encrypt_message, decrypt_message, send_large, recv_large
-import socket
+from utils.codec import available_codecs
 import threading
 import tkinter as tk
 from tkinter import messagebox, scrolledtext
-import peer_discovery
-import peer_streamer
 
 # Server 設定
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 5678
-BUFFER_SIZE = 1024
+
+
+# 整個 GUI 共用一條常駐控制連線（第一次送 prompt 時才 import、才連）
+session = None
+
+
+def get_session():
+    global session
+    if session is None:
+        from control_session import ControlSession
+        session = ControlSession(SERVER_IP, SERVER_PORT)
+    return session
 
 
 # 傳送 prompt 到伺服器
 def send_prompt_to_server(prompt: str) -> str:
-    # 建立 TCP 連線 
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.connect((SERVER_IP, SERVER_PORT))
-            # 傳送加密封包（分段）
-            encrypted_data = encrypt_message(f"/prompt {prompt}")
-            send_large(sock, encrypted_data)
-            # 接收封包（分段）
-            response_encrypted = recv_large(sock, BUFFER_SIZE)
-            decrypted_response = decrypt_message(response_encrypted)
-            return decrypted_response.strip()
+        # 協商音訊 codec 與 prompt 一起送出（pipelined），只等最後的結果
+        control = get_session()
+        control.submit(f"/codec {','.join(available_codecs())}")
+        return control.request(f"/prompt {prompt}").strip()
     except Exception as e:
         return f"[Error] {e}"
 
@@ -51,8 +54,8 @@ class MoodDJ_GUI:
         self.root.geometry("640x480")
         self.root.resizable(False, False)
         
-        # 🔥 一啟動 GUI 就自動啟動 player
-        threading.Thread(target=self.start_player_background, daemon=True).start()
+        # 🔥 一啟動 GUI 就自動啟動 player（視窗畫好、event loop 閒下來之後才開）
+        self.root.after_idle(lambda: threading.Thread(target=self.start_player_background, daemon=True).start())
 
         # 標題
         tk.Label(root, text="MoodDJ Pro", font=("Arial", 18, "bold")).pack(pady=5)
@@ -126,10 +129,12 @@ class MoodDJ_GUI:
 
     def start_p2p_discovery(self):
         self._log("[P2P] Starting peer discovery...")
+        import peer_discovery
         threading.Thread(target=peer_discovery.main, daemon=True).start()
 
     def start_p2p_stream(self):
         self._log("[P2P] Starting peer streaming...")
+        import peer_streamer
         threading.Thread(target=peer_streamer.main, daemon=True).start()
         
     def start_player_background(self):
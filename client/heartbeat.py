@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+client/heartbeat.py
+-----------------------------------
+輕量 UDP 心跳（取代另開一條 TCP 連線送 "ping"）
+ - 每 interval 秒送一個 24-byte ping，server 原樣回 pong，用 pong 算 RTT
+ - 下一個 ping 帶上次量到的 RTT，server 端的存活表就有每個 client 的 RTT
+ - 只在狀態改變時印訊息（連上 / 失聯）
+ - ReceiverReporter：播放中每秒送一份 receiver report（掉包、jitter、緩衝、最大 seq）到同一個 port，
+   從收音訊的 socket 送出，server 由來源位址就知道是哪個 endpoint（見 server/feedback.py）
+"""
+import random
+import socket
+import threading
+import time
+
+from utils import heartbeat
+
+INTERVAL = 5.0
+LOST_AFTER = 15.0   # 超過這麼久沒收到 pong 視為失聯
+REPORT_INTERVAL = 1.0
+
+
+class Heartbeat:
+    def __init__(self, host, port=heartbeat.HEARTBEAT_PORT, interval=INTERVAL,
+                 lost_after=LOST_AFTER, client_id=None):
+        self.target = (host, port)
+        self.interval = interval
+        self.lost_after = lost_after
+        self.client_id = random.getrandbits(32) if client_id is None else client_id
+        self.rtt_ms = None
+        self.alive = False
+        self.last_pong = None
+        self.seq = 0
+        self.stop_event = threading.Event()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def ping(self):
+        self.seq += 1
+        self.sock.sendto(heartbeat.pack(heartbeat.PING, self.client_id, self.seq,
+                                        time.monotonic(), self.rtt_ms), self.target)
+
+    def _receive_until(self, deadline):
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(64)
+                kind, client_id, seq, sent, _ = heartbeat.unpack(data)
+            except socket.timeout:
+                return
+            except (OSError, ValueError):
+                continue   # ICMP unreachable（server 沒開）或格式錯誤
+            if kind == heartbeat.PONG and client_id == self.client_id:
+                now = time.monotonic()
+                self.rtt_ms = (now - sent) * 1000
+                self.last_pong = now
+                if not self.alive:
+                    self.alive = True
+                    print(f"[Heartbeat] ✅ Server alive (rtt {self.rtt_ms:.1f} ms)")
+
+    def run(self):
+        self.last_pong = time.monotonic()   # 啟動後先給 lost_after 秒的寬限
+        lost_reported = False
+        while not self.stop_event.is_set():
+            try:
+                self.ping()
+            except OSError as e:
+                print(f"[Heartbeat] ⚠️ Ping failed: {e}")
+            self._receive_until(time.monotonic() + self.interval)
+            if time.monotonic() - self.last_pong > self.lost_after:
+                if not lost_reported:
+                    print(f"[Heartbeat] ⚠️ Lost heartbeat (no pong for {self.lost_after:.0f}s)")
+                lost_reported, self.alive = True, False
+            else:
+                lost_reported = False
+        self.sock.close()
+
+
+class ReceiverReporter:
+    """播放排程執行緒定期呼叫 maybe_send；不另開 thread，也不等回覆"""
+
+    def __init__(self, sock, host, jbuf, ring=None, port=heartbeat.HEARTBEAT_PORT, interval=REPORT_INTERVAL,
+                 client_id=None):
+        self.sock = sock                  # 收音訊的 socket：server 看到的來源位址 = 它送音訊的目的地
+        self.target = (host, port)
+        self.jbuf = jbuf
+        self.ring = ring
+        self.interval = interval
+        self.client_id = random.getrandbits(32) if client_id is None else client_id
+        self.next_report = 0.0
+        self.sent = 0
+
+    def maybe_send(self, now=None):
+        now = time.monotonic() if now is None else now
+        if now < self.next_report:
+            return False
+        self.next_report = now + self.interval
+        report = self.jbuf.report()
+        if report is None:
+            return False   # 還沒收到串流：存活由 Heartbeat 負責
+        stream_id, highest_seq, received, lost, underruns, jitter_ms, buffered_ms = report
+        if self.ring is not None:
+            underruns += self.ring.underruns
+            buffered_ms += self.ring.available() / 2 / 44100 * 1000
+        try:
+            self.sock.sendto(heartbeat.pack_report(self.client_id, stream_id, highest_seq, received, lost,
+                                                   underruns, jitter_ms, buffered_ms), self.target)
+        except OSError:
+            return False   # server 不在 / 網路斷了：下一輪再送
+        self.sent += 1
+        return True
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+client/jitter_buffer.py
+-----------------------------------
+自適應 jitter buffer（搭配 utils/packet.py 的封包 header）
+功能：
+ - 依 seq 重新排序，重複 / 太晚到的封包直接丟掉並計數
+ - 掉包時補償：靜音 (silence) 或重複上一包 (repeat)
+ - 依 RFC 3550 的 interarrival jitter 估計，動態調整播放延遲
+ - 積太多時丟掉最舊的封包追上即時，underrun 時重新預緩衝
+ - payload 可以是 UdpReceiver / PacketOpener 的 memoryview：收下時複製一份（補送的重複封包、太晚到的不複製），
+   slab 的 slot 被之後的 datagram（包括補送的那幾份）覆寫也不會改到排隊中的音訊
+"""
+import math
+import threading
+import time
+
+from utils.packet import seq_diff
+
+SAMPLE_RATE = 44100
+MIN_DELAY = 0.04        # 秒；最小播放延遲
+MAX_DELAY = 0.5         # 秒；最大播放延遲
+JITTER_FACTOR = 4       # 目標延遲 = MIN_DELAY + JITTER_FACTOR * jitter
+
+
+class JitterBuffer:
+    def __init__(self, sample_rate=SAMPLE_RATE, min_delay=MIN_DELAY, max_delay=MAX_DELAY,
+                 conceal="silence", clock=time.monotonic):
+        self.sample_rate = sample_rate
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.conceal = conceal
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.stats = {
+            "received": 0, "played": 0, "lost": 0, "late": 0, "duplicate": 0,
+            "concealed": 0, "underruns": 0, "overflow_drops": 0, "resets": 0,
+        }
+        self._reset_stream(None)
+
+    def _reset_stream(self, stream_id):
+        self.stream_id = stream_id
+        self.packets = {}          # seq -> payload
+        self.next_seq = None       # 下一個要播放的 seq
+        self.highest_seq = None
+        self.buffering = True
+        self.jitter = 0.0          # 秒
+        self.last_transit = None
+        self.last_payload = b""
+        self.packet_duration = 0.0
+
+    # --------------------------------------------------------
+    # 網路執行緒：放入封包
+    # --------------------------------------------------------
+    def push(self, stream_id, seq, timestamp, payload, arrival=None):
+        arrival = self.clock() if arrival is None else arrival
+        with self.cond:
+            if stream_id != self.stream_id:
+                if self.stream_id is not None:
+                    self.stats["resets"] += 1
+                self._reset_stream(stream_id)
+                self.next_seq = seq
+            self.stats["received"] += 1
+
+            if seq_diff(seq, self.next_seq) < 0:
+                self.stats["late"] += 1
+                return
+            if seq in self.packets:
+                self.stats["duplicate"] += 1
+                return
+
+            # RFC 3550: J += (|D| - J) / 16
+            transit = arrival - timestamp / self.sample_rate
+            if self.last_transit is not None:
+                d = abs(transit - self.last_transit)
+                self.jitter += (d - self.jitter) / 16
+            self.last_transit = transit
+
+            payload = bytes(payload)
+            self.packets[seq] = payload
+            if self.highest_seq is None or seq_diff(seq, self.highest_seq) > 0:
+                self.highest_seq = seq
+            if payload:
+                self.packet_duration = len(payload) / 2 / self.sample_rate
+
+            # 積太多：丟掉最舊的，讓延遲回到目標附近
+            limit = 2 * self.target_packets()
+            while len(self.packets) > limit:
+                self._skip_one()
+                self.stats["overflow_drops"] += 1
+
+            if self.buffering and self._buffered_span() >= self.target_packets():
+                self.buffering = False
+            self.cond.notify()
+
+    # --------------------------------------------------------
+    # 播放執行緒：取出下一段 payload
+    # --------------------------------------------------------
+    def pop(self, timeout=None):
+        """回傳下一個要播放的 payload；預緩衝中且逾時回傳 None"""
+        deadline = None if timeout is None else self.clock() + timeout
+        with self.cond:
+            while self.buffering or self.next_seq is None:
+                remaining = None if deadline is None else deadline - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+            if not self.packets:
+                # 完全沒東西可播：underrun，重新預緩衝
+                self.stats["underruns"] += 1
+                self.buffering = True
+                return None
+
+            payload = self.packets.pop(self.next_seq, None)
+            if payload is None:
+                self.stats["lost"] += 1
+                self.stats["concealed"] += 1
+                payload = self._concealment()
+            else:
+                self.last_payload = payload
+                self.stats["played"] += 1
+            self.next_seq = (self.next_seq + 1) % (1 << 32)
+            return payload
+
+    def _skip_one(self):
+        if self.packets.pop(self.next_seq, None) is None:
+            self.stats["lost"] += 1
+        self.next_seq = (self.next_seq + 1) % (1 << 32)
+
+    def _concealment(self):
+        if self.conceal == "repeat" and self.last_payload:
+            return bytes(self.last_payload)
+        return bytes(len(self.last_payload) or 2048)
+
+    def _buffered_span(self):
+        if self.highest_seq is None or self.next_seq is None:
+            return 0
+        return seq_diff(self.highest_seq, self.next_seq) + 1
+
+    def target_delay(self) -> float:
+        delay = self.min_delay + JITTER_FACTOR * self.jitter
+        return min(self.max_delay, delay)
+
+    def target_packets(self) -> int:
+        if self.packet_duration <= 0:
+            return 1
+        return max(1, math.ceil(self.target_delay() / self.packet_duration))
+
+    def depth(self) -> int:
+        with self.cond:
+            return len(self.packets)
+
+    def report(self):
+        """receiver report 用：(stream_id, highest_seq, received, lost, underruns, jitter_ms, buffered_ms)；還沒收到串流時 None"""
+        with self.cond:
+            if self.stream_id is None or self.highest_seq is None:
+                return None
+            return (self.stream_id, self.highest_seq, self.stats["received"], self.stats["lost"],
+                    self.stats["underruns"], self.jitter * 1000, len(self.packets) * self.packet_duration * 1000)
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            snap = dict(self.stats)
+            snap["depth"] = len(self.packets)
+            snap["jitter_ms"] = self.jitter * 1000
+            snap["target_delay_ms"] = self.target_delay() * 1000
+            return snap
@@ -3,10 +3,18 @@
 client/peer_discovery.py
 -----------------------------------
 功能：
- - 向伺服器註冊自己的 IP / UDP port
- - 向伺服器請求目前線上 peers 清單
+ - 向伺服器註冊自己的 IP / UDP port（可帶 mood / channel，定期續約，不續約會被 registry 移除）
+ - 向伺服器請求目前線上 peers 清單（分頁 + 多個 datagram 組回，可依 mood / channel 過濾）
+   以 registry 給的游標（上一頁最後一個 key）翻頁，replica 的 version 是第一頁的 version：
+   翻頁期間的變動都在那之後的增量裡；舊版 registry 沒有游標時改用 offset，翻到一半 version 變了就重翻
+ - 本地 replica + 增量同步（sync 參數）：
+   * push：註冊時訂閱，registry 有變動就把增量推過來（預設）
+   * poll：每次續約順便帶上本地 version，只拿那之後的增量
+   * full：舊行為，每次都抓整份清單
+   增量接不上（漏收推播）時自動補問 SYNC；registry 說 reset 時才重抓整份
  - 可被其他模組（如 peer_streamer）匯入使用
 """
+import itertools
 import socket
 import json
 import threading
@@ -14,39 +22,183 @@ import time
 
 SERVER_IP = "127.0.0.1"
 SERVER_PORT = 5700    # P2P 註冊用獨立 port
+LIST_TIMEOUT = 2      # 秒；一頁的所有 datagram 要在這段時間內收齊
+REFRESH_INTERVAL = 10 # 秒；續約週期（registry TTL 為 30 秒）
+SYNC_MODES = ("push", "poll", "full")
+MAX_RESTARTS = 3      # 舊版 registry 翻頁期間一直有變動時最多重翻幾次
 
 class PeerDiscovery:
-    def __init__(self, local_ip="127.0.0.1", udp_port=5680):
+    def __init__(self, local_ip="127.0.0.1", udp_port=5680, mood=None, channel=None,
+                 sync="push", refresh=REFRESH_INTERVAL):
+        if sync not in SYNC_MODES:
+            raise ValueError(f"sync must be one of {SYNC_MODES}")
         self.local_ip = local_ip
         self.udp_port = udp_port
+        self.mood = mood
+        self.channel = channel
+        self.sync = sync
+        self.refresh = refresh
         self.peers = []
+        self.replica = {}          # (ip, port) -> peer，與 registry 的 version 同步
+        self.version = 0
+        self.partial = {}          # (from, to) -> {part: (added, removed)}，多 datagram 的增量
+        self.sock = None           # push / poll 模式的常駐 socket（註冊、增量、推播都走它）
         self.running = False
+        self.req_ids = itertools.count(1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
 
-    def register_self(self):
-        """註冊自己的 IP/Port 給 server"""
-        msg = json.dumps({"ip": self.local_ip, "port": self.udp_port})
+    def _send(self, data: bytes):
+        self.bytes_sent += len(data)
+        if self.sock is not None:
+            self.sock.sendto(data, (SERVER_IP, SERVER_PORT))
+            return
         with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.sendto(msg.encode(), (SERVER_IP, SERVER_PORT))
+            s.sendto(data, (SERVER_IP, SERVER_PORT))
 
-    def fetch_peers(self):
-        """向 server 請求 peers"""
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.sendto(b"LIST", (SERVER_IP, SERVER_PORT))
-            s.settimeout(2)
+    def register_self(self):
+        """註冊（續約）自己的 IP/Port 給 server；增量模式順便帶上本地 version"""
+        peer = {"ip": self.local_ip, "port": self.udp_port}
+        if self.mood:
+            peer["mood"] = self.mood
+        if self.channel:
+            peer["channel"] = self.channel
+        if self.sock is not None:
+            peer["since"] = self.version
+            if self.sync == "push":
+                peer["sub"] = True
+        self._send(json.dumps(peer).encode())
+
+    def unregister_self(self):
+        self._send(("BYE " + json.dumps({"ip": self.local_ip, "port": self.udp_port})).encode())
+
+    def _fetch_page(self, s, query):
+        """送出一個 LIST 請求並收齊該頁所有 datagram；回傳 (peers, next offset, version, 游標)，逾時回傳 None"""
+        query["req"] = next(self.req_ids)
+        request = ("LIST " + json.dumps(query)).encode()
+        self.bytes_sent += len(request)
+        s.sendto(request, (SERVER_IP, SERVER_PORT))
+        parts, expected, next_offset, version, after = {}, None, None, None, None
+        deadline = time.monotonic() + LIST_TIMEOUT
+        while expected is None or len(parts) < expected:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            s.settimeout(remaining)
             try:
                 data, _ = s.recvfrom(4096)
-                self.peers = json.loads(data.decode())
+                reply = json.loads(data.decode())
             except socket.timeout:
-                pass
+                return None
+            except ValueError:
+                continue
+            self.bytes_received += len(data)
+            if reply.get("req") != query["req"]:
+                continue   # 上一個逾時請求遲到的回覆
+            expected, next_offset, version = reply["parts"], reply["next"], reply.get("version", 0)
+            after = reply.get("after")
+            parts[reply["part"]] = reply["peers"]
+        return [peer for i in range(expected) for peer in parts[i]], next_offset, version, after
+
+    def fetch_peers(self, mood=None, channel=None):
+        """向 server 請求 peers（自動翻完所有分頁）；任一頁逾時則保留上一次的清單"""
+        query = {"offset": 0}
+        if mood:
+            query["mood"] = mood
+        if channel:
+            query["channel"] = channel
+        peers, version, restarts = [], None, 0
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            while True:
+                page = self._fetch_page(s, query)
+                if page is None:
+                    return self.peers
+                if version is None:
+                    version = page[2]   # 翻頁期間的變動之後由增量補上（增量是冪等的最終狀態）
+                elif "after" not in query and page[2] != version and restarts < MAX_RESTARTS:
+                    # 舊版 registry（沒有游標，只能用 offset）翻頁期間清單變了：offset 可能錯位，從頭重翻
+                    peers, version, restarts = [], None, restarts + 1
+                    query["offset"] = 0
+                    continue
+                peers.extend(page[0])
+                if page[1] is None:
+                    break
+                if page[3] is not None:
+                    query["after"] = page[3]
+                query["offset"] = page[1]
+        if mood or channel:
+            return peers
+        self.replica = {(p["ip"], p["port"]): p for p in peers}
+        self.version = version
+        self.peers = peers
         return self.peers
 
+    # --------------------------------------------------------
+    # 增量同步
+    # --------------------------------------------------------
+    def _on_delta(self, reply):
+        key = (reply["from"], reply["to"])
+        parts = self.partial.setdefault(key, {})
+        parts[reply["part"]] = (reply["added"], reply["removed"])
+        if len(parts) < reply["parts"]:
+            if len(self.partial) > 16:
+                self.partial = {key: parts}   # 收不齊的舊增量就放棄，下次續約會補
+            return
+        del self.partial[key]
+        since, version = key
+        if version <= self.version:
+            return                            # 已經套用過
+        if since > self.version:
+            # 中間漏了一段（推播遺失）：補問
+            query = {"since": self.version, "req": next(self.req_ids)}
+            self._send(("SYNC " + json.dumps(query)).encode())
+            return
+        # 增量是 version 時的最終狀態：套在 since..version 之間任何一版上結果都一樣
+        for added, removed in parts.values():
+            for peer in added:
+                self.replica[(peer["ip"], peer["port"])] = peer
+            for ip, port in removed:
+                self.replica.pop((ip, port), None)
+        self.version = version
+        self.peers = list(self.replica.values())
+
+    def handle_reply(self, data):
+        """處理常駐 socket 收到的一個 datagram（增量回覆或推播）"""
+        self.bytes_received += len(data)
+        try:
+            reply = json.loads(data.decode())
+        except ValueError:
+            return
+        if reply.get("type") == "delta":
+            self._on_delta(reply)
+        elif reply.get("type") == "reset":
+            self.fetch_peers()
+
+    def _listen(self):
+        while self.running:
+            try:
+                data, _ = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                if not self.running:
+                    return
+                continue   # server 暫時不在（ICMP unreachable）
+            self.handle_reply(data)
+
     def auto_refresh(self):
         """背景自動更新 peer list"""
         self.running = True
+        if self.sync != "full" and self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind(("", 0))
+            self.sock.settimeout(1.0)
+            threading.Thread(target=self._listen, daemon=True).start()
         while self.running:
             self.register_self()
-            self.fetch_peers()
-            time.sleep(10)
+            if self.sync == "full":
+                self.fetch_peers()
+            time.sleep(self.refresh)
 
     def start(self):
         t = threading.Thread(target=self.auto_refresh, daemon=True)
@@ -55,6 +207,10 @@ class PeerDiscovery:
 
     def stop(self):
         self.running = False
+        self.unregister_self()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
         print("[peer_discovery] Peer sync stopped.")
 
 
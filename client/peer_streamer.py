@@ -4,60 +4,121 @@ client/peer_streamer.py
 -----------------------------------
 功能：
  - P2P 音樂中繼 / 接收
- - 主 peer 將 UDP 音訊送給其他 peers
+ - 主 peer（source）只送給中繼樹上自己的 fanout 個子節點，每個 peer 收到後再轉給自己的子節點
+   （見 client/relay_tree.py），source 上行只需 k 份
+ - 收、送共用同一個常駐 socket；給了 PeerDiscovery 時，peer 加入 / 離開會自動重建樹
+ - 給了 multicast group 時改為 join group 收 server 的串流（同一個 LAN 不必經過中繼）
  - 其他 peer 收到後直接播放（PyAudio 或 sounddevice）
 """
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 加入專案根目錄
 import socket
 import threading
-import numpy as np
+import time
 
-try:
-    import pyaudio
-    BACKEND = "pyaudio"
-except Exception:
-    import sounddevice as sd
-    BACKEND = "sounddevice"
+from utils import metrics, multicast
+from utils.codec import DecoderSet
+from utils.packet import unpack_header
+from audio_output import AudioOutput, detect_backend
+from jitter_buffer import JitterBuffer
+from player import FEED_BYTES, FEED_SECONDS
+from relay_tree import DEFAULT_FANOUT, Relay
+from ring_buffer import RingBuffer
+from udp_receiver import UdpReceiver
 
-BUFFER_SIZE = 1024
+UDP_PORT = 5680             # server 串流的 port（multicast group 也用這個 port）
+BUFFER_SIZE = 2048          # 需大於 header + PCM payload
+RING_BYTES = int(44100 * 2 * 0.2)
 
 class PeerStreamer:
-    def __init__(self, peers, local_port=5681):
+    def __init__(self, peers, local_port=5681, local_ip="127.0.0.1", source=None,
+                 fanout=DEFAULT_FANOUT, discovery=None, group=None, group_port=UDP_PORT, interface=None):
+        """
+        source    串流來源的 (ip, port)；None 表示自己就是來源（呼叫 relay_audio 的那一端）
+        discovery PeerDiscovery；給了就以它的 replica 為 peer 清單
+        group     multicast group（或 mood 名稱）；給了就在 group_port 上 join，listen_audio 收 group 的封包
+        同時收也送的 peer 要先 listen_audio 再轉送，讓子節點看到的來源位址就是自己註冊的 port
+        """
         self.peers = peers
         self.local_port = local_port
         self.running = False
+        if group and not multicast.is_multicast(group):
+            group = multicast.group_for(group)
+        self.group = group
+        if group:
+            self.sock = multicast.open_listener(group, group_port, interface)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.relay = Relay((local_ip, local_port), source, peers, fanout, self.sock, discovery)
+        relay = self.relay
+        metrics.gauge("mooddj_relay_sent_total", lambda: relay.sent, "datagrams forwarded to relay children")
+        metrics.gauge("mooddj_relay_sent_bytes_total", lambda: relay.sent_bytes, "bytes forwarded to relay children")
+        metrics.gauge("mooddj_relay_errors_total", lambda: relay.errors, "relay sendto failures")
+        metrics.gauge("mooddj_relay_children", lambda: len(relay.children), "relay children of this peer")
+
+    def set_peers(self, peers):
+        """沒有 PeerDiscovery 時手動更新清單（會重建樹）"""
+        self.peers = peers
+        self.relay.set_peers(peers)
 
-    # === 傳送音訊資料到其他 peers ===
-    def relay_audio(self, chunk: bytes):
-        for peer in self.peers:
+    # === 傳送音訊資料到中繼樹上的子節點 ===
+    def relay_audio(self, chunk):
+        """chunk 可以是 bytes 或 UdpReceiver 給的 memoryview（直接送出不複製）"""
+        self.relay.forward(chunk)
+
+    # === 收封包：先往下轉送，再放進 jitter buffer ===
+    def receive_loop(self, sock, jbuf):
+        decoders = DecoderSet()
+        receiver = UdpReceiver(sock, slot_size=BUFFER_SIZE)
+        while self.running:
+            try:
+                data = receiver.recv()   # slab 上的 view，不複製
+            except OSError:
+                break                    # stop / leave 關掉了 socket
+            self.relay.relay(data)
             try:
-                ip, port = peer["ip"], peer["port"]
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                    s.sendto(chunk, (ip, port))
-            except Exception as e:
-                print(f"[peer_streamer] Send error: {e}")
+                codec, stream_id, seq, timestamp, payload = unpack_header(data)
+                pcm = decoders.decode(codec, stream_id, payload)
+            except Exception:
+                continue
+            jbuf.push(stream_id, seq, timestamp, pcm)
+
+    def feed(self, jbuf, ring):
+        """jitter buffer → ring buffer；ring 只餵到 FEED_BYTES（同 player.feed_loop），其餘留在 jitter buffer"""
+        while self.running:
+            while self.running and ring.available() >= FEED_BYTES:
+                time.sleep(FEED_SECONDS / 8)
+            payload = jbuf.pop(timeout=0.5)
+            if not payload:
+                continue
+            while self.running and ring.free() < len(payload):
+                time.sleep(len(payload) / 2 / 44100 / 2)
+            ring.write(payload)
 
     # === 收音訊並播放 ===
     def listen_audio(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(("0.0.0.0", self.local_port))
-        print(f"[peer_streamer] Listening UDP on {self.local_port} for P2P stream...")
+        sock = self.sock
+        if self.group:
+            print(f"[peer_streamer] Listening multicast group {self.group} for stream...")
+        else:
+            sock.bind(("0.0.0.0", self.local_port))
+            print(f"[peer_streamer] Listening UDP on {self.local_port} for P2P stream...")
         self.running = True
+        self.jitter_buffer = JitterBuffer()
+        threading.Thread(target=self.receive_loop, args=(sock, self.jitter_buffer), daemon=True).start()
 
-        if BACKEND == "pyaudio":
-            audio = pyaudio.PyAudio()
-            stream = audio.open(format=pyaudio.paInt16, channels=1, rate=44100, output=True)
-            while self.running:
-                data, _ = sock.recvfrom(BUFFER_SIZE)
-                if data:
-                    stream.write(data)
-        else:
-            import sounddevice as sd
-            with sd.OutputStream(samplerate=44100, channels=1, dtype='int16') as stream:
-                while self.running:
-                    data, _ = sock.recvfrom(BUFFER_SIZE)
-                    if data:
-                        samples = np.frombuffer(data, dtype=np.int16)
-                        stream.write(samples)
+        self.ring = RingBuffer(RING_BYTES)
+        output = AudioOutput(detect_backend(), self.ring)
+        output.start()
+        try:
+            self.feed(self.jitter_buffer, self.ring)
+        finally:
+            output.close()
+            try:
+                sock.shutdown(socket.SHUT_RDWR)   # 叫醒卡在 recv 的 receive_loop（只 close 叫不醒）
+            except OSError:
+                pass
+            sock.close()
 
     def start_listener(self):
         threading.Thread(target=self.listen_audio, daemon=True).start()
@@ -68,11 +129,12 @@ class PeerStreamer:
         print("[peer_streamer] Stopped.")
 
 
-def main(peers=None, local_port=5681):
+def main(peers=None, local_port=5681, group=None):
     """
-    Blocking entry point used by the GUI to start a standalone UDP listener.
+    Blocking entry point used by the GUI to start a standalone UDP listener
+    (or a multicast group member when group is given).
     """
-    streamer = PeerStreamer(peers or [], local_port=local_port)
+    streamer = PeerStreamer(peers or [], local_port=local_port, group=group)
     try:
         streamer.listen_audio()
     except KeyboardInterrupt:
@@ -5,88 +5,229 @@ client/player.py
 跨平台 UDP 音樂播放模組：
  - 優先使用 PyAudio（若可用）
  - 若 PyAudio 不可用，則自動改用 sounddevice（macOS / Linux 原生支援）
+ - 音訊 backend 在開始播放時才探測、載入（見 audio_output.detect_backend），import 這個模組很快
+ - 預設收 unicast（127.0.0.1:5680）；--multicast <group 或 mood> 改為 join 該 mood channel 的 multicast group
+ - metrics：http://127.0.0.1:9101/metrics（收包 / 丟包 / 太晚 / jitter buffer 深度…），不再每個封包 print
+ - receiver report：播放中每秒把掉包 / jitter / 緩衝 / 最大 seq 從收音訊的 socket 回報給 server 的 5690 port，
+   server 據此調整送法（補送、封包大小、排程提前），不再回報的 client 會被停送（見 server/feedback.py）
+ - 加密頻道：client.py 把 server 發的頻道 key 交給 stream_keys 後，只收得下加密封包（明文封包一律丟掉）；
+   沒有 key（獨立執行的 player.py）時加密封包丟掉，不會把密文當 PCM 播
+
+用法：
+    python client/player.py
+    python client/player.py --multicast happy
+    python client/player.py --multicast 239.255.77.9 --interface 192.168.1.20
+    python client/player.py --server 192.168.1.10
 """
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # 加入專案根目錄
+import argparse
 import socket
+import threading
+import time
+
+from utils import metrics, multicast
+from utils.codec import DecoderSet
+from utils.packet import is_sealed, unpack_header
+from audio_output import AudioOutput, detect_backend
+from heartbeat import ReceiverReporter
+from jitter_buffer import JitterBuffer
+from ring_buffer import RingBuffer
+from udp_receiver import UdpReceiver
 
 UDP_PORT = 5680
-BUFFER_SIZE = 1024
+SERVER_IP = "127.0.0.1"     # receiver report 送往這台的 heartbeat port
+BUFFER_SIZE = 2048          # 需大於 header + PCM payload
+STATS_INTERVAL = 5
+RING_SECONDS = 0.2          # 音訊 callback 前的 ring buffer 長度
+RING_BYTES = int(44100 * 2 * RING_SECONDS)
+FEED_SECONDS = 0.03         # ring 裡只保持這麼多（≈ 2.6 個 callback），其餘留在 jitter buffer
+FEED_BYTES = int(44100 * 2 * FEED_SECONDS)
+METRICS_PORT = 9101
+
+DECODE_ERRORS = metrics.counter("mooddj_player_decode_errors_total", "packets that failed to decode")
+BAD_PACKETS = metrics.counter("mooddj_player_bad_packets_total", "datagrams with an invalid header")
+AUTH_FAILURES = metrics.counter("mooddj_player_auth_failures_total",
+                                "datagrams rejected by stream encryption (no key, bad tag, or plaintext while keyed)")
+metrics_server = None
+
+# 加密頻道的 key（client.py 收到 "[server] Stream key: ..." 時 set_key）；加密用到時才 import cryptography
+stream_keys = None
+
+
+def get_stream_keys():
+    global stream_keys
+    if stream_keys is None:
+        from utils.encryptor import PacketOpener
+        stream_keys = PacketOpener(slot_size=BUFFER_SIZE)
+    return stream_keys
+
+
+def set_stream_key(algorithm, key):
+    get_stream_keys().set_key(algorithm, key)
 
-def play_stream(sock, url):
+def play_stream(sock, url, server=SERVER_IP, client_id=None, stop=None, report_sock=None):
+    """client.py 使用：在已綁定的 UDP socket 上播放（整個 session 只開一次音訊裝置）
+
+    server / client_id：receiver report 的目的地與 id（client.py 用 Heartbeat 的 id）
+    stop：set 之後 session 結束（關掉音訊輸出與 sock）；report_sock 見 run_session
+    """
     print(f"[player] Starting playback for stream: {url}")
-    while True:
-        data, _ = sock.recvfrom(1024)
-        if data:
-            try:
-                import pyaudio
-                p = pyaudio.PyAudio()
-                stream = p.open(format=pyaudio.paInt16, channels=1, rate=44100, output=True)
-                stream.write(data)
-            except Exception as e:
-                print(f"[player] Error playing audio: {e}")
-                break
+    run_session(sock, stop, server, client_id, report_sock)
 
 # ------------------------------------------------------------
-# 嘗試載入 PyAudio；若失敗，自動使用 sounddevice
+# 網路執行緒：收封包 → 解析 header → 放進 jitter buffer
 # ------------------------------------------------------------
-try:
-    import pyaudio
-    AUDIO_BACKEND = "pyaudio"
-    print("[player] ✅ Using PyAudio backend")
-except Exception as e:
-    print("[player] ⚠️ PyAudio unavailable, fallback to sounddevice:", e)
-    import numpy as np
-    import sounddevice as sd
-    AUDIO_BACKEND = "sounddevice"
+def receive_loop(sock, jbuf, receiver=None, stop=None):
+    decoders = DecoderSet()
+    receiver = receiver or UdpReceiver(sock, slot_size=BUFFER_SIZE)
+    while True:
+        try:
+            data = receiver.recv()   # slab 上的 view，不複製
+        except OSError:
+            break
+        if stop is not None and stop.is_set():
+            break
+        if stream_keys is not None:
+            for held in stream_keys.release():   # key 到之前留著的封包（頻道開頭）
+                push_datagram(held, decoders, jbuf)
+        push_datagram(data, decoders, jbuf)
+
+
+def push_datagram(data, decoders, jbuf):
+    """解密（加密頻道）→ 解析 header → 解碼 → 放進 jitter buffer"""
+    keys = stream_keys
+    if keys is not None or is_sealed(data):
+        keys = keys or get_stream_keys()
+        sealed = is_sealed(data)
+        if keys.aead is None and sealed:
+            # 頻道 key 還在控制連線上：先留著，key 到了再解
+            if not keys.hold(data):
+                AUTH_FAILURES.inc()
+            return
+        if keys.aead is not None:
+            try:
+                if not sealed:
+                    raise ValueError("plaintext packet on an encrypted session")
+                data = keys.open(data)   # 解進 opener 的 slot，之後跟明文封包一樣處理
+            except ValueError as e:
+                AUTH_FAILURES.inc()
+                metrics.log_sampled("auth", f"[player] Dropped packet: {e}")
+                return
+    try:
+        codec, stream_id, seq, timestamp, payload = unpack_header(data)
+    except ValueError:
+        BAD_PACKETS.inc()
+        return
+    try:
+        pcm = decoders.decode(codec, stream_id, payload)
+    except Exception as e:
+        DECODE_ERRORS.inc()
+        metrics.log_sampled("decode", f"[player] Decode failed (codec {codec}): {e}")
+        return
+    jbuf.push(stream_id, seq, timestamp, pcm)
+
+
+def feed_loop(jbuf, ring, stop=None, reporter=None):
+    """播放排程執行緒：jitter buffer → ring buffer；順便送 receiver report
+
+    ring 只餵到 FEED_BYTES：緩衝留在 jitter buffer 裡，它的目標延遲才是真的 reorder 視窗
+    （晚到 / 補送的封包還來得及放回去），underrun 與回報的緩衝量也才反映實際狀況
+    """
+    last_report = time.monotonic()
+    while stop is None or not stop.is_set():
+        while ring.available() >= FEED_BYTES and (stop is None or not stop.is_set()):
+            time.sleep(FEED_SECONDS / 8)
+        payload = jbuf.pop(timeout=0.5)
+        now = time.monotonic()
+        if reporter is not None:
+            reporter.maybe_send(now)
+        if now - last_report >= STATS_INTERVAL:
+            print(f"[player] Jitter buffer: {jbuf.snapshot()} "
+                  f"ring underruns={ring.underruns} overruns={ring.overruns}")
+            last_report = now
+        if not payload:
+            continue
+        # 等到放得下整包再寫，避免截斷封包（每次等半包的播放時間）
+        while ring.free() < len(payload):
+            time.sleep(len(payload) / 2 / 44100 / 2)
+        ring.write(payload)
+
+
+def register_metrics(receiver, jbuf, ring):
+    """這個 session 的計數以 gauge 輸出（讀取時才取值，收包路徑上沒有額外成本）"""
+    global metrics_server
+    metrics.gauge("mooddj_player_packets_received_total", lambda: receiver.packets, "UDP datagrams received")
+    metrics.gauge("mooddj_player_bytes_received_total", lambda: receiver.bytes, "UDP bytes received")
+    metrics.gauge("mooddj_player_truncated_total", lambda: receiver.truncated, "datagrams that filled a slab slot")
+    for key in ("late", "duplicate", "lost", "concealed", "overflow_drops", "underruns", "resets", "played"):
+        metrics.gauge(f"mooddj_jitter_{key}_total", lambda key=key: jbuf.stats[key], f"jitter buffer {key}")
+    metrics.gauge("mooddj_jitter_depth", lambda: len(jbuf.packets), "packets waiting in the jitter buffer")
+    metrics.gauge("mooddj_jitter_ms", lambda: jbuf.jitter * 1000, "RFC 3550 interarrival jitter estimate")
+    metrics.gauge("mooddj_ring_underruns_total", lambda: ring.underruns, "audio callbacks padded with silence")
+    metrics.gauge("mooddj_ring_overruns_total", lambda: ring.overruns, "writes dropped because the ring was full")
+    if metrics_server is None:
+        metrics_server = metrics.serve(METRICS_PORT)
+
+
+def run_session(sock, stop=None, server=SERVER_IP, client_id=None, report_sock=None):
+    """一個播放 session：收包執行緒 + 常駐 callback 輸出 + 排程迴圈（server 為 None 時不送 receiver report）
+
+    report_sock：送 receiver report 的 socket，預設就是收音訊的 sock；
+    multicast 時傳 unicast socket（綁在 group 上的 socket 不該拿來送，server 看到的來源位址也要是 client 自己的）
+    """
+    jbuf = JitterBuffer()
+    ring = RingBuffer(RING_BYTES)
+    receiver = UdpReceiver(sock, slot_size=BUFFER_SIZE)
+    reporter = (ReceiverReporter(report_sock or sock, server, jbuf, ring, client_id=client_id)
+                if server else None)
+    register_metrics(receiver, jbuf, ring)
+    stop = stop or threading.Event()
+    threading.Thread(target=receive_loop, args=(sock, jbuf, receiver, stop), daemon=True).start()
+    output = AudioOutput(detect_backend(), ring)
+    output.start()
+    try:
+        feed_loop(jbuf, ring, stop, reporter)
+    except KeyboardInterrupt:
+        print("[player] Stopped by user.")
+    finally:
+        stop.set()
+        output.close()
+        try:
+            # 只 close 叫不醒卡在 recv 的收包 thread；shutdown 會讓它收到 0 bytes 後看到 stop 離開
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
 
 # ------------------------------------------------------------
 # 主函式：監聽 UDP 音訊封包並播放
 # ------------------------------------------------------------
-def listen_udp():
+def listen_udp(server=SERVER_IP):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind(("127.0.0.1", UDP_PORT))
     print(f"[player] Listening UDP on port {UDP_PORT} ...")
+    run_session(sock, server=server)
 
-    if AUDIO_BACKEND == "pyaudio":
-        # PyAudio 模式：使用 PortAudio 實時輸出
-        audio = pyaudio.PyAudio()
-        stream = audio.open(format=audio.get_format_from_width(2),
-                            channels=1,
-                            rate=44100,
-                            output=True)
-        try:
-            while True:
-                data, _ = sock.recvfrom(BUFFER_SIZE)
-                if data:
-                    print(f"[player] Received {len(data)} bytes")
-                    stream.write(data)
-        except KeyboardInterrupt:
-            print("[player] Stopped by user.")
-        finally:
-            stream.stop_stream()
-            stream.close()
-            audio.terminate()
-            sock.close()
 
-    else:
-        # sounddevice 模式：以 NumPy + CoreAudio 播放
-        try:
-            stream = sd.OutputStream(samplerate=44100, channels=1, dtype='int16')
-            stream.start()
-            while True:
-                data, _ = sock.recvfrom(BUFFER_SIZE)
-                if data:
-                    print(f"[player] Received {len(data)} bytes")
-                    samples = np.frombuffer(data, dtype=np.int16)
-                    stream.write(samples)
-        except KeyboardInterrupt:
-            print("[player] Stopped by user.")
-        finally:
-            stream.stop()
-            stream.close()
-            sock.close()
+def listen_multicast(group, port=UDP_PORT, interface=None, server=SERVER_IP):
+    """join multicast group 後播放；group 可以是位址或 mood 名稱"""
+    if not multicast.is_multicast(group):
+        group = multicast.group_for(group)
+    sock = multicast.open_listener(group, port, interface)
+    print(f"[player] Joined multicast group {group}:{port} ...")
+    run_session(sock, server=server)
 
 # ------------------------------------------------------------
 # 主程式入口
 # ------------------------------------------------------------
 if __name__ == "__main__":
-    listen_udp()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="MoodDJ UDP player")
+    parser.add_argument("--multicast", metavar="GROUP_OR_MOOD", help="join 這個 multicast group（或 mood channel）")
+    parser.add_argument("--interface", help="join multicast 用的本機介面 IP")
+    parser.add_argument("--server", default=SERVER_IP, help="receiver report 送往的 server IP（\"\" 不回報）")
+    args = parser.parse_args()
+    if args.multicast:
+        listen_multicast(args.multicast, interface=args.interface, server=args.server)
+    else:
+        listen_udp(args.server)
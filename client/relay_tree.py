@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+client/relay_tree.py
+-----------------------------------
+P2P 中繼樹（peer_streamer 用）
+ - 以 source 為根、每個節點最多 fanout 個子節點的 k-ary 樹
+ - 節點依 (ip, port) 排序後按層排入（heap 排法：第 i 個節點的子節點是 i*k+1 .. i*k+k），
+   只要各 peer 的清單相同（PeerDiscovery 的 replica），算出來的樹就一樣，不用另外協調
+ - 深度 ⌈log_k N⌉；source 上行只需負擔 k 份，而不是 N 份
+ - Relay：一個節點的轉送端，整個生命週期只用一個 socket；
+   PeerDiscovery 的 version 一變就重建樹，依 (stream_id, seq) 去重，清單短暫不一致時也不會繞圈
+"""
+import socket
+from collections import OrderedDict
+
+from utils import metrics
+from utils.packet import peek_header
+
+DEFAULT_FANOUT = 3
+SEEN_PACKETS = 512      # 去重時記住最近幾個 (stream_id, seq)
+
+
+def peer_key(peer):
+    """peer dict 或 (ip, port) → (ip, port)"""
+    if isinstance(peer, dict):
+        return peer["ip"], int(peer["port"])
+    return peer[0], int(peer[1])
+
+
+class RelayTree:
+    def __init__(self, source, peers=(), fanout=DEFAULT_FANOUT):
+        if fanout < 1:
+            raise ValueError("fanout must be >= 1")
+        self.source = peer_key(source)
+        self.fanout = fanout
+        self.order = []     # [source, 其餘 peer 依 (ip, port) 排序]
+        self.position = {}  # (ip, port) -> 在 order 中的位置
+        self.rebuild(peers)
+
+    def rebuild(self, peers):
+        """peers 變動時重建（O(N log N)）；source 自己出現在清單裡會被略過"""
+        others = sorted({peer_key(p) for p in peers} - {self.source})
+        self.order = [self.source] + others
+        self.position = {key: i for i, key in enumerate(self.order)}
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, key):
+        return peer_key(key) in self.position
+
+    def children(self, key) -> list:
+        """key 要轉送給誰；不在樹上的節點不轉送"""
+        i = self.position.get(peer_key(key))
+        if i is None:
+            return []
+        first = i * self.fanout + 1
+        return self.order[first:first + self.fanout]
+
+    def parent(self, key):
+        i = self.position.get(peer_key(key))
+        if not i:
+            return None
+        return self.order[(i - 1) // self.fanout]
+
+    def depth(self, key) -> int:
+        """source 為 0；不在樹上回傳 -1"""
+        i = self.position.get(peer_key(key))
+        if i is None:
+            return -1
+        depth = 0
+        while i:
+            i = (i - 1) // self.fanout
+            depth += 1
+        return depth
+
+
+class Relay:
+    def __init__(self, local, source=None, peers=(), fanout=DEFAULT_FANOUT, sock=None, discovery=None):
+        """
+        local     自己的 (ip, port)
+        source    串流來源的 (ip, port)；None 表示自己就是來源
+        sock      送出用的 socket（通常就是收音訊的那個）；None 時自己開一個，一直用到 close()
+        discovery PeerDiscovery；給了就以它的清單為準，version 變動時重建樹
+        """
+        self.local = peer_key(local)
+        self.tree = RelayTree(self.local if source is None else source, peers, fanout)
+        self.discovery = discovery
+        self.synced = None          # 建樹時的 discovery.version
+        self.own_sock = sock is None
+        self.sock = sock if sock is not None else socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.children = self.tree.children(self.local)
+        self.seen = OrderedDict()   # 最近轉送過的 (stream_id, seq)
+        self.sent = 0
+        self.sent_bytes = 0
+        self.errors = 0
+        self.rebuilds = 0
+
+    def set_peers(self, peers):
+        self.tree.rebuild(peers)
+        self.children = self.tree.children(self.local)
+        self.rebuilds += 1
+
+    def sync(self) -> bool:
+        """discovery 的清單有變就重建樹；回傳是否重建"""
+        if self.discovery is None or self.discovery.version == self.synced:
+            return False
+        self.synced = self.discovery.version
+        self.set_peers(self.discovery.peers)
+        return True
+
+    def forward(self, datagram) -> int:
+        """把 datagram 原封不動送給所有子節點；回傳成功送出的份數"""
+        self.sync()
+        sent = 0
+        for child in self.children:
+            try:
+                self.sock.sendto(datagram, child)
+            except OSError as e:
+                self.errors += 1
+                metrics.log_sampled(("relay", child), f"[relay] Send error to {child[0]}:{child[1]}: {e}")
+                continue
+            sent += 1
+            self.sent_bytes += len(datagram)
+        self.sent += sent
+        return sent
+
+    def relay(self, datagram) -> int:
+        """收到的封包往下轉送；同一個 (stream_id, seq) 只轉一次（亂序到的照轉）
+
+        加密頻道的封包不解開，照 header 去重後原封不動轉給子節點
+        """
+        try:
+            _, _, stream_id, seq, _ = peek_header(datagram)
+        except ValueError:
+            return 0
+        key = (stream_id, seq)
+        if key in self.seen:
+            return 0
+        self.seen[key] = None
+        if len(self.seen) > SEEN_PACKETS:
+            self.seen.popitem(last=False)
+        return self.forward(datagram)
+
+    def close(self):
+        if self.own_sock:
+            self.sock.close()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+client/ring_buffer.py
+-----------------------------------
+單一生產者 / 單一消費者的 byte ring buffer（給音訊 callback 用）
+ - 記憶體在建立時一次配置好，讀寫都是 memoryview 切片複製，不產生新物件
+ - 不用 lock：head 只由寫入端更新、tail 只由讀取端更新，
+   先複製資料再更新索引，另一端看到的永遠是完整資料
+ - 寫不下的部分丟棄並計入 overruns；讀不夠時補靜音並計入 underruns
+"""
+
+
+class RingBuffer:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.head = 0          # 累計寫入 bytes（只由寫入端修改）
+        self.tail = 0          # 累計讀出 bytes（只由讀取端修改）
+        self.overruns = 0
+        self.overrun_bytes = 0
+        self.underruns = 0
+        self.started = False
+
+    def available(self) -> int:
+        return self.head - self.tail
+
+    def free(self) -> int:
+        return self.capacity - (self.head - self.tail)
+
+    # --------------------------------------------------------
+    # 寫入端（網路 / 播放排程執行緒）
+    # --------------------------------------------------------
+    def write(self, data) -> int:
+        data = memoryview(data).cast("B")
+        n = min(len(data), self.free())
+        if n < len(data):
+            self.overruns += 1
+            self.overrun_bytes += len(data) - n
+        start = self.head % self.capacity
+        first = min(n, self.capacity - start)
+        self.view[start:start + first] = data[:first]
+        if n > first:
+            self.view[:n - first] = data[first:n]
+        self.head += n
+        return n
+
+    # --------------------------------------------------------
+    # 讀取端（音訊 callback）
+    # --------------------------------------------------------
+    def read_into(self, out) -> int:
+        """填滿 out（可寫的 buffer），資料不足的部分補 0；回傳實際讀到的 bytes"""
+        out = memoryview(out).cast("B")
+        n = min(len(out), self.available())
+        start = self.tail % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.view[start:start + first]
+        if n > first:
+            out[first:n] = self.view[:n - first]
+        if n < len(out):
+            out[n:] = bytes(len(out) - n)
+            if self.started:
+                self.underruns += 1
+        elif n:
+            self.started = True
+        self.tail += n
+        return n
+
+    def read(self, size: int) -> bytes:
+        out = bytearray(size)
+        self.read_into(out)
+        return bytes(out)
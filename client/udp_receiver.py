@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+client/udp_receiver.py
+-----------------------------------
+零複製 UDP 接收（player / peer_streamer 共用）
+ - 預先配置一塊 slab（slots × slot_size），以 recv_into / recvfrom_into 直接收進去
+ - 回傳的是 slab 上的 memoryview，不為每個封包建立新的 bytes
+ - slot 以環狀方式重複使用：回傳的 view 在之後再收 slots 個封包前都有效，
+   使用端必須在那之前用完（relay 立刻轉送）或自行複製（jitter buffer 收下時複製）
+"""
+SLOTS = 256
+SLOT_SIZE = 2048
+
+
+class UdpReceiver:
+    def __init__(self, sock, slots=SLOTS, slot_size=SLOT_SIZE):
+        self.sock = sock
+        self.slots = slots
+        self.slot_size = slot_size
+        self.slab = bytearray(slots * slot_size)
+        view = memoryview(self.slab)
+        self.views = [view[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+        self.index = 0
+        self.packets = 0
+        self.bytes = 0
+        self.truncated = 0
+
+    def _next_slot(self):
+        slot = self.views[self.index]
+        self.index = (self.index + 1) % self.slots
+        return slot
+
+    def recv(self):
+        """收一個 datagram，回傳 slab 上的 memoryview（不含來源位址）"""
+        slot = self._next_slot()
+        n = self.sock.recv_into(slot)
+        self._account(n)
+        return slot[:n]
+
+    def recvfrom(self):
+        """收一個 datagram，回傳 (memoryview, addr)"""
+        slot = self._next_slot()
+        n, addr = self.sock.recvfrom_into(slot)
+        self._account(n)
+        return slot[:n], addr
+
+    def _account(self, n):
+        self.packets += 1
+        self.bytes += n
+        if n == self.slot_size:
+            self.truncated += 1   # 可能被截斷（datagram ≥ slot_size）
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+server/channel_hub.py
+-----------------------------------
+共享的 mood 頻道：每個 (mood, codec) 同時最多一條解碼 pipeline，所有選了這個 mood 的 client 共用
+ - client 以 /setudp 登記自己的 UDP endpoint（沒登記時用 <控制連線 IP>:5680）
+ - 第一個訂閱者開啟頻道（一條 thread + 一個 ffmpeg / mmap 讀取），之後的訂閱者只是加入目的地集合，
+   從「現在」開始收（直播位置，不從頭重播）；換 mood 時自動退出舊頻道
+ - 一首播完還有人在聽就無縫接下一首（play_queue.py：背景預取、同一個 stream id、sample 邊界接軌）
+ - 最後一個訂閱者離開（換 mood / 斷線）時頻道停止，ffmpeg 結束
+ - 給了 decoder_pool 時，頻道開播先拿一條預熱好的來源，第一個封包不必等 ffmpeg 啟動
+ - multicast 訂閱者的 endpoint 就是 group 位址：同一頻道不論多少 multicast listener 都只送一份；
+   group 沒有路由時退回該 client 的 unicast endpoint。每個頻道 (mood, codec, secure) 一個 group（group_for），
+   開著的頻道之間不重複：不同頻道的 stream id 不同，共用 group 的 listener 會一直收到交錯的串流
+ - secure 的訂閱者進加密頻道 (mood, codec, secure=True)：頻道每次開播產生一把隨機 key（PacketSealer），
+   封包只加密一次；key 由 server 經控制連線發給訂閱者
+ - receiver report（server/feedback.py）以 stream id 找到頻道，只收頻道 reporters 裡的位址送來的；回報停掉或一直送不到的 endpoint 由 drop_endpoint 退訂
+解碼與排程的成本只跟頻道數有關，跟 listener 數無關；每多一個 unicast listener 只多一次 sendto。
+"""
+import socket
+import threading
+
+from pacer import Pacer
+from play_queue import PlayQueue
+from streamer import PacketSender, StreamStopped, TrackSource
+from utils import multicast
+from utils.encryptor import PacketSealer
+
+
+class Subscribers:
+    """目的地集合（endpoint -> 參照數）；迭代時用不可變的快照，送封包的 thread 不必上鎖"""
+
+    def __init__(self):
+        self.refs = {}
+        self.snapshot = ()
+        self.lock = threading.Lock()
+
+    def add(self, endpoint):
+        with self.lock:
+            self.refs[endpoint] = self.refs.get(endpoint, 0) + 1
+            self.snapshot = tuple(self.refs)
+
+    def remove(self, endpoint) -> int:
+        """回傳剩下的 endpoint 數"""
+        with self.lock:
+            count = self.refs.get(endpoint, 0) - 1
+            if count > 0:
+                self.refs[endpoint] = count
+            else:
+                self.refs.pop(endpoint, None)
+            self.snapshot = tuple(self.refs)
+            return len(self.refs)
+
+    def __iter__(self):
+        return iter(self.snapshot)
+
+    def __contains__(self, endpoint):
+        return endpoint in self.refs
+
+    def __len__(self):
+        return len(self.snapshot)
+
+
+class Channel:
+    def __init__(self, mood, codec, secure=False):
+        self.mood = mood
+        self.codec = codec
+        self.secure = secure
+        self.sealer = PacketSealer() if secure else None
+        self.subscribers = Subscribers()
+        self.reporters = Subscribers()  # 可以送 receiver report 的位址（訂閱者的 unicast endpoint）
+        self.listeners = 0              # 訂閱中的 client 數（multicast client 共用一個 endpoint）
+        self.stop = threading.Event()
+        self.thread = None
+        self.sender = None
+        self.queue = None
+
+    @property
+    def key(self):
+        return (self.mood, self.codec, self.secure)
+
+
+class ChannelHub:
+    def __init__(self, resolve, ttl=multicast.DEFAULT_TTL, loop=True, interface=None,
+                 open_source=TrackSource, crossfade_ms=0, pool=None, resolve_next=None):
+        """
+        resolve      mood -> 音訊 URL（server 用 music_manager.search_youtube_music）
+        ttl / loop / interface 套用在每個頻道的 socket 上（multicast endpoint 用得到）
+        open_source  (url, codec) -> 一首歌的來源（見 streamer.TrackSource）；benchmark 可換成離線版本
+        crossfade_ms 換歌時的交叉淡化（見 play_queue.py）
+        pool         DecoderPool；頻道開播時先向它拿預熱好的來源
+        resolve_next (mood, n) -> 第 n 首的 URL（server 用 music_manager.search_youtube_music_next），換歌時往下播
+        """
+        self.resolve = resolve
+        self.resolve_next = resolve_next
+        self.ttl = ttl
+        self.loop = loop
+        self.interface = interface
+        self.open_source = open_source
+        self.crossfade_ms = crossfade_ms
+        self.pool = pool
+        self.channels = {}              # (mood, codec, secure) -> Channel
+        self.clients = {}               # client key -> (Channel, endpoint)
+        self.report_addrs = {}          # client key -> 這個 client 送 receiver report 的位址
+        self.routes = {}                # multicast group -> 有沒有路由
+        self.groups = {}                # channel key -> multicast group（彼此不重複）
+        self.streams = {}               # stream id -> Channel（sender 建好之後才有）
+        self.lock = threading.Lock()
+        self.pipelines_started = 0
+
+    # --------------------------------------------------------
+    # 訂閱
+    # --------------------------------------------------------
+    def group_for(self, mood, codec, secure=False):
+        """頻道的 multicast group：從 multicast.group_for 算出的位址開始，跳過別的頻道已經在用的；全部用完回傳 None"""
+        key = (mood, codec, secure)
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                taken = set(self.groups.values())
+                prefix, _, last = multicast.group_for(mood, codec, secure).rpartition(".")
+                for i in range(254):
+                    group = f"{prefix}.{(int(last) - 1 + i) % 254 + 1}"
+                    if group not in taken:
+                        self.groups[key] = group
+                        break
+                else:
+                    group = None
+            return group
+
+    def endpoint_for(self, unicast, group=None, port=None):
+        """multicast 可用就用 (group, port)，否則退回 client 自己的 unicast endpoint"""
+        if not group:
+            return unicast
+        port = unicast[1] if port is None else port
+        if group not in self.routes:
+            try:
+                multicast.open_sender(group, port, self.ttl, self.loop, self.interface).close()
+                self.routes[group] = True
+            except OSError as e:
+                print(f"[channel_hub] ⚠️ Multicast to {group} unavailable ({e}), using unicast")
+                self.routes[group] = False
+        return (group, port) if self.routes[group] else unicast
+
+    def subscribe(self, client, mood, codec, endpoint, url=None, secure=False, reporter=None) -> Channel:
+        """client 加入 (mood, codec) 頻道；頻道還沒開就以 url（或 resolve(mood)）開一條 pipeline
+
+        secure：加入加密頻道；回傳的 Channel 的 sealer.key 要發給這個 client
+        reporter：client 送 receiver report 的位址，預設就是 endpoint（multicast 時是 client 自己的 unicast endpoint）
+        """
+        key = (mood, codec, secure)
+        reporter = endpoint if reporter is None else reporter
+        with self.lock:
+            current = self.clients.get(client)
+            if current is not None:
+                if current[0].key == key and current[1] == endpoint and self.report_addrs.get(client) == reporter:
+                    return current[0]
+                self._leave(client)
+            channel = self.channels.get(key)
+            if channel is None:
+                channel = self.channels[key] = Channel(mood, codec, secure)
+            if multicast.is_multicast(endpoint[0]):
+                self.groups.setdefault(key, endpoint[0])   # group_for 之後頻道停過又重開：重新佔住
+            channel.subscribers.add(endpoint)
+            channel.reporters.add(reporter)
+            channel.listeners += 1
+            self.clients[client] = (channel, endpoint)
+            self.report_addrs[client] = reporter
+            if channel.thread is None:
+                channel.thread = threading.Thread(target=self._run, args=(channel, url), daemon=True)
+                channel.thread.start()
+                self.pipelines_started += 1
+                print(f"[channel_hub] ▶️  Channel {mood}/{codec} started")
+            else:
+                print(f"[channel_hub] {client} joined live channel {mood}/{codec} ({channel.listeners} listeners)")
+            return channel
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self._leave(client)
+
+    def drop_endpoint(self, endpoint) -> int:
+        """不再送到這個 endpoint（client 不回報了 / 一直送不到）；回傳退訂的 client 數
+
+        控制連線還在的 client 下一次 /prompt 會重新訂閱
+        """
+        with self.lock:
+            clients = [c for c, (_, e) in self.clients.items() if e == endpoint]
+            for client in clients:
+                self._leave(client)
+        return len(clients)
+
+    def channel_for_stream(self, stream_id):
+        return self.streams.get(stream_id)
+
+    def _leave(self, client):
+        entry = self.clients.pop(client, None)
+        if entry is None:
+            return
+        channel, endpoint = entry
+        channel.subscribers.remove(endpoint)
+        channel.reporters.remove(self.report_addrs.pop(client, endpoint))
+        channel.listeners -= 1
+        if channel.listeners == 0:
+            channel.stop.set()
+            self.channels.pop(channel.key, None)
+            self.groups.pop(channel.key, None)
+            print(f"[channel_hub] ⏹  Channel {channel.mood}/{channel.codec} stopped (no listeners)")
+
+    # --------------------------------------------------------
+    # pipeline
+    # --------------------------------------------------------
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1 if self.loop else 0)
+        if self.interface:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+        sock.bind(("0.0.0.0", 0))
+        return sock
+
+    def _run(self, channel, url):
+        """頻道 thread：一首接一首，直到沒有訂閱者"""
+        sock = self._open_socket()
+        # 整個頻道一個 sender（一個 stream id）：換歌時 client 的 jitter buffer 不重置
+        channel.sender = PacketSender(sock, channel.subscribers, Pacer(), codec=channel.codec, stop=channel.stop,
+                                      sealer=channel.sealer)
+        channel.queue = PlayQueue(self.resolve, channel.mood, channel.codec, self.crossfade_ms,
+                                  open_source=self.open_source, resolve_next=self.resolve_next)
+        with self.lock:
+            self.streams[channel.sender.stream_id] = channel
+        source = self.pool.take(channel.mood, channel.codec) if self.pool is not None else None
+        try:
+            channel.queue.play(channel.sender, url, source)
+        except StreamStopped:
+            pass
+        except Exception as e:
+            print(f"[channel_hub] Channel {channel.mood}/{channel.codec} failed: {e}")
+        finally:
+            sock.close()
+            with self.lock:
+                if self.streams.get(channel.sender.stream_id) is channel:
+                    del self.streams[channel.sender.stream_id]
+                # 失敗結束時把還在的訂閱者清掉，下一次 /prompt 會重開頻道
+                if self.channels.get(channel.key) is channel:
+                    del self.channels[channel.key]
+                    self.groups.pop(channel.key, None)
+                    for client in [c for c, (ch, _) in self.clients.items() if ch is channel]:
+                        del self.clients[client]
+                        self.report_addrs.pop(client, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "channels": len(self.channels),
+                "listeners": sum(c.listeners for c in self.channels.values()),
+                "endpoints": sum(len(c.subscribers) for c in self.channels.values()),
+                "pipelines_started": self.pipelines_started,
+            }
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+server/decoder_pool.py
+-----------------------------------
+預熱的解碼 pipeline：每個 (mood, codec) 先備好幾條「已經 resolve、ffmpeg 已經啟動、已經讀進幾秒」的來源
+ - 頻道開播（某個 mood 的第一個 /prompt）時直接拿一條備好的，第一個封包馬上送出，
+   不必再等 ffmpeg 啟動、HTTP 連線、probe
+ - 被拿走後背景 thread 立刻補一條；預算：同時待命的 ffmpeg process 數、預讀 buffer 的總 bytes
+ - 只在串流 URL 快過期時（music_manager.url_expiry，提前 REFRESH_MARGIN）關掉重開，沒人聽也不會每隔幾分鐘
+   重新解析、重抓、中斷快取寫入；ffmpeg 自己異常結束（例如 HTTP 連線被斷）的待命也換掉
+ - 只預熱 server 實際能產生的 codec（utils.codec.server_codecs：ffmpeg 沒有 libopus 就不開 opus）
+ - PCM 快取命中的來源本身就是 mmap，開啟不用等，只佔一個位置不預讀
+"""
+import threading
+import time
+
+from music_manager import REFRESH_MARGIN, url_expiry
+from pacer import BYTE_RATE
+from streamer import TrackSource
+from utils import metrics
+from utils.codec import server_codecs
+
+PER_MOOD = 1                  # 每個 (mood, codec) 待命幾條
+BUFFER_SECONDS = 3.0          # 每條預讀幾秒
+MAX_PROCESSES = 8             # 同時待命的 ffmpeg 上限
+MAX_BYTES = 16 * 1024 ** 2    # 預讀 buffer 總量上限
+EXPIRY_MARGIN = REFRESH_MARGIN   # URL 剩不到這麼久就過期時重開（跟 TrackCache 提前刷新的時間一樣）
+OPUS_BYTE_RATE = 64000 // 8   # OPUS_BITRATE 64k 的 bytes/s（估預讀量用）
+
+HITS = metrics.counter("mooddj_warm_pool_hits_total", "channel starts served by a warm decoder")
+MISSES = metrics.counter("mooddj_warm_pool_misses_total", "channel starts that had to open a decoder")
+
+
+class WarmSource:
+    """開好、預讀了一段的來源；read 先吐預讀的 bytes，再接著讀原本的來源"""
+
+    def __init__(self, mood, source, buffer_bytes, expires_at=None):
+        self.mood = mood
+        self.source = source
+        self.codec = source.codec
+        self.url = getattr(source, "url", None)
+        self.buffered = bytearray()
+        while len(self.buffered) < buffer_bytes:
+            chunk = source.read(min(65536, buffer_bytes - len(self.buffered)))
+            if not chunk:
+                break
+            self.buffered += chunk
+        self.offset = 0
+        self.expires_at = expires_at     # 串流 URL 過期的 unix time；None 表示不會過期
+
+    @property
+    def process(self):
+        return getattr(self.source, "process", None)
+
+    def failed(self) -> bool:
+        """ffmpeg 已經以錯誤結束（HTTP 連線被斷、URL 失效）：這條待命放不出來了"""
+        process = self.process
+        return process is not None and process.poll() not in (None, 0)
+
+    def duration(self):
+        return getattr(self.source, "duration", lambda: None)()
+
+    def read(self, n):
+        """一定湊滿 n bytes（除非到結尾）：Ogg 拆包需要剛好的長度"""
+        if self.offset >= len(self.buffered):
+            return self.source.read(n)
+        chunk = bytes(self.buffered[self.offset:self.offset + n])
+        self.offset += len(chunk)
+        if self.offset >= len(self.buffered):
+            self.buffered = bytearray()
+            self.offset = 0
+            if len(chunk) < n:
+                chunk += self.source.read(n - len(chunk))
+        return chunk
+
+    def close(self):
+        self.source.close()
+
+
+class DecoderPool:
+    def __init__(self, resolve, moods, codecs=None, per_mood=PER_MOOD, buffer_seconds=BUFFER_SECONDS,
+                 max_processes=MAX_PROCESSES, max_bytes=MAX_BYTES, expiry_margin=EXPIRY_MARGIN,
+                 open_source=TrackSource, clock=time.time):
+        """
+        resolve      mood -> 音訊 URL（同 ChannelHub）
+        moods        要預熱的 mood；codecs 要預熱的 codec（依序補，預算不夠時排後面的就不補），
+                     None 表示 start() 時用 server_codecs()
+        open_source  (url, codec) -> 來源（見 streamer.TrackSource）；benchmark 可換成離線版本
+        clock        跟 URL 的 expire 比的 unix time；benchmark 可換成假時鐘
+        """
+        self.resolve = resolve
+        self.moods = list(moods)
+        self.per_mood = per_mood
+        self.buffer_seconds = buffer_seconds
+        self.max_processes = max_processes
+        self.max_bytes = max_bytes
+        self.expiry_margin = expiry_margin
+        self.open_source = open_source
+        self.clock = clock
+        self.keys, self.standby = [], {}
+        if codecs is not None:
+            self._set_codecs(codecs)
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.hits = 0
+        self.misses = 0
+        self.opened = 0
+        self.refreshed = 0
+
+    def _set_codecs(self, codecs):
+        self.keys = [(mood, codec) for codec in codecs for mood in self.moods]
+        self.standby = {key: [] for key in self.keys}
+
+    def start(self):
+        if not self.running:
+            if not self.keys:
+                self._set_codecs(server_codecs())
+            self.running = True
+            threading.Thread(target=self._fill_loop, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
+        with self.lock:
+            sources = [s for pool in self.standby.values() for s in pool]
+            for pool in self.standby.values():
+                pool.clear()
+        for source in sources:
+            source.close()
+
+    def take(self, mood, codec):
+        """拿一條待命的來源（沒有就回傳 None，呼叫端自己開）；拿走後背景補一條"""
+        with self.lock:
+            pool = self.standby.get((mood, codec))
+            source = pool.pop(0) if pool else None
+        if source is None:
+            self.misses += 1
+            MISSES.inc()
+            return None
+        self.hits += 1
+        HITS.inc()
+        self.wake.set()
+        return source
+
+    # --------------------------------------------------------
+    # 背景補貨
+    # --------------------------------------------------------
+    def _usage(self):
+        sources = [s for pool in self.standby.values() for s in pool]
+        processes = sum(1 for s in sources if s.process is not None and s.process.poll() is None)
+        return processes, sum(len(s.buffered) for s in sources)
+
+    def _buffer_bytes(self, codec):
+        return int(self.buffer_seconds * (BYTE_RATE if codec == "pcm" else OPUS_BYTE_RATE))
+
+    def _stale(self, source, now) -> bool:
+        if source.failed():
+            return True
+        return source.expires_at is not None and source.expires_at - now < self.expiry_margin
+
+    def _expire(self):
+        """關掉 URL 快過期、或 ffmpeg 已經失敗的待命（之後由 _fill_one 補）"""
+        now = self.clock()
+        expired = []
+        with self.lock:
+            for pool in self.standby.values():
+                expired += [s for s in pool if self._stale(s, now)]
+                pool[:] = [s for s in pool if not self._stale(s, now)]
+        self.refreshed += len(expired)
+        for source in expired:
+            source.close()
+
+    def _fill_one(self):
+        """補一條最缺的；預算不夠或都滿了回傳 False"""
+        with self.lock:
+            processes, used = self._usage()
+            missing = [key for key in self.keys if len(self.standby[key]) < self.per_mood]
+        for mood, codec in missing:
+            need = self._buffer_bytes(codec)
+            if processes >= self.max_processes or used + need > self.max_bytes:
+                return False
+            try:
+                url = self.resolve(mood)
+                source = self.open_source(url, codec)
+                # 快取命中（mmap）開啟本來就不用等，不預讀，也不會過期
+                cached = getattr(source, "mm", None) is not None
+                warm = WarmSource(mood, source, 0 if cached else need,
+                                  None if cached else url_expiry(url, self.clock()))
+            except Exception as e:
+                print(f"[decoder_pool] ⚠️ Warming {mood}/{codec} failed: {e}")
+                continue
+            self.opened += 1
+            with self.lock:
+                if self.running:
+                    self.standby[(mood, codec)].append(warm)
+                    return True
+            warm.close()
+            return False
+        return False
+
+    def _fill_loop(self):
+        while self.running:
+            self._expire()
+            while self.running and self._fill_one():
+                pass
+            self.wake.wait(timeout=5.0)
+            self.wake.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            processes, used = self._usage()
+            standby = sum(len(pool) for pool in self.standby.values())
+        return {"standby": standby, "processes": processes, "buffered_bytes": used,
+                "hits": self.hits, "misses": self.misses, "opened": self.opened, "refreshed": self.refreshed}
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+server/feedback.py
+-----------------------------------
+receiver report（player 每秒一個，格式見 utils/heartbeat.py）→ 依 client 的實際收聽狀況調整頻道的送法
+ - 每個回報者（以來源位址區分，就是 server 送音訊的 endpoint）留著上一份回報，兩份之間算出：
+   * 網路掉包率 = 1 - 收到的 datagram 數 / (新的 seq 數 × 每個 seq 送了幾份)，補送的那幾份也算進去，
+     所以開了補送之後量到的仍是網路本身的掉包率，不會因為洞都補上了就誤判成網路變好；
+     跟上一個估計各半平均（LOSS_GAIN），一個回報區間剛好多掉幾個不會直接跳兩級
+   * 播放掉包率 = 補償掉的封包數 / 新的 seq 數（補送之後還剩下的洞，給 summary / benchmark 看）
+   * 緩衝是否見底：underrun 次數增加，或緩衝低於 LOW_BUFFER_MS（加入後前 WARMUP_REPORTS 份不算，那時還在預緩衝）
+ - 三個旋鈕，都有遲滯：一份壞回報就升一級，連續 CLEAN_REPORTS 份乾淨的回報才降一級
+   * 補送（每個 endpoint）：每個新封包後面再補送前 1 / 2 個封包（PacketSender.redundancy），只送給掉包的 endpoint；
+     補 r 份之後預期還剩 loss^(r+1) 的洞，這個值 ≥ RESIDUAL_UP 才升一級（10% 掉包補 1 份就夠，20% 才補 2 份）；
+     multicast listener 的回報套用到頻道的 group endpoint
+   * 封包大小（每個頻道，只有 PCM）：頻道裡超過 SMALL_SHARE_UP 的回報者在補送時改成 SMALL_PACKET，掉一包只少 5.8 ms，
+     補送的那份也早一點到；降到 SMALL_SHARE_DOWN 以下才改回來。封包數是整個頻道一起變成 4 倍，
+     所以一個掉包的 listener 只拿到自己的補送，不會讓共用頻道的每個訂閱者都多收 4 倍的封包
+   * 排程提前（每個頻道）：有人緩衝見底時 pacer.lead 加 LEAD_STEP，多出來的那段立刻送出，client 不用等即時速度慢慢補；
+     上限 MAX_LEAD 在 jitter buffer 的餘裕（2 × 最小延遲）之內，提前送到的不會被當成積太多丟掉
+   頻道是共用的：提前量取頻道裡最需要的那個回報者
+ - 只收頻道訂閱者送來的回報（channel.reporters：unicast 是音訊的 endpoint，multicast 是 client 自己的 unicast endpoint）；
+   其他位址、或 stream id 對不到頻道的回報直接丟掉，偽造的回報不能替別人開補送、也不能把別人的 endpoint 記成自己的
+ - 回報過又停了 timeout 秒的 unicast endpoint、sendto 連續失敗 FAIL_LIMIT 個封包的 endpoint 從頻道退訂，不再對它送；
+   從來沒回報過的 client（舊版 player）不會因此被退訂
+ - 全部跑在 server 的 event loop 上：liveness.PingProtocol 收回報，liveness.run_ticker 每秒呼叫 expire
+"""
+import time
+
+from pacer import PACKET_SIZE
+from streamer import MAX_REDUNDANCY
+from utils import metrics, multicast
+from utils.packet import seq_diff
+
+REPORT_TIMEOUT = 10.0   # 秒；回報過的 client 超過這麼久沒回報就退訂（player 每秒回報一次）
+FAIL_LIMIT = 100        # sendto 連續失敗這麼多個封包（PCM 約 1 秒）就退訂
+RESIDUAL_UP = 0.02      # 補送之後預期還剩的掉包率 ≥ 2%：補送升一級
+LOSS_DOWN = 0.01        # < 1% 且緩衝正常才算乾淨的回報
+LOSS_GAIN = 0.5         # 掉包率估計的平滑係數
+CLEAN_REPORTS = 5       # 連續幾份乾淨的回報才降一級
+LOW_BUFFER_MS = 20.0
+WARMUP_REPORTS = 3      # 加入頻道後前幾份回報不看緩衝（player 還在預緩衝、填 ring）
+LEAD_STEP = 0.02        # 秒
+MAX_LEAD = 0.04
+SMALL_PACKET = 512
+SMALL_SHARE_UP = 0.5    # 超過一半的回報者在補送：頻道改送小封包
+SMALL_SHARE_DOWN = 0.25 # 降到四分之一以下（含）才改回 PACKET_SIZE
+
+REPORTS = metrics.counter("mooddj_receiver_reports_total", "receiver reports received from players")
+REJECTED = metrics.counter("mooddj_receiver_reports_rejected_total",
+                           "receiver reports ignored because the source is not subscribed to the stream")
+ADAPTATIONS = metrics.counter("mooddj_feedback_adaptations_total", "redundancy / lead changes made from reports")
+DROPPED = metrics.counter("mooddj_feedback_dropped_endpoints_total",
+                          "endpoints unsubscribed because reports stopped or sendto kept failing")
+
+
+class ReceiverState:
+    __slots__ = ("addr", "client_id", "stream_id", "channel", "highest_seq", "received", "lost", "underruns",
+                 "jitter_ms", "buffer_ms", "loss", "residual", "redundancy", "lead", "clean", "reports",
+                 "last_seen")
+
+    def __init__(self, addr, client_id, now):
+        self.addr = addr
+        self.client_id = client_id
+        self.stream_id = None
+        self.channel = None
+        self.highest_seq = 0
+        self.received = 0
+        self.lost = 0
+        self.underruns = 0
+        self.jitter_ms = 0.0
+        self.buffer_ms = 0.0
+        self.loss = 0.0          # 網路掉包率（平滑過）
+        self.residual = 0.0      # 播放掉包率（補送之後）
+        self.redundancy = 0
+        self.lead = 0.0
+        self.clean = 0
+        self.reports = 0
+        self.last_seen = now
+
+
+class Feedback:
+    def __init__(self, hub, timeout=REPORT_TIMEOUT, fail_limit=FAIL_LIMIT, clock=time.monotonic):
+        """hub：channel_hub.ChannelHub（以 stream id 找頻道、退訂 endpoint）"""
+        self.hub = hub
+        self.timeout = timeout
+        self.fail_limit = fail_limit
+        self.clock = clock
+        self.receivers = {}      # 來源位址 -> ReceiverState
+        self.members = {}        # Channel -> 這個頻道的 ReceiverState 集合
+        self.dropped_total = 0
+
+    # --------------------------------------------------------
+    # 收回報
+    # --------------------------------------------------------
+    def receive(self, report, addr, now=None):
+        """report 是 heartbeat.unpack_report 的結果；回傳該回報者的 ReceiverState，不是訂閱者送來的回報回傳 None"""
+        client_id, stream_id, highest_seq, received, lost, underruns, jitter_ms, buffer_ms = report
+        now = self.clock() if now is None else now
+        REPORTS.inc()
+        channel = self.hub.channel_for_stream(stream_id)
+        if channel is None or addr not in channel.reporters:
+            REJECTED.inc()
+            metrics.log_sampled(("feedback", "rejected"),
+                                f"[feedback] Ignoring receiver report from {addr}: not subscribed to stream {stream_id}")
+            return None
+        state = self.receivers.get(addr)
+        if state is None:
+            state = self.receivers[addr] = ReceiverState(addr, client_id, now)
+        changed = False
+        if state.stream_id != stream_id or state.channel is not channel:
+            # 換頻道 / 頻道重開：這份回報只當基準，旋鈕歸零
+            self._leave(state)
+            state.stream_id, state.channel = stream_id, channel
+            state.redundancy, state.lead, state.clean, state.reports, state.loss = 0, 0.0, 0, 0, 0.0
+            self.members.setdefault(channel, set()).add(state)
+            changed = True
+        else:
+            expected = seq_diff(highest_seq, state.highest_seq)
+            if expected > 0:
+                copies = 1 + state.redundancy
+                got = (received - state.received) & 0xFFFFFFFF
+                loss = min(1.0, max(0.0, 1 - got / (expected * copies)))
+                state.loss += (loss - state.loss) * LOSS_GAIN
+                state.residual = min(1.0, ((lost - state.lost) & 0xFFFFFFFF) / expected)
+                starving = state.reports >= WARMUP_REPORTS and (underruns != state.underruns
+                                                                 or buffer_ms < LOW_BUFFER_MS)
+                changed = self._adapt(state, starving)
+        state.client_id = client_id
+        state.highest_seq, state.received, state.lost, state.underruns = highest_seq, received, lost, underruns
+        state.jitter_ms, state.buffer_ms = jitter_ms, buffer_ms
+        state.reports += 1
+        state.last_seen = now
+        if changed:
+            self._apply(channel)
+        return state
+
+    def _adapt(self, state, starving) -> bool:
+        before = (state.redundancy, state.lead)
+        if state.loss ** (state.redundancy + 1) >= RESIDUAL_UP:
+            state.redundancy = min(MAX_REDUNDANCY, state.redundancy + 1)
+        if starving:
+            state.lead = min(MAX_LEAD, state.lead + LEAD_STEP)
+        if state.loss < LOSS_DOWN and not starving:
+            state.clean += 1
+            if state.clean >= CLEAN_REPORTS:
+                state.clean = 0
+                state.redundancy = max(0, state.redundancy - 1)
+                state.lead = max(0.0, state.lead - LEAD_STEP)
+        else:
+            state.clean = 0
+        if (state.redundancy, state.lead) == before:
+            return False
+        ADAPTATIONS.inc()
+        return True
+
+    def _apply(self, channel):
+        """把頻道裡所有回報者的需求合成這個頻道的送法"""
+        sender, queue = channel.sender, channel.queue
+        if sender is None:
+            return
+        members = self.members.get(channel, ())
+        subscribers = set(channel.subscribers)
+        groups = [e for e in subscribers if multicast.is_multicast(e[0])]
+        redundancy = {}
+        for state in members:
+            if state.redundancy:
+                for target in ((state.addr,) if state.addr in subscribers else groups):
+                    redundancy[target] = max(redundancy.get(target, 0), state.redundancy)
+        sender.redundancy = redundancy      # 換成新的 dict：送封包的 thread 不必上鎖
+        sender.pacer.lead = max((s.lead for s in members), default=0.0)
+        if queue is not None and channel.codec == "pcm":
+            share = sum(1 for s in members if s.redundancy) / max(1, len(members))
+            small = queue.packet_size == SMALL_PACKET
+            queue.packet_size = (SMALL_PACKET if share > SMALL_SHARE_UP or (small and share > SMALL_SHARE_DOWN)
+                                 else PACKET_SIZE)
+
+    def forget(self, addr):
+        """client 已斷線（liveness 到期）：丟掉它的回報狀態，頻道的送法重新計算"""
+        state = self.receivers.pop(addr, None)
+        if state is not None:
+            self._leave(state)
+
+    def _leave(self, state):
+        channel = state.channel
+        if channel is None:
+            return
+        members = self.members.get(channel)
+        if members is not None:
+            members.discard(state)
+            if not members:
+                del self.members[channel]
+        state.channel = None
+        self._apply(channel)
+
+    # --------------------------------------------------------
+    # 到期
+    # --------------------------------------------------------
+    def expire(self, now=None) -> list:
+        """退訂不再回報 / 一直送不到的 endpoint；回傳這次退訂的 endpoint"""
+        now = self.clock() if now is None else now
+        dropped = []
+        for addr, state in list(self.receivers.items()):
+            if now - state.last_seen > self.timeout:
+                del self.receivers[addr]
+                self._leave(state)
+                if self.hub.drop_endpoint(addr):
+                    dropped.append(addr)
+        for channel in list(self.hub.channels.values()):
+            sender = channel.sender
+            if sender is None:
+                continue
+            for endpoint, failures in dict(sender.failures).items():
+                if failures >= self.fail_limit and not multicast.is_multicast(endpoint[0]):
+                    sender.failures.pop(endpoint, None)
+                    if self.hub.drop_endpoint(endpoint):
+                        dropped.append(endpoint)
+        self.dropped_total += len(dropped)
+        DROPPED.inc(len(dropped))
+        return dropped
+
+    # --------------------------------------------------------
+    # 查詢
+    # --------------------------------------------------------
+    def get(self, addr):
+        return self.receivers.get(addr)
+
+    def __len__(self):
+        return len(self.receivers)
+
+    def summary(self) -> dict:
+        states = list(self.receivers.values())
+        losses = sorted(s.loss for s in states)
+        return {
+            "receivers": len(states),
+            "loss_p50": losses[len(losses) // 2] if losses else None,
+            "loss_max": losses[-1] if losses else None,
+            "residual_max": max((s.residual for s in states), default=None),
+            "redundant": sum(1 for s in states if s.redundancy),
+            "lead_ms": max((s.lead for s in states), default=0.0) * 1000,
+            "dropped": self.dropped_total,
+        }
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+server/liveness.py
+-----------------------------------
+client 存活追蹤（取代 5690 port 上「一條心跳連線一個 thread」的做法）
+ - LivenessTable：client -> 最後一次看到的時間、RTT、來源位址
+   以 timer wheel 管理到期時間：touch 只把 client 從一個槽搬到另一個槽（O(1)），
+   每個 tick 只看「這一格」裡的 client，成本與到期數成正比，跟總 client 數無關
+ - 三種訊號都算活著：
+   * 控制連線上的任何 frame（server.handle_client 呼叫 touch）
+   * UDP ping（PingProtocol，格式見 utils/heartbeat.py），server 回 pong，client 回報 RTT
+   * player 的 receiver report（同一個 port，不回覆）；回報內容交給 server/feedback.py 調整送法，
+     feedback 不收（來源不是頻道的訂閱者）的回報不算
+ - 到期的 client 交給 on_expire（server.py 停止送音訊給它、清掉它的回報狀態）；
+   receiver report 的來源位址就是 client 收音訊的 endpoint，記在 ClientState.endpoint
+ - 全部跑在 server 的 asyncio event loop 裡，一萬個 client 也只有一個 socket、零個額外 thread
+"""
+import asyncio
+import math
+import time
+
+from utils import heartbeat, metrics
+
+TIMEOUT = 15.0     # 秒；超過這麼久沒訊號就視為斷線（client 預設每 5 秒 ping 一次）
+TICK = 1.0         # 秒；到期檢查的粒度
+
+
+class ClientState:
+    __slots__ = ("client_id", "addr", "endpoint", "first_seen", "last_seen", "rtt_ms", "pings", "deadline")
+
+    def __init__(self, client_id, addr, now):
+        self.client_id = client_id
+        self.addr = addr
+        self.endpoint = None     # 音訊 endpoint（receiver report 的來源位址）
+        self.first_seen = now
+        self.last_seen = now
+        self.rtt_ms = None
+        self.pings = 0
+        self.deadline = 0
+
+
+class LivenessTable:
+    def __init__(self, timeout=TIMEOUT, tick=TICK, clock=time.monotonic):
+        self.timeout = timeout
+        self.tick_seconds = tick
+        self.clock = clock
+        self.ticks = math.ceil(timeout / tick)
+        self.wheel = [set() for _ in range(self.ticks + 2)]
+        self.clients = {}                      # client_id -> ClientState
+        self.cursor = self._tick_of(clock())   # 最後一個處理過的 tick
+        self.expired_total = 0
+
+    def _tick_of(self, now):
+        return int(now / self.tick_seconds)
+
+    def _slot(self, tick):
+        return self.wheel[tick % len(self.wheel)]
+
+    # --------------------------------------------------------
+    # 更新
+    # --------------------------------------------------------
+    def touch(self, client_id, addr=None, rtt_ms=None, now=None):
+        """收到 client 的任何訊號；回傳該 client 的 ClientState"""
+        now = self.clock() if now is None else now
+        state = self.clients.get(client_id)
+        if state is None:
+            state = self.clients[client_id] = ClientState(client_id, addr, now)
+        else:
+            self._slot(state.deadline).discard(client_id)
+            state.last_seen = now
+            if addr is not None:
+                state.addr = addr
+        if rtt_ms is not None:
+            state.rtt_ms = rtt_ms
+        state.pings += 1
+        # +1：deadline 所在的 tick 結束時，距離 last_seen 一定已超過 timeout
+        state.deadline = self._tick_of(now) + self.ticks + 1
+        self._slot(state.deadline).add(client_id)
+        return state
+
+    def remove(self, client_id):
+        """client 主動離開（例如控制連線正常關閉）"""
+        state = self.clients.pop(client_id, None)
+        if state is not None:
+            self._slot(state.deadline).discard(client_id)
+        return state
+
+    def tick(self, now=None):
+        """處理到目前為止所有到期的槽；回傳這次到期的 ClientState 清單"""
+        target = self._tick_of(self.clock() if now is None else now)
+        expired = []
+        # 太久沒 tick：整圈掃一次就夠了
+        cursor = max(self.cursor, target - len(self.wheel))
+        while cursor < target:
+            cursor += 1
+            slot = self._slot(cursor)
+            for client_id in [c for c in slot if self.clients[c].deadline <= target]:
+                slot.discard(client_id)
+                expired.append(self.clients.pop(client_id))
+        self.cursor = target
+        self.expired_total += len(expired)
+        return expired
+
+    # --------------------------------------------------------
+    # 查詢
+    # --------------------------------------------------------
+    def get(self, client_id):
+        return self.clients.get(client_id)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def snapshot(self, limit=None) -> list:
+        """[{client_id, addr, age_s, rtt_ms, pings}]，依最後看到的時間由新到舊"""
+        now = self.clock()
+        states = sorted(self.clients.values(), key=lambda s: s.last_seen, reverse=True)
+        return [{"client_id": s.client_id, "addr": s.addr, "age_s": now - s.last_seen,
+                 "rtt_ms": s.rtt_ms, "pings": s.pings} for s in states[:limit]]
+
+    def summary(self) -> dict:
+        rtts = sorted(s.rtt_ms for s in self.clients.values() if s.rtt_ms is not None)
+        return {
+            "clients": len(self.clients),
+            "expired": self.expired_total,
+            "rtt_p50_ms": rtts[len(rtts) // 2] if rtts else None,
+            "rtt_max_ms": rtts[-1] if rtts else None,
+        }
+
+
+class PingProtocol(asyncio.DatagramProtocol):
+    """UDP ping -> touch + pong（同一個 datagram 改 kind 後原路送回）；receiver report -> touch + feedback"""
+
+    def __init__(self, table, feedback=None):
+        self.table = table
+        self.feedback = feedback
+        self.transport = None
+        self.bad = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if heartbeat.is_report(data):
+            report = heartbeat.unpack_report(data)
+            # 只有 feedback 收下的回報（來源是頻道的訂閱者）才算存活：任何人都能送 UDP，偽造的回報不能替別的 client 續命，
+            # 也不能把別人的 endpoint 記成這個 id 的（到期時會被退訂）
+            if self.feedback is not None and self.feedback.receive(report, addr) is None:
+                return
+            self.table.touch(report[0]).endpoint = addr
+            return
+        try:
+            kind, client_id, seq, sent, rtt_ms = heartbeat.unpack(data)
+        except ValueError:
+            self.bad += 1
+            return
+        if kind != heartbeat.PING:
+            return
+        self.table.touch(client_id, addr, rtt_ms)
+        self.transport.sendto(heartbeat.PONG + data[2:], addr)
+
+
+async def run_ticker(table, interval=TICK, feedback=None, on_expire=None):
+    """定期清掉到期的 client 與不再回報的 endpoint（掛在 server 的 event loop 上）
+
+    on_expire(expired)：到期的 ClientState 清單，由 server 停止對它們的串流
+    """
+    while True:
+        await asyncio.sleep(interval)
+        expired = table.tick()
+        if expired:
+            if on_expire is not None:
+                on_expire(expired)
+            metrics.log_sampled(("liveness", "expired"),
+                                f"[liveness] {len(expired)} client(s) timed out, {len(table)} alive")
+        if feedback is not None:
+            dropped = feedback.expire()
+            if dropped:
+                metrics.log_sampled(("liveness", "dropped"),
+                                    f"[liveness] Stopped streaming to {len(dropped)} endpoint(s) "
+                                    f"(reports stopped or sendto kept failing)")
+
+
+async def start(table, host, port=heartbeat.HEARTBEAT_PORT, feedback=None, on_expire=None):
+    """開 UDP ping endpoint 與到期 ticker；回傳 (transport, ticker task)
+
+    feedback：server/feedback.py 的 Feedback；給了就處理 receiver report
+    on_expire：見 run_ticker
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: PingProtocol(table, feedback),
+                                                       local_addr=(host, port))
+    ticker = asyncio.create_task(run_ticker(table, table.tick_seconds, feedback, on_expire))
+    return transport, ticker
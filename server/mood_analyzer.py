@@ -1,12 +1,203 @@
 # -*- coding: utf-8 -*-
+"""
+server/mood_analyzer.py
+-----------------------------------
+以關鍵字權重判斷心情
+功能：
+- 以 split() 斷詞，整個關鍵字表編成一個 token -> [(mood, weight)] 的索引，
+  每個 prompt 只掃一次，不會再有 "good" 命中 "goodbye" 這種子字串誤判
+- 帶標點的字（"good!"、"sad,tired"）第一次遇到時拆開解析，結果同樣快取
+- 容許常見字尾（crying -> cry、running -> run、loved -> love、dances -> dance），
+  字尾解析的結果快取在索引裡，同一個字只解析一次
+- 每個心情加總權重，回傳信心分佈；analyze_text 仍回傳分數最高的心情
+- analyze_many(prompts) 一次處理整批：整批接成一個字串只做一次 lower / split，
+  沒見過的字整批一起解析（一次 lock），再一路查表累加，prompt 之間以分隔 token 切開
+- token 快取由 analyze_text（executor thread）與 analyze_many 共用：查表不上鎖，未命中的寫入才上鎖
+- 關鍵字表在 mood_keywords.json，檔案改了會自動重新載入，不用重啟 server
+"""
+import json
+import os
+import string
+import threading
+import time
+
+KEYWORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mood_keywords.json")
+RELOAD_CHECK_INTERVAL = 1.0   # 最多每秒 stat 一次關鍵字檔
+SMOOTHING = 0.1               # 信心分佈的平滑值（沒有任何命中時為均勻分佈）
+SUFFIXES = ("ing", "ed", "er", "es", "s", "ly", "d")
+TOKEN_CACHE_MAX = 50000       # 字尾解析快取上限，超過就清空重來
+PUNCTUATION = str.maketrans({c: " " for c in string.punctuation})   # 只在快取未命中時使用
+SEPARATOR = "\x00"            # analyze_many 接字串時 prompt 之間的分隔 token
+BOUNDARY = ((0, 0.0),)        # 分隔 token 在快取裡的值：批次時以 is 判斷；單一 prompt 碰到時只加 0
+
+
+class MoodClassifier:
+    def __init__(self, path=KEYWORDS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.cache_lock = threading.Lock()   # token 快取的寫入（清空 / 補上未命中的字）
+        self.mtime = None
+        self.last_check = 0.0
+        self.load()
+
+    # --------------------------------------------------------
+    # 關鍵字表載入 / 熱更新
+    # --------------------------------------------------------
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            table = json.load(f)
+        moods = list(table["moods"])
+        index = {}
+        for i, mood in enumerate(moods):
+            for keyword, weight in table["moods"][mood].items():
+                index.setdefault(keyword.lower(), []).append((i, float(weight)))
+        # 一次換掉整組狀態，讀取端不用 lock；第四項是 token 解析快取（含未命中的字）
+        self.state = (moods, index, table.get("default", moods[0]), self._base_cache(index))
+        self.mtime = os.stat(self.path).st_mtime
+        print(f"[mood_analyzer] Loaded {len(index)} keywords for {len(moods)} moods")
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self.last_check < RELOAD_CHECK_INTERVAL:
+            return
+        with self.lock:
+            self.last_check = now
+            try:
+                if os.stat(self.path).st_mtime != self.mtime:
+                    self.load()
+            except (OSError, ValueError, KeyError) as e:
+                # 檔案寫到一半或格式錯誤：保留舊表
+                print(f"[mood_analyzer] Reload failed, keeping previous table: {e}")
+
+    # --------------------------------------------------------
+    # 斷詞 + 查表
+    # --------------------------------------------------------
+    @staticmethod
+    def _base_cache(index):
+        cache = dict(index)
+        cache[SEPARATOR] = BOUNDARY
+        return cache
+
+    def _resolve(self, state, tokens):
+        """把快取裡沒有的 token 解析後補進去（上鎖），回傳補好的快取
+
+        快取太大時換一份新的而不是原地清空：別的 thread 正在用舊快取查的 prompt 不會漏字
+        """
+        moods, index, default, cache = state
+        with self.cache_lock:
+            if len(cache) > TOKEN_CACHE_MAX:
+                cache = self._base_cache(index)
+                with self.lock:
+                    if self.state is state:   # 期間重新載入過就不蓋掉新表
+                        self.state = (moods, index, default, cache)
+            for token in tokens:
+                if token not in cache:
+                    cache[token] = self._lookup(token, index)
+        return cache
+
+    @classmethod
+    def _lookup(cls, token, index):
+        """token 沒直接命中索引時：先拆標點，再試著去字尾"""
+        parts = token.translate(PUNCTUATION).split()
+        if parts != [token]:
+            hits = []
+            for part in parts:
+                hits.extend(index.get(part) or cls._lookup_stem(part, index))
+            return tuple(hits)
+        return cls._lookup_stem(token, index)
+
+    @staticmethod
+    def _lookup_stem(token, index):
+        """去字尾（含 e 結尾與重複子音）"""
+        for suffix in SUFFIXES:
+            if token.endswith(suffix) and len(token) > len(suffix) + 1:
+                stem = token[:-len(suffix)]
+                hits = index.get(stem) or index.get(stem + "e")
+                if hits is None and len(stem) > 2 and stem[-1] == stem[-2]:
+                    hits = index.get(stem[:-1])   # running -> runn -> run
+                if hits is not None:
+                    return hits
+        return ()
+
+    def scores(self, prompt, state=None):
+        state = state or self.state
+        moods, _, _, cache = state
+        totals = [0.0] * len(moods)
+        get = cache.get
+        for token in (prompt or "").lower().split():
+            hits = get(token)
+            if hits is None:
+                cache = self._resolve(state, (token,))
+                get = cache.get
+                hits = cache[token]
+            for i, weight in hits:
+                totals[i] += weight
+        return totals
+
+    @staticmethod
+    def _best(totals, moods, default):
+        # max / index 取第一個最大值：同分時依表格順序；全部 0 分時是預設心情
+        best = max(totals)
+        return moods[totals.index(best)] if best > 0 else default
+
+    # --------------------------------------------------------
+    # 對外介面
+    # --------------------------------------------------------
+    def classify(self, prompt: str) -> dict:
+        """回傳 {mood: 機率}"""
+        self.maybe_reload()
+        state = self.state
+        moods = state[0]
+        totals = self.scores(prompt, state)
+        norm = sum(totals) + SMOOTHING * len(moods)
+        return {m: (t + SMOOTHING) / norm for m, t in zip(moods, totals)}
+
+    def analyze(self, prompt: str) -> str:
+        self.maybe_reload()
+        state = self.state
+        return self._best(self.scores(prompt, state), state[0], state[2])
+
+    def analyze_many(self, prompts) -> list:
+        self.maybe_reload()
+        state = self.state
+        moods, _, default, cache = state
+        prompts = [p or "" for p in prompts]
+        if not prompts:
+            return []
+        text = f" {SEPARATOR} ".join(prompts)
+        if text.count(SEPARATOR) != len(prompts) - 1:
+            # prompt 本身帶了分隔字元：逐一處理
+            return [self._best(self.scores(p, state), moods, default) for p in prompts]
+        tokens = text.lower().split()
+        unique = set(tokens)
+        if not unique.issubset(cache.keys()):
+            cache = self._resolve(state, unique)
+        results = []
+        zero = [0.0] * len(moods)
+        totals = zero[:]
+        best = self._best
+        # 沒命中的字（快取裡是空 tuple）在 filter 就濾掉，迴圈只跑命中的字與分隔 token
+        for hits in filter(None, map(cache.get, tokens)):
+            if hits is BOUNDARY:
+                results.append(best(totals, moods, default))
+                totals = zero[:]
+                continue
+            for i, weight in hits:
+                totals[i] += weight
+        results.append(best(totals, moods, default))
+        return results
+
+
+classifier = MoodClassifier()
+
+
 def analyze_text(prompt: str) -> str:
-    prompt = (prompt or "").lower()
-    if any(k in prompt for k in ["sad", "lonely", "tired", "cry", "down"]):
-        return "sad"
-    if any(k in prompt for k in ["happy", "excited", "love", "good"]):
-        return "happy"
-    if any(k in prompt for k in ["relax", "calm", "focus", "quiet"]):
-        return "calm"
-    if any(k in prompt for k in ["party", "energetic", "run", "dance"]):
-        return "energetic"
-    return "calm"
\ No newline at end of file
+    return classifier.analyze(prompt)
+
+
+def classify_text(prompt: str) -> dict:
+    return classifier.classify(prompt)
+
+
+def analyze_many(prompts) -> list:
+    return classifier.analyze_many(prompts)
@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
 # 從 YouTube Music 搜尋曲目 (使用 yt_dlp 抓音訊串流 URL)
-import yt_dlp
+# 解析結果放進 TrackCache：LRU + TTL（依串流 URL 的 expire 參數）+ 背景提前刷新
+# 解析一律在有上限的 worker pool 裡做，同一個 query 同時只會跑一次（single-flight），其他請求共用結果
+# yt_dlp 在第一次解析時才 import（worker thread 裡），server 啟動不用等它載入
+# 頻道播下一首時往下取同一個搜尋的第 2、3 … 個結果（query 帶 "#<n>"，每個位置各自快取），到 SEARCH_DEPTH 再從頭
+import asyncio
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
 
 YOUTUBE_PLAYLISTS = {
     "happy": "happy upbeat music",
@@ -8,15 +17,51 @@ YOUTUBE_PLAYLISTS = {
     "calm": "lofi chill beats",
     "energetic": "party dance hits"
 }
+DEFAULT_QUERY = "lofi chill beats"
 
-def search_youtube_music(mood: str) -> str:
-    """Search YouTube Music by mood and return a playable audio URL."""
-    query = YOUTUBE_PLAYLISTS.get(mood, "lofi chill beats")
+CACHE_MAX_ENTRIES = 32
+DEFAULT_TTL = 30 * 60        # URL 沒帶 expire 時的保存秒數
+REFRESH_MARGIN = 5 * 60      # 距離過期不到這麼久就背景刷新
+REFRESH_INTERVAL = 30        # 背景刷新執行緒的巡檢間隔
+EXTRACT_WORKERS = 4          # 同時最多幾個 yt-dlp 解析
+EXTRACT_TIMEOUT = 20         # 秒；單一請求最多等多久（解析本身不會因此中斷，結果照樣進快取）
+SEARCH_DEPTH = 10            # 頻道一首接一首時最多往下取到第幾個搜尋結果
+
+Track = namedtuple("Track", ["url", "title", "expires_at"])
+
+
+def url_expiry(url: str, now: float, default_ttl: float = DEFAULT_TTL) -> float:
+    """googlevideo 的串流 URL 帶有 expire=<unix time>；沒有就用預設 TTL"""
+    try:
+        expire = parse_qs(urlparse(url).query).get("expire")
+        if expire:
+            return float(expire[0])
+    except ValueError:
+        pass
+    return now + default_ttl
+
+
+def track_query(mood: str, index: int = 1) -> str:
+    """心情的第 index 個搜尋結果對應的快取 key / extractor query（第 1 個就是原本的 query）"""
+    query = YOUTUBE_PLAYLISTS.get(mood, DEFAULT_QUERY)
+    return query if index <= 1 else f"{query}#{index}"
+
+
+def yt_dlp_extract(query: str) -> Track:
+    """預設 extractor：用 yt_dlp 解析搜尋結果（query 結尾 "#<n>" 時取第 n 個，否則第一個）"""
+    import yt_dlp
+
+    base, _, suffix = query.rpartition("#")
+    if base and suffix.isdigit():
+        query, index = base, int(suffix)
+    else:
+        index = 1
     ydl_opts = {
         "quiet": True,
         "skip_download": True,
         "format": "bestaudio/best",
-        "default_search": "ytsearch1",  # 只取第一個搜尋結果
+        "default_search": f"ytsearch{index}",
+        "playlist_items": str(index),   # 只解析第 index 個結果的格式
     }
 
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
@@ -25,5 +70,224 @@ def search_youtube_music(mood: str) -> str:
             info = info["entries"][0]
         url = info["url"] if "url" in info else info["formats"][0]["url"]
         title = info.get("title", "Unknown")
-        print(f"[music_manager] Found: {title}")
-        return url
\ No newline at end of file
+        return Track(url, title, url_expiry(url, time.time()))
+
+
+class SingleFlight:
+    """query -> 進行中的解析；同一個 query 同時只跑一次 fn，所有等待者共用同一個 Future
+
+    fn 在有上限的 thread pool 裡執行。每個等待者 acquire 後都要 release：
+    最後一個等待者放棄（逾時 / client 斷線）時，還在排隊、沒開始跑的解析會被取消；
+    已經在跑的解析無法中斷，會跑完並照常把結果放進快取。pin=True（背景刷新）的解析不會被取消。
+    """
+
+    def __init__(self, fn, workers=EXTRACT_WORKERS):
+        self.fn = fn
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract")
+        self.flights = {}               # query -> [Future, 等待者數, pinned]
+        self.lock = threading.RLock()   # Future 已完成時 add_done_callback 會同步呼叫 _done
+        self.started = 0                # fn 實際執行次數
+        self.coalesced = 0              # 直接共用進行中結果的請求數
+        self.cancelled = 0              # 沒人等了而取消的排隊中解析
+
+    def acquire(self, query, pin=False):
+        with self.lock:
+            flight = self.flights.get(query)
+            if flight is None:
+                future = self.executor.submit(self._run, query)
+                flight = self.flights[query] = [future, 0, False]
+                future.add_done_callback(lambda f, q=query: self._done(q, f))
+            elif not pin:
+                self.coalesced += 1
+            if pin:
+                flight[2] = True
+            else:
+                flight[1] += 1
+            return flight[0]
+
+    def release(self, query, future):
+        with self.lock:
+            flight = self.flights.get(query)
+            if flight is None or flight[0] is not future:
+                return
+            flight[1] -= 1
+            if flight[1] <= 0 and not flight[2] and future.cancel():
+                self.cancelled += 1
+
+    def _run(self, query):
+        with self.lock:
+            self.started += 1
+        return self.fn(query)
+
+    def _done(self, query, future):
+        with self.lock:
+            flight = self.flights.get(query)
+            if flight is not None and flight[0] is future:
+                del self.flights[query]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"started": self.started, "coalesced": self.coalesced,
+                    "cancelled": self.cancelled, "in_flight": len(self.flights)}
+
+
+class TrackCache:
+    """query -> Track 的快取（LRU 淘汰、TTL 到期、快過期時背景刷新）
+
+    extractor 是 query -> Track 的函式，可以換成 stub 離線測試；
+    clock 預設 time.time，測試時可注入假時鐘。
+    快取沒命中時的解析與背景刷新都經過同一個 SingleFlight（workers 個 thread）。
+    """
+
+    def __init__(self, extractor=yt_dlp_extract, max_entries=CACHE_MAX_ENTRIES,
+                 refresh_margin=REFRESH_MARGIN, clock=time.time, workers=EXTRACT_WORKERS):
+        self.extractor = extractor
+        self.max_entries = max_entries
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refresher = None
+        self.flights = SingleFlight(self._resolve, workers)
+
+    def _lookup(self, query: str):
+        """快取命中且未過期就回傳 Track（快過期時順便背景刷新），否則 None"""
+        now = self.clock()
+        with self.lock:
+            track = self.entries.get(query)
+            if track is None or track.expires_at <= now:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(query)
+            self.hits += 1
+            stale_soon = track.expires_at - now < self.refresh_margin
+        if stale_soon:
+            self.refresh_async(query)
+        return track
+
+    def get(self, query: str, timeout=None) -> Track:
+        """同步版本（thread 裡用）；逾時丟 concurrent.futures.TimeoutError"""
+        track = self._lookup(query)
+        if track is not None:
+            return track
+        future = self.flights.acquire(query)
+        try:
+            return future.result(timeout)
+        finally:
+            self.flights.release(query, future)
+
+    async def get_async(self, query: str, timeout=None) -> Track:
+        """asyncio 版本：不佔用 event loop 也不佔 executor thread 等待；
+        逾時丟 asyncio.TimeoutError，被 cancel（client 斷線）時放棄等待"""
+        track = self._lookup(query)
+        if track is not None:
+            return track
+        loop = asyncio.get_running_loop()
+        future = self.flights.acquire(query)
+        # 每個等待者自己的 asyncio Future：取消它不會取消其他人共用的解析
+        waiter = loop.create_future()
+
+        def deliver(f):
+            if waiter.done():
+                return
+            if f.cancelled():
+                waiter.cancel()
+            elif f.exception() is not None:
+                waiter.set_exception(f.exception())
+            else:
+                waiter.set_result(f.result())
+
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(deliver, f))
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            self.flights.release(query, future)
+
+    def _resolve(self, query: str) -> Track:
+        track = self.extractor(query)
+        self.put(query, track)
+        return track
+
+    def put(self, query: str, track: Track):
+        with self.lock:
+            self.entries[query] = track
+            self.entries.move_to_end(query)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, query: str):
+        with self.lock:
+            self.entries.pop(query, None)
+
+    def refresh_async(self, query: str):
+        """背景重新解析；同一個 query 同時只會有一個解析中（與快取沒命中的請求共用）"""
+        future = self.flights.acquire(query, pin=True)
+        future.add_done_callback(lambda f: self._refresh_done(query, f))
+
+    def _refresh_done(self, query: str, future):
+        if not future.cancelled() and future.exception() is not None:
+            print(f"[music_manager] Refresh failed for '{query}': {future.exception()}")
+
+    def refresh_due(self):
+        """把所有快過期的項目丟去背景刷新（LRU 中還在的都算熱門）"""
+        now = self.clock()
+        with self.lock:
+            due = [q for q, t in self.entries.items() if t.expires_at - now < self.refresh_margin]
+        for query in due:
+            self.refresh_async(query)
+
+    def start_refresher(self, interval=REFRESH_INTERVAL):
+        if self.refresher is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.refresh_due()
+
+        self.refresher = threading.Thread(target=loop, daemon=True)
+        self.refresher.start()
+
+    def warm(self, queries):
+        """預先解析（例如 server 啟動時把四個心情都先抓好）"""
+        for query in queries:
+            self.refresh_async(query)
+
+
+track_cache = TrackCache()
+
+
+def resolve_track(mood: str, timeout=EXTRACT_TIMEOUT, index=1) -> Track:
+    """依心情取得 Track（先查快取）；index 是第幾個搜尋結果"""
+    query = track_query(mood, index)
+    track_cache.start_refresher()
+    return track_cache.get(query, timeout)
+
+
+async def resolve_track_async(mood: str, timeout=EXTRACT_TIMEOUT) -> Track:
+    query = YOUTUBE_PLAYLISTS.get(mood, DEFAULT_QUERY)
+    track_cache.start_refresher()
+    return await track_cache.get_async(query, timeout)
+
+
+def search_youtube_music(mood: str) -> str:
+    """Search YouTube Music by mood and return a playable audio URL."""
+    track = resolve_track(mood)
+    print(f"[music_manager] Found: {track.title}")
+    return track.url
+
+
+def search_youtube_music_next(mood: str, index: int) -> str:
+    """頻道的下一首：同一個搜尋的第 index 個結果（超過 SEARCH_DEPTH 從頭再來）"""
+    track = resolve_track(mood, index=(index - 1) % SEARCH_DEPTH + 1)
+    print(f"[music_manager] Next ({index}): {track.title}")
+    return track.url
+
+
+async def search_youtube_music_async(mood: str, timeout=EXTRACT_TIMEOUT) -> str:
+    """server 的 event loop 用：等待解析時不佔任何 thread；逾時丟 asyncio.TimeoutError"""
+    track = await resolve_track_async(mood, timeout)
+    print(f"[music_manager] Found: {track.title}")
+    return track.url
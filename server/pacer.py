@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+server/pacer.py
+-----------------------------------
+依串流 byte rate 做即時節奏控制（取代固定 sleep）
+功能：
+- 以 monotonic clock 計算每個封包「應該」送出的時間點
+- 排程是絕對時間（start + bytes / byte_rate），不累積 sleep 誤差 → 自動修正 drift
+- 可選擇小量 burst：一次送出 burst 個封包後再等待
+- 落後太多（例如卡住）時重新對齊，不會事後狂送補回來
+- 記錄每個封包的實際送出誤差（jitter）與整體 drift
+- lead：排程整體提前幾秒（server/feedback.py 在 client 緩衝見底時調高，多出來的部分立刻送出補滿）
+"""
+import time
+from collections import deque
+
+SAMPLE_RATE = 44100
+CHANNELS = 1
+SAMPLE_WIDTH = 2                               # s16le
+BYTE_RATE = SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH  # 88200 B/s
+PACKET_SIZE = 1024
+MAX_LAG = 0.5                                  # 落後超過 0.5 秒就重新對齊
+STATS_WINDOW = 100000                          # 保留最近多少筆誤差算百分位
+
+
+class Pacer:
+    def __init__(self, byte_rate=BYTE_RATE, burst=1, max_lag=MAX_LAG,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.byte_rate = byte_rate
+        self.burst = max(1, burst)
+        self.max_lag = max_lag
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+        self.sent_bytes = 0
+        self.pending = 0
+        self.lead = 0.0
+        self.stats = PacingStats()
+
+    def reset(self):
+        self.start = None
+        self.sent_bytes = 0
+        self.pending = 0
+
+    def due_time(self) -> float:
+        return self.start + self.sent_bytes / self.byte_rate - self.lead
+
+    def wait(self, nbytes: int):
+        """在送出下一個 nbytes 封包之前呼叫；必要時睡到該送的時間"""
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        if self.pending == 0:
+            due = self.due_time()
+            if due > now:
+                self.sleep(due - now)
+                now = self.clock()
+            elif now - due > self.max_lag:
+                # 上游卡住太久：從現在重新起算，不暴衝補送
+                self.stats.resyncs += 1
+                self.start = now - self.sent_bytes / self.byte_rate + self.lead
+                due = now
+            self.stats.record(now - due)
+            self.pending = self.burst
+        self.pending -= 1
+        self.sent_bytes += nbytes
+
+    def drift(self) -> float:
+        """目前實際時間與媒體時間的差（正 = 落後）"""
+        if self.start is None:
+            return 0.0
+        return (self.clock() - self.start) - self.sent_bytes / self.byte_rate
+
+
+class PacingStats:
+    """送出時間誤差統計（秒）"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max_error = 0.0
+        self.resyncs = 0
+        self.errors = deque(maxlen=STATS_WINDOW)
+
+    def record(self, error: float):
+        self.count += 1
+        self.total += error
+        self.max_error = max(self.max_error, error)
+        self.errors.append(error)
+
+    def summary(self) -> dict:
+        errors = sorted(self.errors)
+        if not errors:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000,
+            "p50_ms": errors[len(errors) // 2] * 1000,
+            "p99_ms": errors[min(len(errors) - 1, int(len(errors) * 0.99))] * 1000,
+            "max_ms": self.max_error * 1000,
+            "resyncs": self.resyncs,
+        }
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+server/pcm_cache.py
+-----------------------------------
+轉碼後 PCM 的本機磁碟快取（content-addressed）
+功能：
+- key = sha256(來源識別 + 轉碼參數)，同一首歌不同過期時間的 URL 共用同一份
+- 命中時用 mmap 直接串流，不開 ffmpeg、不連網
+- 寫入先寫暫存檔 + fsync，再 os.replace（crash-safe，不會留下半個檔案）
+- 暫存檔名帶寫入者的 PID：啟動時只清掉 PID 已經不在的、或超過 STALE_TMP_AGE 沒動的，
+  共用同一個目錄的其他 server / benchmark 正在寫的不會被刪
+- 總容量上限，超過時以最後使用時間 (mtime) 淘汰最舊的
+"""
+import hashlib
+import mmap
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlparse, parse_qs
+
+CACHE_DIR = os.environ.get(
+    "MOODDJ_PCM_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".pcm_cache")
+)
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+SUFFIX = ".pcm"
+TMP_MARK = ".tmp-"
+STALE_TMP_AGE = 24 * 3600   # 秒；暫存檔這麼久沒寫入就當作遺留的（比任何串流 URL 的有效期都長）
+
+
+def source_id(url: str) -> str:
+    """取出來源的穩定識別：googlevideo URL 用 id + itag（expire / 簽章每次都不同）"""
+    parsed = urlparse(url)
+    qs = parse_qs(parsed.query)
+    if "id" in qs:
+        return f"{parsed.hostname}:{qs['id'][0]}:{qs.get('itag', [''])[0]}"
+    return url
+
+
+def cache_key(url: str, fmt: str) -> str:
+    return hashlib.sha256(f"{source_id(url)}|{fmt}".encode()).hexdigest()
+
+
+def tmp_pid(name: str):
+    """暫存檔名 <key>.pcm.tmp-<pid>-<random> 裡的 PID；格式不符回傳 None"""
+    pid = name.rpartition(TMP_MARK)[2].split("-")[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def pid_alive(pid: int) -> bool:
+    """這台機器上 pid 還在不在；判斷不了時當作還在（寧可留著）"""
+    if pid == os.getpid() or os.name == "nt":   # Windows 的 os.kill 會直接結束對方，只看檔案年紀
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True   # PermissionError：別的使用者的 process
+    return True
+
+
+class PCMCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_tmp()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def _remove_stale_tmp(self):
+        # 上次 crash 留下的暫存檔：寫入者已經不在，或很久沒動
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if TMP_MARK not in name:
+                continue
+            path = os.path.join(self.directory, name)
+            pid = tmp_pid(name)
+            try:
+                if (pid is not None and not pid_alive(pid)) or now - os.stat(path).st_mtime > STALE_TMP_AGE:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def open(self, key: str):
+        """命中回傳唯讀 mmap（呼叫端負責 close），否則 None"""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)  # 更新 mtime 當作 LRU 時間
+            return mm
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def writer(self, key: str):
+        return CacheWriter(self, key)
+
+    def evict(self):
+        """總容量超過上限時刪掉最久沒用的檔案"""
+        with self.lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(SUFFIX) or TMP_MARK in name:
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)  # 已開啟的 mmap 不受影響
+                    total -= size
+                except FileNotFoundError:
+                    pass
+
+
+class CacheWriter:
+    """邊轉碼邊寫入暫存檔；commit() 才原子性地放進快取，abort() 丟棄"""
+
+    def __init__(self, cache: PCMCache, key: str):
+        self.cache = cache
+        self.key = key
+        self.tmp_path = cache.path(key) + f"{TMP_MARK}{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.file = open(self.tmp_path, "wb")
+        self.size = 0
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        if self.size == 0 or self.size > self.cache.max_bytes:
+            os.unlink(self.tmp_path)
+            return
+        os.replace(self.tmp_path, self.cache.path(self.key))
+        if hasattr(os, "O_DIRECTORY"):
+            # rename 本身也要落盤
+            dir_fd = os.open(self.cache.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        self.cache.evict()
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
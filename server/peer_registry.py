@@ -1,29 +1,347 @@
-# server/peer_registry.py
-# 用於管理 peer 清單（IP + Port）
+# -*- coding: utf-8 -*-
+"""
+server/peer_registry.py
+-----------------------------------
+管理 peer 清單（IP + Port），UDP 5700
+功能：
+ - 以 (ip, port) 為 key 的 dict 索引，註冊 / 查詢都是 O(1)
+ - TTL 到期：peer 需定期重新註冊（client 每 10 秒一次），超過 TTL 沒註冊就移除
+   OrderedDict 依最後註冊時間排序，到期檢查只看最前面已過期的那幾個
+ - 可帶 mood / channel 欄位，LIST 可依欄位過濾（各自有反向索引）
+ - LIST 回覆分頁：每頁最多 limit 個 peer，一頁再拆成多個 ≤ MAX_DATAGRAM 的 datagram，
+   不會再因為清單太大超過 client 的 recvfrom 緩衝而整包遺失
+   分頁依 (ip, port) 排序（續約不會改變位置），以上一頁最後一個 key 當游標（after）往下翻：
+   翻頁期間沒變動的 peer 一定剛好出現一次，有變動的由增量補上
+ - 版本號 + 增量同步：每次變動 version +1，client 只要帶著自己的 version 來問，
+   就只拿到那之後新增 / 移除的 peer（同一個 peer 變動多次只回最後狀態）
+ - 推播訂閱：註冊時帶 "sub": true，清單有變時 server 主動把增量推給訂閱者（合併 PUSH_INTERVAL 內的變動）
 
-import socket, json, threading
+協定（UDP，UTF-8 JSON）：
+    {"ip": ..., "port": ..., "mood": ..., "channel": ...}   註冊 / 續約
+        可加 "since": N  -> 同時回覆 version N 之後的增量
+        可加 "sub": true -> 訂閱推播（送到這個 datagram 的來源位址，隨註冊一起續約 / 到期）
+    SYNC {"since": N, "req": 7}                            只問增量
+    BYE {"ip": ..., "port": ...}                          主動離開
+    LIST                                                   第一頁、不過濾
+    LIST {"mood": ..., "channel": ..., "after": [ip, port], "limit": 500, "req": 7}
+        after 省略時是第一頁；舊版 client 用 "offset": N 翻頁（期間有 peer 加入 / 離開時可能漏掉或重複）
+回覆（每個 datagram 一個 JSON 物件）：
+    {"req": 7, "version": 42, "part": 0, "parts": 3, "total": 1234, "next": 500, "after": [ip, port], "peers": [...]}
+    after 為下一頁的游標（這頁最後一個 peer 的 key），next 為下一頁的 offset，沒有下一頁時兩者都是 null
+    {"type": "delta", "req": 7, "from": 40, "to": 42, "part": 0, "parts": 1,
+     "added": [{peer}...], "removed": [[ip, port]...]}    增量（推播時 req 為 null）
+    {"type": "reset", "req": 7, "to": 42}                   N 太舊（變動紀錄已清掉），請重新 LIST
+"""
+import json
+import socket
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
 
 PEER_PORT = 5700
-peers = []
+PEER_TTL = 30.0            # 秒；client 每 10 秒續約一次，容許掉兩次
+PAGE_LIMIT = 500           # 每頁最多幾個 peer
+MAX_DATAGRAM = 1400        # 回覆 datagram 上限（避開 IP 分段）
+FILTER_FIELDS = ("mood", "channel")
+LOG_SLACK = 20000          # 變動紀錄最多比線上 peer 數多保留幾筆（移除紀錄）
+PUSH_INTERVAL = 0.5        # 秒；推播最多這麼頻繁，期間內的變動合併成一次
 
-def registry_server():
+
+class PeerRegistry:
+    def __init__(self, ttl=PEER_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.peers = OrderedDict()      # (ip, port) -> peer dict，依最後註冊時間由舊到新
+        self.keys = []                  # 所有 (ip, port)，排序過（LIST 分頁用的固定順序）
+        self.expires = {}               # (ip, port) -> 到期時間
+        self.index = {field: {} for field in FILTER_FIELDS}   # field -> value -> set(key)
+        self.version = 0                # 每次清單有變動就 +1
+        self.changed = OrderedDict()    # (ip, port) -> 最後一次變動的 version（含已移除的），依 version 排序
+        self.floor = 0                  # since < floor 的增量已無法計算（紀錄被清掉）
+        self.views = {}                 # (mood, channel) -> (version, 排序過的 keys)，過濾後的 LIST 快照
+        self.subscribers = {}           # 推播位址 -> 到期時間
+        self.pushed = 0                 # 已推播到的 version
+        self.last_push = 0.0
+        self.lock = threading.Lock()
+
+    # --------------------------------------------------------
+    # 註冊 / 移除 / 到期
+    # --------------------------------------------------------
+    def register(self, peer, now=None) -> bool:
+        """註冊或續約；回傳是否為新的（或欄位有變的）peer"""
+        now = self.clock() if now is None else now
+        key = (str(peer["ip"]), int(peer["port"]))
+        entry = {"ip": key[0], "port": key[1]}
+        for field in FILTER_FIELDS:
+            if peer.get(field) is not None:
+                entry[field] = str(peer[field])
+        with self.lock:
+            old = self.peers.get(key)
+            self.expires[key] = now + self.ttl
+            if old == entry:
+                self.peers.move_to_end(key)
+                return False
+            if old is not None:
+                self._unindex(key, old)
+            else:
+                insort(self.keys, key)
+            self.peers[key] = entry
+            self.peers.move_to_end(key)
+            for field in FILTER_FIELDS:
+                if field in entry:
+                    self.index[field].setdefault(entry[field], set()).add(key)
+            self._log(key)
+            return True
+
+    def unregister(self, ip, port) -> bool:
+        key = (str(ip), int(port))
+        with self.lock:
+            return self._remove(key) is not None
+
+    def expire(self, now=None) -> list:
+        """移除所有已過期的 peer；回傳被移除的清單"""
+        now = self.clock() if now is None else now
+        removed = []
+        with self.lock:
+            while self.peers:
+                key = next(iter(self.peers))
+                if self.expires[key] > now:
+                    break
+                removed.append(self._remove(key))
+        return removed
+
+    def _remove(self, key):
+        entry = self.peers.pop(key, None)
+        if entry is None:
+            return None
+        del self.expires[key]
+        del self.keys[bisect_left(self.keys, key)]
+        self._unindex(key, entry)
+        self._log(key)
+        return entry
+
+    def _log(self, key):
+        self.version += 1
+        self.changed[key] = self.version
+        self.changed.move_to_end(key)
+        while len(self.changed) > len(self.peers) + LOG_SLACK:
+            _, self.floor = self.changed.popitem(last=False)
+
+    def _unindex(self, key, entry):
+        for field in FILTER_FIELDS:
+            value = entry.get(field)
+            if value is None:
+                continue
+            keys = self.index[field].get(value)
+            keys.discard(key)
+            if not keys:
+                del self.index[field][value]
+
+    # --------------------------------------------------------
+    # 查詢
+    # --------------------------------------------------------
+    def __len__(self):
+        return len(self.peers)
+
+    def get(self, ip, port):
+        return self.peers.get((str(ip), int(port)))
+
+    def _view(self, mood=None, channel=None) -> list:
+        """符合過濾條件的 key（排序過）；不過濾時就是 self.keys，過濾時同一個 version 內重複 LIST 用快照"""
+        if mood is None and channel is None:
+            return self.keys
+        cached = self.views.get((mood, channel))
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        keys = None
+        for field, value in (("mood", mood), ("channel", channel)):
+            if value is None:
+                continue
+            matched = self.index[field].get(str(value), set())
+            keys = matched if keys is None else keys & matched
+        view = sorted(keys)
+        if len(self.views) > 64:
+            self.views.clear()
+        self.views[(mood, channel)] = (self.version, view)
+        return view
+
+    def list(self, mood=None, channel=None, offset=0, limit=PAGE_LIMIT, after=None):
+        """回傳 (這一頁的 peers, 下一頁 offset 或 None, 符合條件的總數)
+
+        after 是上一頁最後一個 peer 的 (ip, port)：給了就從這個 key 之後開始，忽略 offset
+        """
+        limit = max(1, min(int(limit), PAGE_LIMIT))
+        with self.lock:
+            keys = self._view(mood, channel)
+            if after is not None:
+                start = bisect_right(keys, (str(after[0]), int(after[1])))
+            else:
+                start = max(0, int(offset))
+            page = [self.peers[k] for k in keys[start:start + limit]]
+            total = len(keys)
+        next_offset = start + limit if start + limit < total else None
+        return page, next_offset, total
+
+    def changes(self, since):
+        """version since 之後的淨變動：(added, removed, 目前 version)；since 太舊時回傳 None"""
+        with self.lock:
+            if since < self.floor or since > self.version:
+                return None
+            added, removed = [], []
+            for key, version in reversed(self.changed.items()):
+                if version <= since:
+                    break
+                entry = self.peers.get(key)
+                if entry is not None:
+                    added.append(entry)
+                else:
+                    removed.append(list(key))
+            return added, removed, self.version
+
+    # --------------------------------------------------------
+    # 推播訂閱
+    # --------------------------------------------------------
+    def subscribe(self, addr, now=None):
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.subscribers[addr] = now + self.ttl
+
+    def unsubscribe(self, addr):
+        with self.lock:
+            self.subscribers.pop(addr, None)
+
+    def push_due(self, now=None):
+        """到了推播時間且有變動：回傳 (datagrams, 訂閱者位址清單)，否則 None"""
+        now = self.clock() if now is None else now
+        if self.version == self.pushed or now - self.last_push < PUSH_INTERVAL:
+            return None
+        since, self.last_push = self.pushed, now
+        delta = self.changes(since)
+        with self.lock:
+            self.subscribers = {a: t for a, t in self.subscribers.items() if t > now}
+            targets = list(self.subscribers)
+        if delta is None:
+            datagrams = encode_reset(self.version)
+        else:
+            datagrams = encode_delta(delta[0], delta[1], since, delta[2])
+        self.pushed = self.version if delta is None else delta[2]
+        return datagrams, targets
+
+
+def _chunk(encoded, budget) -> list:
+    """把已編碼的 JSON 片段分組，每組總長不超過 budget（至少回傳一個空組）"""
+    groups, current, size = [], [], 0
+    for item in encoded:
+        if current and size + len(item) + 1 > budget:
+            groups.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += len(item) + 1
+    groups.append(current)
+    return groups
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+
+def encode_page(peers, next_offset, total, req=None, version=0, max_datagram=MAX_DATAGRAM) -> list:
+    """把一頁 peers 切成多個 datagram（每個都是獨立可解析的 JSON）"""
+    after = [peers[-1]["ip"], peers[-1]["port"]] if next_offset is not None and peers else None
+    head = (f'{{"req":{_dumps(req)},"version":{version},"total":{total},"next":{_dumps(next_offset)},'
+            f'"after":{_dumps(after)}')
+    groups = _chunk([_dumps(peer) for peer in peers], max_datagram - len(head) - 48)
+    return [f'{head},"parts":{len(groups)},"part":{i},"peers":[{",".join(group)}]}}'.encode()
+            for i, group in enumerate(groups)]
+
+
+def encode_delta(added, removed, since, version, req=None, max_datagram=MAX_DATAGRAM) -> list:
+    """增量切成多個 datagram：先放 added 的組，再放 removed 的組"""
+    head = f'{{"type":"delta","req":{_dumps(req)},"from":{since},"to":{version}'
+    budget = max_datagram - len(head) - 64
+    groups = [(g, []) for g in _chunk([_dumps(p) for p in added], budget) if g]
+    groups += [([], g) for g in _chunk([_dumps(k) for k in removed], budget) if g]
+    groups = groups or [([], [])]
+    return [f'{head},"parts":{len(groups)},"part":{i},"added":[{",".join(a)}],"removed":[{",".join(r)}]}}'.encode()
+            for i, (a, r) in enumerate(groups)]
+
+
+def encode_reset(version, req=None) -> list:
+    return [_dumps({"type": "reset", "req": req, "to": version}).encode()]
+
+
+def encode_changes(registry, since, req=None) -> list:
+    delta = registry.changes(since)
+    if delta is None:
+        return encode_reset(registry.version, req)
+    return encode_delta(delta[0], delta[1], since, delta[2], req)
+
+
+def handle_datagram(registry, data, addr=None):
+    """處理一個請求 datagram；回傳要送回給來源的 datagram 清單"""
+    msg = data.decode(errors="replace")
+    try:
+        if msg == "LIST" or msg.startswith("LIST "):
+            query = json.loads(msg[5:]) if msg.startswith("LIST ") else {}
+            version = registry.version   # 先取 version：分頁期間的變動之後用增量補
+            page, next_offset, total = registry.list(query.get("mood"), query.get("channel"),
+                                                     query.get("offset", 0), query.get("limit", PAGE_LIMIT),
+                                                     query.get("after"))
+            return encode_page(page, next_offset, total, query.get("req"), version)
+        if msg.startswith("SYNC "):
+            query = json.loads(msg[5:])
+            return encode_changes(registry, int(query["since"]), query.get("req"))
+        if msg.startswith("BYE "):
+            peer = json.loads(msg[4:])
+            if addr is not None:
+                registry.unsubscribe(addr)
+            if registry.unregister(peer["ip"], peer["port"]):
+                print(f"[peer_registry] Unregistered {peer['ip']}:{peer['port']}")
+            return []
+        peer = json.loads(msg)
+        if registry.register(peer):
+            print(f"[peer_registry] Registered {peer['ip']}:{peer['port']}")
+        if peer.get("sub") and addr is not None:
+            registry.subscribe(addr)
+        if peer.get("since") is not None:
+            return encode_changes(registry, int(peer["since"]))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        pass
+    return []
+
+
+def registry_server(registry=None, host="0.0.0.0", port=PEER_PORT, ready=None):
+    registry = PeerRegistry() if registry is None else registry
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind(("0.0.0.0", PEER_PORT))
-    print(f"[peer_registry] Listening on UDP {PEER_PORT} ...")
+    sock.bind((host, port))
+    sock.settimeout(PUSH_INTERVAL)   # 沒請求時也定期清過期 peer、送推播
+    print(f"[peer_registry] Listening on UDP {port} ...")
+    if ready is not None:
+        ready.set()
 
     while True:
-        data, addr = sock.recvfrom(4096)
-        msg = data.decode()
-        if msg == "LIST":
-            sock.sendto(json.dumps(peers).encode(), addr)
-        else:
-            try:
-                peer = json.loads(msg)
-                if peer not in peers:
-                    peers.append(peer)
-                    print(f"[peer_registry] Registered {peer}")
-            except Exception:
-                pass
+        try:
+            data, addr = sock.recvfrom(4096)
+            for reply in handle_datagram(registry, data, addr):
+                sock.sendto(reply, addr)
+        except socket.timeout:
+            pass
+        except OSError:
+            continue   # 對方 port 已關（ICMP unreachable）
+        expired = registry.expire()
+        if expired:
+            print(f"[peer_registry] Expired {len(expired)} peer(s), {len(registry)} online")
+        push = registry.push_due()
+        if push is not None:
+            datagrams, targets = push
+            for target in targets:
+                for datagram in datagrams:
+                    try:
+                        sock.sendto(datagram, target)
+                    except OSError:
+                        pass
+
 
 if __name__ == "__main__":
-    threading.Thread(target=registry_server, daemon=False).start()
\ No newline at end of file
+    threading.Thread(target=registry_server, daemon=False).start()
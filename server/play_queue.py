@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+server/play_queue.py
+-----------------------------------
+頻道的播放佇列：一首接一首無縫播放，不再每首之間靜音等 resolve + ffmpeg 啟動
+ - 整個頻道共用一個 PacketSender：stream id 不變、seq / timestamp 連續、Pacer 的排程不重來，
+   client 的 jitter buffer 不會因為換歌而重置、重新 prefill
+ - 下一首：resolve_next(mood, n) 取同一個心情的第 n 首（n 每首往下加 1，不會一直重播快取裡同一首）；
+   沒給 resolve_next 時退回 resolve(mood)
+ - 預取：這首一開始播就在背景 resolve 下一首；知道長度（PCM 快取命中）時剩 prefetch 秒才開解碼器，
+   不知道長度（ffmpeg 邊轉邊送）時 resolve 完就先開（ffmpeg 填滿 pipe 後自己停住等讀取）
+ - PCM 在 sample 邊界接軌：上一首最後不滿一個封包的 bytes 跟下一首開頭拼成完整封包，中間不插靜音
+ - crossfade_ms > 0（需要 numpy，有開 crossfade 的頻道才 import）時，上一首最後 crossfade_ms 跟下一首開頭做線性交叉淡化
+ - Opus 封包本身是獨立的 20 ms frame，直接在封包邊界接上（不做 crossfade）
+ - 換歌時上一首在背景 thread 關（結束 ffmpeg、commit 快取），送封包的 thread 不等
+"""
+import threading
+import time
+
+from pacer import PACKET_SIZE, SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS
+from streamer import TrackSource, send_opus
+from utils import metrics
+
+PREFETCH_SECONDS = 10.0
+FRAME_BYTES = SAMPLE_WIDTH * CHANNELS
+
+SWITCH_WAIT = metrics.histogram("mooddj_track_switch_wait_seconds",
+                                "time the channel waited for the next track at a track boundary")
+
+
+def crossfade(tail, head):
+    """等長的兩段 s16le：tail 線性淡出、head 線性淡入，回傳混好的 bytes"""
+    import numpy as np
+    a = np.frombuffer(tail, dtype="<i2").astype(np.float32)
+    b = np.frombuffer(head, dtype="<i2").astype(np.float32)
+    ramp = np.linspace(0.0, 1.0, len(a), endpoint=False, dtype=np.float32)
+    return np.clip(a + (b - a) * ramp, -32768, 32767).astype("<i2").tobytes()
+
+
+class Prefetch:
+    """背景 resolve 下一首；spawn() 之後才開解碼器（TrackSource）"""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.url = None
+        self.source = None
+        self.error = None
+        self.spawned = threading.Event()
+        self.done = threading.Event()
+        self.cancelled = False
+        self.lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.url = self.queue.next_url()
+            self.spawned.wait()
+            if not self.cancelled:
+                source = self.queue.open_source(self.url, self.queue.codec)
+                with self.lock:
+                    if self.cancelled:
+                        source.close()
+                    else:
+                        self.source = source
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def spawn(self):
+        self.spawned.set()
+
+    def take(self):
+        """等下一首開好並取走；回傳 (source, 是否早就準備好)"""
+        ready = self.done.is_set()
+        self.spawned.set()
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        with self.lock:
+            source, self.source = self.source, None
+        return source, ready
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            source, self.source = self.source, None
+        self.spawned.set()
+        if source is not None:
+            source.close()
+
+
+class PlayQueue:
+    def __init__(self, resolve, mood, codec="pcm", crossfade_ms=0, prefetch=PREFETCH_SECONDS,
+                 open_source=TrackSource, packet_size=PACKET_SIZE, resolve_next=None):
+        """
+        resolve      mood -> 音訊 URL（同 ChannelHub）
+        resolve_next (mood, n) -> 第 n 首的 URL（第 1 首就是 resolve 給的那首）
+        crossfade_ms 換歌時的交叉淡化長度；0 = 直接在 sample 邊界接上
+        prefetch     知道長度時，剩幾秒開下一首的解碼器
+        open_source  (url, codec) -> 有 read(n) / close()（duration() 可有可無）的來源；benchmark 可換成離線版本
+        """
+        self.resolve = resolve
+        self.resolve_next = resolve_next
+        self.position = 1             # 目前播的是第幾首（第一首是 resolve 的結果）
+        self.mood = mood
+        self.codec = codec
+        self.prefetch = prefetch
+        self.open_source = open_source
+        self.packet_size = packet_size
+        self.fade_bytes = 0
+        if crossfade_ms and codec == "pcm":
+            try:
+                import numpy  # noqa: F401
+                self.fade_bytes = int(crossfade_ms / 1000 * SAMPLE_RATE) * FRAME_BYTES
+            except ImportError:
+                print("[play_queue] ⚠️ numpy not installed, crossfade disabled")
+        self.tracks = 0
+        self.prefetched = 0           # 換歌時下一首早就開好的次數
+        self.max_wait = 0.0           # 換歌時等下一首最久的一次（秒）
+
+    def next_url(self):
+        """下一首的 URL（Prefetch 的 thread 裡呼叫，同時只有一個）"""
+        if self.resolve_next is None:
+            return self.resolve(self.mood)
+        self.position += 1
+        return self.resolve_next(self.mood, self.position)
+
+    def play(self, sender, url=None, source=None):
+        """一首接一首送，直到 sender 丟 StreamStopped（頻道沒有訂閱者）或 resolve / 解碼失敗
+
+        source：已經開好的第一首（decoder_pool 的待命來源）；沒有就開 url（或 resolve 一首）
+        """
+        current = source or self.open_source(url or self.resolve(self.mood), self.codec)
+        pending = bytearray()        # 還沒送出的 PCM：不滿一個封包的尾巴 + crossfade 要用的最後 fade_bytes
+        upcoming = None
+        try:
+            while True:
+                self.tracks += 1
+                upcoming = Prefetch(self)
+                if self.codec == "opus":
+                    upcoming.spawn()
+                    send_opus(sender, current)
+                else:
+                    self._pump(sender, current, pending, upcoming)
+                t0 = time.perf_counter()
+                nxt, ready = upcoming.take()
+                upcoming = None
+                wait = time.perf_counter() - t0
+                SWITCH_WAIT.observe(wait)
+                self.prefetched += ready
+                self.max_wait = max(self.max_wait, wait)
+                threading.Thread(target=current.close, daemon=True).start()
+                current = nxt
+                if self.fade_bytes and pending:
+                    self._crossfade(current, pending)
+        finally:
+            if upcoming is not None:
+                upcoming.cancel()
+            current.close()
+
+    def _pump(self, sender, source, pending, upcoming):
+        """把 source 讀到結尾，送出所有完整封包；pending 留下不滿一個封包的尾巴與最後 fade_bytes"""
+        keep = self.fade_bytes
+        duration = getattr(source, "duration", lambda: None)()
+        spawn_at = None if duration is None else max(0.0, duration - self.prefetch) * SAMPLE_RATE * FRAME_BYTES
+        if spawn_at is None or spawn_at == 0:
+            upcoming.spawn()
+        read = 0
+        while True:
+            size = self.packet_size   # server/feedback.py 可能在串流中途改封包大小
+            chunk = source.read(size)
+            if not chunk:
+                return
+            read += len(chunk)
+            if spawn_at and read >= spawn_at:
+                upcoming.spawn()
+                spawn_at = None
+            if not pending and not keep and len(chunk) == size:
+                sender.send(chunk)   # 一般情況：整個封包直接送（mmap 的 memoryview，不複製）
+                continue
+            pending += chunk
+            while len(pending) - keep >= size:
+                sender.send(bytes(pending[:size]))
+                del pending[:size]
+
+    def _crossfade(self, source, pending):
+        """pending 最後 fade_bytes 跟下一首開頭混在一起（就地改寫 pending）"""
+        n = min(self.fade_bytes, len(pending)) // FRAME_BYTES * FRAME_BYTES
+        head = bytearray()
+        while len(head) < n:
+            chunk = source.read(n - len(head))
+            if not chunk:
+                break
+            head += chunk
+        n = len(head) // FRAME_BYTES * FRAME_BYTES
+        if n == 0:
+            return
+        start = len(pending) - min(self.fade_bytes, len(pending)) // FRAME_BYTES * FRAME_BYTES
+        pending[start:start + n] = crossfade(pending[start:start + n], head[:n])
+        pending += head[n:]
+
+    def stats(self) -> dict:
+        return {"tracks": self.tracks, "prefetched": self.prefetched, "max_wait_ms": self.max_wait * 1000}
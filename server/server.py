@@ -2,18 +2,28 @@
 """
 server/server.py
 -----------------------------------
-支援 Timeout / Encryption / Auto Thread 的安全版 Server
+支援 Timeout / Encryption / asyncio 的安全版 Server
 功能：
-- TCP 控制 + 多執行緒
-- AES/Fernet 加密通訊
+- TCP 控制：單一 asyncio event loop 服務所有連線（不再一條連線一個 thread）
+- 長連線 + pipelining："#<id> <command>" 的指令並行處理，回覆帶同一個 id、可能亂序
+- 加密通訊：連線先做 X25519 握手，之後每條連線自己的 AES-GCM / ChaCha20-Poly1305 key（utils/encryptor.py）；
+  沒有握手的舊版 client 仍用共用 key 的 Fernet
+- /secure on：這個 client 收加密的 UDP 音訊（加密頻道，頻道 key 經控制連線發送）
 - Timeout: 60 秒未活動自動斷線
-- 非阻塞主迴圈（節流列印）
+- 存活追蹤：UDP ping（5690）+ 控制連線 frame，單一 timer wheel，不再一條心跳連線一個 thread
+- receiver report（player 每秒送到 5690）：依掉包 / 緩衝調整補送、封包大小、排程提前，不再回報的 endpoint 停送（feedback.py）
+- yt-dlp 搜尋在 music_manager 的 worker pool 裡做（同一個 query 同時只解析一次），
+  event loop 只等結果；逾時回覆錯誤，client 斷線時放棄等待
+- 串流傳送模式：預設 unicast；client 送 "/delivery multicast" 後改送該頻道（mood, codec, secure）的 multicast group
+- 共享 mood 頻道（channel_hub.py）：同一個 mood 只有一條 pipeline，/setudp 登記的 endpoint 都訂閱它
+- 預熱的解碼 pipeline（decoder_pool.py）：mood 頻道開播時直接接上待命的 ffmpeg，不必等啟動
+- metrics（utils/metrics.py）：http://127.0.0.1:9100/metrics，各階段延遲 histogram、串流計數、在線數
 """
+import asyncio
 import os
+import re
 import sys
-import socket, json, threading
 import threading
-import time
 
 # ------------------------------------------------------------
 # 讓 Python 可以正確匯入上層 utils 模組
@@ -23,10 +33,18 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # ------------------------------------------------------------
 # 模組匯入
 # ------------------------------------------------------------
+import liveness
+from channel_hub import ChannelHub
+from feedback import Feedback
+from decoder_pool import DecoderPool
 from mood_analyzer import analyze_text
-from music_manager import search_youtube_music
-from streamer import broadcast_youtube_audio
-from utils.encryptor import encrypt_message, decrypt_message, send_large, recv_large
+from music_manager import (search_youtube_music, search_youtube_music_async, search_youtube_music_next, track_cache,
+                           YOUTUBE_PLAYLISTS)
+from utils import metrics, multicast
+from utils.codec import choose_codec, server_codecs
+from utils.encryptor import HandshakeError, accept_hello, encrypt_message, decrypt_message, is_hello
+from utils.framing import HANDSHAKE_FRAME_SIZE, MAX_FRAME_SIZE, read_frame, write_frame, FrameError
+from utils.heartbeat import HEARTBEAT_PORT
 
 # ------------------------------------------------------------
 # 伺服器設定
@@ -34,171 +52,321 @@ from utils.encryptor import encrypt_message, decrypt_message, send_large, recv_l
 HOST = "0.0.0.0"
 PORT = 5678
 BUFFER_SIZE = 4096
-BACKLOG = 5
+BACKLOG = 1024
+IDLE_TIMEOUT = 60
+
+# pipelined request 的格式："#<request id> <command>"
+TAG_RE = re.compile(r"#(\d+) (.*)", re.S)
+# 只有這些（會等 yt-dlp 解析的）指令另開 task；改 session 狀態的指令依收到的順序直接執行
+CONCURRENT_COMMANDS = ("/prompt ",)
 
 # 串流目的地 UDP Port（⚠️ 由 client/player.py 綁定接收；server 不可綁這個 port）
 UDP_PORT = 5680
 
+# multicast 模式（/delivery multicast）：TTL 1 只在本網段；LOOP 開著時同一台機器上的 player 也收得到
+MULTICAST_TTL = 1
+MULTICAST_LOOP = True
+MULTICAST_INTERFACE = None   # None = 依路由表選介面
+
+# 換歌時的交叉淡化（毫秒，需要 numpy）；0 = 在 sample 邊界直接無縫接上
+CROSSFADE_MS = 0
+
+# 預熱的解碼 pipeline：每個 (mood, codec) 待命 WARM_PER_MOOD 條，已經 resolve、ffmpeg 已啟動並預讀幾秒
+# 預算：待命的 ffmpeg 最多 WARM_MAX_PROCESSES 個、預讀 buffer 最多 WARM_MAX_BYTES；WARM_POOL = False 關閉
+WARM_POOL = True
+WARM_PER_MOOD = 1
+WARM_BUFFER_SECONDS = 3.0
+WARM_MAX_PROCESSES = 8
+WARM_MAX_BYTES = 16 * 1024 ** 2
+decoder_pool = DecoderPool(search_youtube_music, YOUTUBE_PLAYLISTS.keys(), per_mood=WARM_PER_MOOD,
+                           buffer_seconds=WARM_BUFFER_SECONDS, max_processes=WARM_MAX_PROCESSES,
+                           max_bytes=WARM_MAX_BYTES) if WARM_POOL else None
+
+# 共享 mood 頻道：每個 (mood, codec) 最多一條解碼 pipeline，一首接一首無縫播放
+channel_hub = ChannelHub(search_youtube_music, ttl=MULTICAST_TTL, loop=MULTICAST_LOOP,
+                         interface=MULTICAST_INTERFACE, crossfade_ms=CROSSFADE_MS, pool=decoder_pool,
+                         resolve_next=search_youtube_music_next)
+
+# 連線統計（benchmark / 監控用）
+connection_stats = {"accepted": 0, "active": 0, "requests": 0}
+
+# client 存活表：UDP ping 與控制連線上的 frame 都會更新（見 liveness.py）
+liveness_table = liveness.LivenessTable()
+
+# player 的 receiver report → 每個頻道 / endpoint 的送法（見 feedback.py）
+receiver_feedback = Feedback(channel_hub)
+
+# UDP 心跳的 client id -> 控制連線位址（client 在 /setudp 帶上心跳 id 時登記）
+heartbeat_sessions = {}
+
+
+def expire_clients(states):
+    """liveness 到期的 client：停止對它串流、清掉它的回報狀態
+
+    控制連線如果其實還在，下一個 /prompt 會重新訂閱；("tcp", addr) 的到期不處理，
+    那條連線由 handle_client 的 IDLE_TIMEOUT / 關閉負責退訂
+    """
+    for state in states:
+        client = heartbeat_sessions.get(state.client_id)
+        if client is not None:
+            channel_hub.unsubscribe(client)
+        if state.endpoint is not None:
+            receiver_feedback.forget(state.endpoint)
+            channel_hub.drop_endpoint(state.endpoint)
+
 # ------------------------------------------------------------
-# 個別 client thread 處理函式
+# metrics（只綁 127.0.0.1）
 # ------------------------------------------------------------
-def handle_client(conn, addr):
-    print(f"[server] Connected by {addr}")
-    conn.settimeout(60)      # 若 60 秒沒活動自動斷線
-    conn.setblocking(False)  # 非阻塞 socket；我們用 try/except + sleep 來友善輪詢
+METRICS_PORT = 9100
+ANALYZE_LATENCY = metrics.histogram("mooddj_analyze_text_seconds", "analyze_text latency")
+SEARCH_LATENCY = metrics.histogram("mooddj_search_seconds", "search_youtube_music latency (cache hit or extraction)")
+REQUESTS = metrics.counter("mooddj_control_requests_total", "control commands received")
+SEARCH_TIMEOUTS = metrics.counter("mooddj_search_timeouts_total", "searches that hit EXTRACT_TIMEOUT")
+metrics.gauge("mooddj_control_sessions", lambda: connection_stats["active"], "open control connections")
+metrics.gauge("mooddj_live_clients", lambda: len(liveness_table), "clients seen within the liveness timeout")
+metrics.gauge("mooddj_channels", lambda: channel_hub.stats()["channels"], "active mood channels")
+metrics.gauge("mooddj_channel_listeners", lambda: channel_hub.stats()["listeners"], "clients subscribed to a channel")
+metrics.gauge("mooddj_receivers_reporting", lambda: len(receiver_feedback), "players sending receiver reports")
+metrics.gauge("mooddj_receivers_redundant", lambda: receiver_feedback.summary()["redundant"],
+              "receivers currently getting redundant packets")
+metrics.gauge("mooddj_warm_pool_standby", lambda: decoder_pool.stats()["standby"] if decoder_pool else 0,
+              "warm decoders waiting for a channel")
+metrics.gauge("mooddj_warm_pool_processes", lambda: decoder_pool.stats()["processes"] if decoder_pool else 0,
+              "ffmpeg processes held by the warm pool")
+metrics.gauge("mooddj_extractions_total", lambda: track_cache.flights.stats()["started"], "yt-dlp extractions run")
+metrics.gauge("mooddj_extractions_coalesced_total", lambda: track_cache.flights.stats()["coalesced"],
+              "searches that shared an in-flight extraction")
 
-    try:
-        while True:
-            try:
-                # 非阻塞接收封包（分段）
-                try:
-                    encrypted_data = recv_large(conn, BUFFER_SIZE)
-                except BlockingIOError:
-                    time.sleep(0.05)
-                    continue
+# ------------------------------------------------------------
+# 指令處理：回覆文字交給 send（untagged 直接送出；tagged 收集後一次送）
+# ------------------------------------------------------------
+async def run_command(data, session, send):
+    # 回覆封包（加密 + 長度訊框）
+    await send(f"[server] Mood processed: {data}")
 
-                if not encrypted_data:
-                    print(f"[server] {addr} disconnected.")
-                    break
+    # 指令處理
+    if data.startswith("/prompt "):
+        msg = data.replace("/prompt ", "", 1)
+        with ANALYZE_LATENCY.time():
+            mood = analyze_text(msg)
+        # yt-dlp 解析在 worker pool 裡跑，同 mood 的並行請求共用一次解析；
+        # 這個 task 被 cancel（client 斷線）時只是放棄等待
+        try:
+            with SEARCH_LATENCY.time():
+                stream_url = await search_youtube_music_async(mood)
+        except asyncio.TimeoutError:
+            SEARCH_TIMEOUTS.inc()
+            await send(f"[server] Search for {mood} timed out, please try again.")
+            return
 
-                # 解密
-                try:
-                    data = decrypt_message(encrypted_data)
-                except Exception:
-                    print(f"[server] ⚠️  Decryption failed from {addr}")
-                    continue
-
-                print(f"[server] Received (decrypted): {data}")
-
-                # 回覆封包（加密 + 分段）
-                response = f"[server] Mood processed: {data}"
-                while True:
-                    try:
-                        send_large(conn, encrypt_message(response))
-                        break
-                    except BlockingIOError:
-                        time.sleep(0.05)
-
-                # 指令處理
-                if data.startswith("/prompt "):
-                    msg = data.replace("/prompt ", "", 1)
-                    mood = analyze_text(msg)
-                    stream_url = search_youtube_music(mood)
-
-                    # 回覆分析結果
-                    encrypted_response = encrypt_message(f"[server] Mood: {mood}")
-                    sent = 0
-                    while sent < len(encrypted_response):
-                        try:
-                            sent += conn.send(encrypted_response[sent:])
-                        except BlockingIOError:
-                            time.sleep(0.05)
-
-                    # 提示串流目的地（方便你對照 player）
-                    print(f"[server] ▶️  Start streaming to UDP port {UDP_PORT}")
-
-                    # 開新 thread 廣播音樂（由 streamer 決定送往 127.0.0.1:UDP_PORT 或廣播位址）
-                    threading.Thread(
-                        target=broadcast_youtube_audio,
-                        args=(stream_url,),   # 若你的 streamer 支援帶入目標，改成 args=(stream_url, '127.0.0.1', UDP_PORT)
-                        daemon=True
-                    ).start()
-
-                else:
-                    invalid_msg = encrypt_message("[server] Invalid command.")
-                    sent = 0
-                    while sent < len(invalid_msg):
-                        try:
-                            sent += conn.send(invalid_msg[sent:])
-                        except BlockingIOError:
-                            time.sleep(0.05)
-
-            except socket.timeout:
-                print(f"[server] {addr} connection timeout.")
-                break
+        # 回覆分析結果
+        await send(f"[server] Mood: {mood}")
+
+        # 加入這個 mood 的頻道：已經在播就從直播位置開始收，不另開 ffmpeg
+        # multicast：endpoint 是這個頻道 (mood, codec, secure) 的 group（沒有路由時退回 client 的 unicast endpoint）
+        unicast = (session["addr"][0], session["udp_port"])
+        group = (channel_hub.group_for(mood, session["codec"], session["secure"])
+                 if session["delivery"] == "multicast" else None)
+        endpoint = channel_hub.endpoint_for(unicast, group, UDP_PORT)
+        if multicast.is_multicast(endpoint[0]):
+            await send(f"[server] Multicast: {endpoint[0]}:{endpoint[1]}")
+        channel = channel_hub.subscribe(session["addr"], mood, session["codec"], endpoint, stream_url,
+                                        secure=session["secure"], reporter=unicast)
+        if session["secure"]:
+            # 頻道 key 只在加密的控制連線上送
+            await send(channel.sealer.announcement())
+        print(f"[server] ▶️  {session['addr']} listening to {mood} at {endpoint[0]}:{endpoint[1]}")
+
+    elif data.startswith("/codec "):
+        # client 依偏好列出可解碼的 codec，例如 "/codec opus,pcm"
+        session["codec"] = choose_codec(data.replace("/codec ", "", 1).split(","))
+        await send(f"[server] Codec: {session['codec']}")
+
+    elif data.startswith("/setudp "):
+        # client 的 UDP 接收 port（IP 用控制連線的來源位址），可選第二個欄位是 client 的 UDP 心跳 id：
+        # 心跳到期時據此停止對這條連線串流
+        try:
+            port, *client_id = data.replace("/setudp ", "", 1).split()
+            session["udp_port"] = int(port)
+            if client_id:
+                session["client_id"] = int(client_id[0])
+                heartbeat_sessions[session["client_id"]] = session["addr"]
+            await send(f"[server] UDP endpoint: {session['addr'][0]}:{session['udp_port']}")
+        except ValueError:
+            await send("[server] Invalid UDP port.")
 
+    elif data.startswith("/delivery "):
+        mode = data.replace("/delivery ", "", 1).strip()
+        session["delivery"] = mode if mode in multicast.DELIVERY_MODES else "unicast"
+        await send(f"[server] Delivery: {session['delivery']}")
+
+    elif data.startswith("/secure "):
+        on = data.replace("/secure ", "", 1).strip() == "on"
+        if on and session["cipher"] is None:
+            # 舊版 Fernet 連線用的是共用 key，頻道 key 不能在上面送
+            await send("[server] Secure audio needs an encrypted session (client hello).")
+        else:
+            session["secure"] = on
+            await send(f"[server] Secure audio: {'on' if on else 'off'}")
+
+    elif data == "/ping":
+        await send("[server] pong")
+
+    else:
+        await send("[server] Invalid command.")
+
+
+async def run_tagged(tag, data, session, writer):
+    """帶 request id 的指令：所有回覆合成一個 "#<id> ..." frame（/prompt 在獨立 task 裡跑，可亂序回覆）"""
+    lines = []
+
+    async def collect(text):
+        lines.append(text)
+
+    try:
+        await run_command(data, session, collect)
     except Exception as e:
-        print(f"[server] Error: {e}")
-    finally:
-        conn.close()
-        print(f"[server] Connection closed: {addr}")
+        lines.append(f"[server] Error: {e}")
+    try:
+        await write_frame(writer, session["seal"](f"#{tag} " + "\n".join(lines)))
+    except (ConnectionResetError, BrokenPipeError):
+        pass
 
 # ------------------------------------------------------------
-# 心跳監控伺服器（每條心跳連線用 blocking recv，不影響主迴圈）
+# 個別 client coroutine 處理函式
 # ------------------------------------------------------------
-def heartbeat_server():
-    hb_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    hb_port = 5690
-    hb_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    hb_sock.bind((HOST, hb_port))
-    hb_sock.listen(5)
-    hb_sock.setblocking(False)
-    print(f"[server] Listening [TCP] heartbeat on {HOST}:{hb_port}")
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    # codec 由 /codec 協商，預設未壓縮 PCM；delivery 由 /delivery 設定，預設 unicast
+    # udp_port 由 /setudp 設定，預設 5680（player.py 綁的 port）
+    # seal / open：握手後換成這條連線的 AEAD；沒握手（舊版 client）就是共用 key 的 Fernet
+    session = {"addr": addr, "codec": "pcm", "delivery": "unicast", "udp_port": UDP_PORT, "secure": False,
+               "cipher": None, "seal": encrypt_message, "open": decrypt_message}
+    tasks = set()
+    first = True
+    max_size = HANDSHAKE_FRAME_SIZE   # 握手 / 第一個指令解密成功之前只收小 frame
+    connection_stats["accepted"] += 1
+    connection_stats["active"] += 1
+    print(f"[server] Connected by {addr}")
+
+    async def send(text):
+        await write_frame(writer, session["seal"](text))
 
-    while True:
-        try:
-            conn, addr = hb_sock.accept()
-            print(f"[heartbeat] Connected by {addr}")
-            threading.Thread(target=handle_heartbeat, args=(conn, addr), daemon=True).start()
-        except BlockingIOError:
-            time.sleep(0.3)
-            continue
-
-def handle_heartbeat(conn, addr):
-    """保持心跳連線直到 client 主動中斷（阻塞式，簡單穩定）"""
-    conn.setblocking(True)
     try:
         while True:
-            data = conn.recv(32)
-            if not data:
+            # 等待一個完整封包；60 秒沒活動自動斷線
+            try:
+                encrypted_data = await asyncio.wait_for(read_frame(reader, max_size), IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"[server] {addr} connection timeout.")
+                break
+
+            if encrypted_data is None:
+                print(f"[server] {addr} disconnected.")
                 break
-            msg = data.decode(errors="replace").strip()
-            # 可視需求加上驗證
-            if msg == "ping":
-                conn.sendall(b"pong")
+
+            # 第一個 frame 是 HELLO：握手，之後這條連線都用協商出來的 key
+            if first and is_hello(encrypted_data):
+                first = False
+                try:
+                    cipher, reply = accept_hello(encrypted_data)
+                except HandshakeError as e:
+                    print(f"[server] ⚠️  Handshake failed from {addr}: {e}")
+                    break
+                session.update(cipher=cipher, seal=cipher.seal, open=cipher.open)
+                max_size = MAX_FRAME_SIZE
+                await write_frame(writer, reply)
+                continue
+            first = False
+
+            # 解密
+            try:
+                data = session["open"](encrypted_data)
+            except Exception:
+                print(f"[server] ⚠️  Decryption failed from {addr}")
+                if session["cipher"] is not None:
+                    break   # AEAD 的訊息計數已經對不上（或是被竄改），這條連線不能再用
+                continue
+            max_size = MAX_FRAME_SIZE
+
+            print(f"[server] Received (decrypted): {data}")
+            connection_stats["requests"] += 1
+            REQUESTS.inc()
+            liveness_table.touch(("tcp", addr), addr)
+
+            # "#<id> <command>"：pipelined request；/prompt 不等前一個做完，
+            # /setudp、/codec、/secure 等改 session 狀態的指令在這裡依序做完才讀下一個 frame
+            tagged = TAG_RE.match(data)
+            if tagged and tagged.group(2).startswith(CONCURRENT_COMMANDS):
+                task = asyncio.create_task(run_tagged(tagged.group(1), tagged.group(2), session, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            elif tagged:
+                await run_tagged(tagged.group(1), tagged.group(2), session, writer)
+            else:
+                await run_command(data, session, send)
+
     except (ConnectionResetError, BrokenPipeError):
-        pass
+        print(f"[server] {addr} disconnected.")
+    except FrameError as e:
+        print(f"[server] ⚠️  Bad frame from {addr}: {e}")
+    except Exception as e:
+        print(f"[server] Error: {e}")
     finally:
-        conn.close()
+        for task in tasks:
+            task.cancel()
+        connection_stats["active"] -= 1
+        liveness_table.remove(("tcp", addr))
+        if heartbeat_sessions.get(session.get("client_id")) == addr:
+            del heartbeat_sessions[session["client_id"]]
+        channel_hub.unsubscribe(addr)
+        writer.close()
+        print(f"[server] Connection closed: {addr}")
 
 # ------------------------------------------------------------
-# 主伺服器啟動邏輯（Nonblocking + 列印節流）
+# 主伺服器啟動邏輯（asyncio event loop）
 # ------------------------------------------------------------
-def start_server():
-    # TCP 控制端
-    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    srv.bind((HOST, PORT))
-    srv.listen(BACKLOG)
-    srv.setblocking(False)
-
-    print(f"[server] Listening [TCP] control  on {HOST}:{PORT}")
+async def serve(host=HOST, port=PORT, ready=None, heartbeat_port=HEARTBEAT_PORT):
+    """啟動 TCP 控制端並永久服務；ready（asyncio.Event / threading.Event）於開始 listen 後 set
+
+    heartbeat_port 為 None 時不開 UDP ping endpoint（benchmark 在同一個 process 開多個 server 用）
+    """
+    srv = await asyncio.start_server(handle_client, host, port, backlog=BACKLOG, reuse_address=True)
+    print(f"[server] Listening [TCP] control  on {host}:{port}")
+    if heartbeat_port is not None:
+        hb_transport, hb_ticker = await liveness.start(liveness_table, host, heartbeat_port, receiver_feedback,
+                                                       expire_clients)
+        print(f"[server] Listening [UDP] heartbeat on {host}:{heartbeat_port}")
     print(f"[server] Target UDP stream port (client listens here): {UDP_PORT}")
+    if ready is not None:
+        ready.set()
+    async with srv:
+        await srv.serve_forever()
+
+
+def warm_up(listening):
+    """開始 listen 之後才做：探測 ffmpeg 能產生的 codec、預先解析四種心情的曲目（這時才 import yt_dlp）、預熱 decoder pool"""
+    listening.wait()
+    print(f"[server] Codecs: {', '.join(server_codecs())}")
+    track_cache.warm(YOUTUBE_PLAYLISTS.values())
+    track_cache.start_refresher()
+    if decoder_pool is not None:
+        decoder_pool.start()
 
-    # 啟動心跳監控執行緒
-    threading.Thread(target=heartbeat_server, daemon=True).start()
 
-    last_log = 0.0
+def start_server():
+    metrics.serve(METRICS_PORT)
+    # 重啟後先接受連線；第一個 /prompt 如果比預熱早到，只是跟預熱共用同一次解析（single-flight）
+    listening = threading.Event()
+    threading.Thread(target=warm_up, args=(listening,), daemon=True).start()
+
     try:
-        while True:
-            try:
-                conn, addr = srv.accept()
-                threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
-            except BlockingIOError:
-                # 節流列印，避免洗版
-                now = time.time()
-                if now - last_log >= 1.0:
-                    print("[server] Nonblocking loop active")
-                    last_log = now
-                time.sleep(0.05)
-                continue
+        asyncio.run(serve(ready=listening))
     except KeyboardInterrupt:
         print("\n[server] Shutting down...")
-    finally:
-        srv.close()
 
 # ------------------------------------------------------------
 # 主程式入口
 # ------------------------------------------------------------
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    start_server()
@@ -1,46 +1,275 @@
 # -*- coding: utf-8 -*-
+import random
 import socket
 import subprocess
 import time
+from collections import deque
+
+from pacer import Pacer, PACKET_SIZE, SAMPLE_RATE, SAMPLE_WIDTH, CHANNELS
+from pcm_cache import PCMCache, cache_key
+from utils import metrics, multicast
+from utils.codec import CODEC_IDS, PCM_SAMPLES_PER_OPUS_FRAME, OPUS_BITRATE, ffmpeg_output_args, iter_ogg_packets
+from utils.packet import SEALED_VERSION, SEQ_MOD, VERSION, pack_header, send_packet
 
 UDP_PORT = 5680
-BUFFER_SIZE = 1024
+BUFFER_SIZE = PACKET_SIZE
+MAX_REDUNDANCY = 2          # 每個目的地最多跟著重送前幾個封包（server/feedback.py 依掉包率決定）
+
+# ffmpeg 輸出格式；也是快取 key 的一部分
+CACHE_FORMATS = {
+    "pcm": "s16le:1ch:44100",              # 原始 PCM (16-bit, mono, 44.1kHz)
+    "opus": f"ogg-opus:1ch:{OPUS_BITRATE}:20ms",
+}
+OPUS_FRAME_PCM_BYTES = PCM_SAMPLES_PER_OPUS_FRAME * SAMPLE_WIDTH * CHANNELS
+
+# metrics（server 的 /metrics endpoint 一起輸出）
+PACKETS_SENT = metrics.counter("mooddj_stream_packets_sent_total", "UDP audio datagrams sent (one per target)")
+BYTES_SENT = metrics.counter("mooddj_stream_bytes_sent_total", "UDP audio bytes sent including header")
+SEND_DROPS = metrics.counter("mooddj_stream_send_drops_total", "datagrams dropped because sendto failed")
+REDUNDANT_SENT = metrics.counter("mooddj_stream_redundant_packets_total",
+                                 "earlier datagrams re-sent to lossy receivers (redundancy)")
+FIRST_PACKET = metrics.histogram("mooddj_stream_first_packet_seconds", "stream start to first packet sent")
+FFMPEG_FIRST_BYTE = metrics.histogram("mooddj_ffmpeg_first_byte_seconds", "ffmpeg spawn to first output byte")
+CACHE_HITS = metrics.counter("mooddj_pcm_cache_hits_total", "tracks streamed from the on-disk cache")
+CACHE_MISSES = metrics.counter("mooddj_pcm_cache_misses_total", "tracks transcoded by ffmpeg")
+
+pcm_cache = None
+
+
+def get_pcm_cache():
+    global pcm_cache
+    if pcm_cache is None:
+        pcm_cache = PCMCache()
+    return pcm_cache
+
+
+class StreamStopped(Exception):
+    """PacketSender 的 stop 被設定（例如頻道已經沒有訂閱者）"""
+
+
+class PacketSender:
+    """替每個 chunk 加上 header（codec / stream id / seq / timestamp），依 pacer 排程送出
+
+    target 可以是單一 (ip, port)，也可以是可迭代的目的地集合（例如 channel_hub.Subscribers）：
+    header 只組一次，每個目的地各送一份；集合在串流中途變動時，下一個封包就送給新的成員。
+    stop 是 threading.Event，設定後下一次 send 丟 StreamStopped。
+    sealer 是 utils.encryptor.PacketSealer：給了就送加密封包（SEALED_VERSION），每個封包只加密一次，
+    每個目的地送同一份密文。
+    redundancy：目的地 -> 每個新封包之後再補送前幾個封包（0 ~ MAX_REDUNDANCY），由 server/feedback.py 依
+    receiver report 設定；jitter buffer 會把先到的那份放進去、重複的丟掉，掉一份不會變成一個洞。
+    sendto 失敗不重試也不睡（不讓一個壞掉的目的地卡住整個頻道），只計入 failures[目的地]（連續失敗數）。
+    """
+
+    def __init__(self, sock, target, pacer, stream_id=None, codec="pcm", stop=None, sealer=None):
+        self.sock = sock
+        self.targets = (target,) if isinstance(target, tuple) else target
+        self.pacer = pacer
+        self.stop = stop
+        self.sealer = sealer
+        self.version = VERSION if sealer is None else SEALED_VERSION
+        self.stream_id = random.getrandbits(16) if stream_id is None else stream_id
+        self.codec_id = CODEC_IDS[codec]
+        self.seq = 0
+        self.timestamp = 0   # 單位：sample
+        self.dropped = 0     # 送不出去的 (封包, 目的地) 數
+        self.failures = {}   # 目的地 -> 連續送不出去的封包數
+        self.redundancy = {}
+        self.history = deque(maxlen=MAX_REDUNDANCY)   # 最近送出的 (header, 密文 / payload)，有 redundancy 時才留
+        self.started = time.perf_counter()
+
+    def send(self, chunk, pcm_bytes=None):
+        """pcm_bytes：這個封包解碼後的 PCM 長度（壓縮封包用它來排程；PCM 就是 len(chunk)）"""
+        pcm_bytes = len(chunk) if pcm_bytes is None else pcm_bytes
+        header = pack_header(self.stream_id, self.seq, self.timestamp, self.codec_id, self.version)
+        self.pacer.wait(pcm_bytes)
+        if self.stop is not None and self.stop.is_set():
+            raise StreamStopped()
+        if self.sealer is not None:
+            # header 是 nonce：seq 繞回之前頻道就該換 key（86 封包/秒要一年半以上）
+            if self.seq >= SEQ_MOD:
+                raise StreamStopped()
+            chunk = self.sealer.seal(header, chunk)
+        sent = 0
+        for target in self.targets:
+            sent += self._send_to(header, chunk, target)
+        redundancy = self.redundancy
+        if redundancy:
+            sent += self._send_redundant(redundancy)
+            # sealer / mmap 的 view 之後會被覆寫或釋放：補送要用的這份自己留一份
+            self.history.appendleft((header, bytes(chunk)))
+        elif self.history:
+            self.history.clear()
+        if self.seq == 0:
+            FIRST_PACKET.observe(time.perf_counter() - self.started)
+        PACKETS_SENT.inc(sent)
+        BYTES_SENT.inc(sent * (len(header) + len(chunk)))
+        self.seq += 1
+        self.timestamp += pcm_bytes // (SAMPLE_WIDTH * CHANNELS)
+
+    def _send_to(self, header, chunk, target) -> int:
+        """回傳送出的份數（0 或 1）"""
+        try:
+            send_packet(self.sock, header, chunk, target)
+        except OSError as e:
+            self.dropped += 1
+            self.failures[target] = self.failures.get(target, 0) + 1
+            SEND_DROPS.inc()
+            metrics.log_sampled(("sendto", target), f"[streamer] OSError during sendto {target}: {e}, packet dropped")
+            return 0
+        if target in self.failures:
+            del self.failures[target]
+        return 1
+
+    def _send_redundant(self, redundancy) -> int:
+        """補送前幾個封包給需要的目的地（剛加入 redundancy 時 history 還沒滿，就少送幾份）"""
+        sent = 0
+        for target, count in redundancy.items():
+            for header, chunk in list(self.history)[:count]:
+                sent += self._send_to(header, chunk, target)
+        REDUNDANT_SENT.inc(sent)
+        return sent
+
+
+class TeeReader:
+    """讀 ffmpeg stdout 的同時把讀到的 bytes 寫進快取；第一次讀到資料時記錄 ffmpeg 首 byte 延遲"""
+
+    def __init__(self, f, writer, started=None):
+        self.f = f
+        self.writer = writer
+        self.started = started
+
+    def read(self, n):
+        data = self.f.read(n)
+        if data:
+            if self.started is not None:
+                FFMPEG_FIRST_BYTE.observe(time.perf_counter() - self.started)
+                self.started = None
+            self.writer.write(data)
+        return data
 
-def broadcast_youtube_audio(audio_url: str, target_ip: str = "127.0.0.1", target_port: int = UDP_PORT):
-    """Fetch audio stream from YouTube and broadcast chunks via UDP broadcast."""
-    print(f"[streamer] Broadcasting YouTube audio: {audio_url} to all clients on network ({target_ip}:{target_port})")
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    sock.bind(("0.0.0.0", 0))
 
-    # 使用 ffmpeg 從 YouTube 串流轉成 PCM (16-bit, mono, 44.1kHz)
-    cmd = [
-        "ffmpeg",
-        "-i", audio_url,
-        "-f", "s16le",        # 原始 PCM
-        "-acodec", "pcm_s16le",
-        "-ac", "1",
-        "-ar", "44100",
-        "-"
-    ]
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+def send_opus(sender, f):
+    """從 Ogg 串流拆出 20 ms Opus packet 逐一送出"""
+    for packet in iter_ogg_packets(f):
+        sender.send(packet, pcm_bytes=OPUS_FRAME_PCM_BYTES)
 
+
+class TrackSource:
+    """一首歌轉好碼的 bytes（read(n) / close()），建立時就開始解碼
+
+    快取命中：從 mmap 切片（PCM 是 memoryview，不複製）；未命中：立刻啟動 ffmpeg，讀取時邊寫入快取，
+    讀到結尾且 ffmpeg 正常結束才 commit。play_queue 用它在上一首還在播時先開好下一首。
+    """
+
+    def __init__(self, audio_url, codec="pcm"):
+        self.url = audio_url
+        self.codec = codec
+        self.process = None
+        self.completed = False
+        cache = get_pcm_cache()
+        key = cache_key(audio_url, CACHE_FORMATS[codec])
+        self.mm = cache.open(key)
+        if self.mm is not None:
+            CACHE_HITS.inc()
+            print(f"[streamer] {codec} cache hit ({len(self.mm)} bytes), streaming from disk")
+            self.view = memoryview(self.mm)
+            self.offset = 0
+        else:
+            CACHE_MISSES.inc()
+            self.writer = cache.writer(key)
+            cmd = ["ffmpeg", "-i", audio_url] + ffmpeg_output_args(codec)
+            started = time.perf_counter()
+            self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self.reader = TeeReader(self.process.stdout, self.writer, started)
+
+    def duration(self):
+        """PCM 快取命中時的長度（秒）；ffmpeg 邊轉邊送或 Opus 時不知道，回傳 None"""
+        if self.mm is None or self.codec != "pcm":
+            return None
+        return len(self.mm) / (SAMPLE_RATE * SAMPLE_WIDTH * CHANNELS)
+
+    def read(self, n):
+        if self.mm is not None:
+            if self.codec != "pcm":
+                return self.mm.read(n)
+            if self.offset >= len(self.view):
+                return b""
+            chunk = self.view[self.offset:self.offset + n]
+            self.offset += len(chunk)
+            return chunk
+        chunk = self.reader.read(n)
+        if not chunk:
+            self.completed = self.process.wait() == 0
+        return chunk
+
+    def close(self):
+        if self.mm is not None:
+            self.view.release()
+            try:
+                self.mm.close()
+            except BufferError:
+                pass   # 例外（例如 StreamStopped）的 traceback 還握著最後一個切片；mmap 被回收時自己關
+            return
+        self.process.terminate()
+        if self.completed:
+            self.writer.commit()
+        else:
+            self.writer.abort()
+
+
+def send_source(sender, source, packet_size=BUFFER_SIZE):
+    """把一個 TrackSource 依 codec 切成封包送完"""
+    if source.codec == "opus":
+        send_opus(sender, source)
+        return
     while True:
-        chunk = process.stdout.read(BUFFER_SIZE)
+        chunk = source.read(packet_size)
         if not chunk:
-            print("[streamer] No more data, stream end.")
             break
-        while True:
-            try:
-                sock.sendto(chunk, (target_ip, target_port))
-                print(f"[streamer] Broadcasted chunk {len(chunk)} bytes")
-                break
-            except OSError as e:
-                print(f"[streamer] OSError during sendto: {e}, retrying in 0.05s")
-                time.sleep(0.05)
-        time.sleep(0.005)
-
-    time.sleep(0.1)
-    process.terminate()
-    sock.close()
-    print("[streamer] Done broadcasting.")
\ No newline at end of file
+        sender.send(chunk)
+
+
+def open_stream_socket(target_ip, target_port, group=None, ttl=multicast.DEFAULT_TTL, loop=True, interface=None):
+    """回傳 (socket, 目的地)：有 group 時送 multicast，沒有 multicast 路由就退回 unicast 到 target_ip"""
+    if group:
+        try:
+            sock = multicast.open_sender(group, target_port, ttl, loop, interface)
+            return sock, (group, target_port)
+        except OSError as e:
+            print(f"[streamer] ⚠️ Multicast to {group} unavailable ({e}), falling back to unicast {target_ip}")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    return sock, (target_ip, target_port)
+
+
+def broadcast_youtube_audio(audio_url: str, target_ip: str = "127.0.0.1", target_port: int = UDP_PORT,
+                            packet_size: int = PACKET_SIZE, burst: int = 1, codec: str = "pcm",
+                            group: str = None, ttl: int = multicast.DEFAULT_TTL, loop: bool = True,
+                            interface: str = None):
+    """Fetch audio stream from YouTube and broadcast chunks via UDP (unicast / broadcast or multicast).
+
+    packet_size: 每個 UDP 封包的 PCM bytes；burst: 每次喚醒連送幾個封包；
+    codec: "pcm" 或 "opus"（見 utils/codec.py）；
+    group: multicast group（見 utils/multicast.py），None 時 unicast 到 target_ip；
+    ttl / loop / interface: multicast 的 TTL、是否送回本機、送出的介面。
+    """
+    sock, target = open_stream_socket(target_ip, target_port, group, ttl, loop, interface)
+    print(f"[streamer] Broadcasting YouTube audio: {audio_url} to {target[0]}:{target[1]}")
+    sock.bind(("0.0.0.0", 0))
+    pacer = Pacer(burst=burst)
+    sender = PacketSender(sock, target, pacer, codec=codec)
+    try:
+        stream_track(sender, audio_url, packet_size, codec)
+    finally:
+        sock.close()
+    print(f"[streamer] Done broadcasting. pacing={pacer.stats.summary()} drift={pacer.drift() * 1000:.1f}ms")
+
+
+def stream_track(sender, audio_url: str, packet_size: int = PACKET_SIZE, codec: str = "pcm"):
+    """送完一首：快取命中就從 mmap 送，否則 ffmpeg 轉碼並寫入快取"""
+    source = TrackSource(audio_url, codec)
+    try:
+        send_source(sender, source, packet_size)
+        print("[streamer] No more data, stream end.")
+    finally:
+        source.close()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+utils/codec.py
+-----------------------------------
+UDP 音訊的編碼模式（server streamer / client player / peer relay 共用）
+ - pcm ：ffmpeg 輸出 s16le mono 44.1 kHz，約 706 kbit/s（fallback，永遠可用）
+ - opus：ffmpeg 以 libopus 編成固定 20 ms 的封包（Ogg 封裝），server 拆出 packet 後逐包送出；
+         client 用 opuslib 解碼並重取樣回 44.1 kHz，後面的 jitter buffer / 播放不需改
+
+協商：client 在控制連線送 "/codec opus,pcm"（依偏好排序），server 回覆選中的 codec。
+server 的 ffmpeg 沒有 libopus 時（server_codecs() 啟動時探測一次 ffmpeg -encoders）只選 pcm，不會給出放不出聲音的串流。
+opuslib 是選用套件，沒安裝時 available_codecs() 只會回報 pcm。
+"""
+import struct
+
+from utils.packet import CODEC_PCM, CODEC_OPUS
+
+SAMPLE_RATE = 44100
+OPUS_RATE = 48000
+OPUS_FRAME_MS = 20
+OPUS_BITRATE = "64k"
+PCM_SAMPLES_PER_OPUS_FRAME = SAMPLE_RATE * OPUS_FRAME_MS // 1000   # 882
+
+CODEC_IDS = {"pcm": CODEC_PCM, "opus": CODEC_OPUS}
+CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+SERVER_CODECS = ("opus", "pcm")
+OPUS_ENCODER = "libopus"
+
+_server_codecs = None
+
+
+def ffmpeg_output_args(codec: str) -> list:
+    """ffmpeg 輸出參數（接在 -i <url> 之後）"""
+    if codec == "opus":
+        return [
+            "-vn", "-ac", "1", "-ar", str(OPUS_RATE),
+            "-c:a", "libopus", "-b:a", OPUS_BITRATE,
+            "-frame_duration", str(OPUS_FRAME_MS), "-application", "audio",
+            "-page_duration", str(OPUS_FRAME_MS * 1000),   # 每頁一包，降低延遲
+            "-f", "ogg", "-",
+        ]
+    return [
+        "-f", "s16le",        # 原始 PCM
+        "-acodec", "pcm_s16le",
+        "-ac", "1",
+        "-ar", str(SAMPLE_RATE),
+        "-",
+    ]
+
+
+def ffmpeg_encoders() -> set:
+    """ffmpeg -encoders 列出的 encoder 名稱；沒有 ffmpeg / 執行失敗時回傳空集合"""
+    import subprocess
+    try:
+        out = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True,
+                             timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return set()
+    # 每行：" A..... libopus              libopus Opus"，旗標之後那欄是名稱
+    return {fields[1] for fields in map(str.split, out.splitlines()) if len(fields) > 1}
+
+
+def server_codecs() -> tuple:
+    """server 實際能產生的 codec（依偏好排序）；只探測一次，ffmpeg 沒有 libopus 時只剩 pcm"""
+    global _server_codecs
+    if _server_codecs is None:
+        opus = OPUS_ENCODER in ffmpeg_encoders()
+        _server_codecs = tuple(name for name in SERVER_CODECS if name != "opus" or opus)
+    return _server_codecs
+
+
+def choose_codec(offered) -> str:
+    """從 client 提供的清單（依偏好）挑第一個 server 也支援的"""
+    codecs = server_codecs()
+    for name in offered:
+        name = name.strip().lower()
+        if name in codecs:
+            return name
+    return "pcm"
+
+
+def available_codecs() -> list:
+    """本機能解碼的 codec（依偏好排序）"""
+    try:
+        import opuslib  # noqa: F401
+        return ["opus", "pcm"]
+    except Exception:
+        return ["pcm"]
+
+
+# ------------------------------------------------------------
+# Ogg 拆包（只需處理 ffmpeg 產生的單一 logical stream）
+# ------------------------------------------------------------
+OGG_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+
+
+def iter_ogg_packets(f):
+    """從 file-like（有 read(n)）逐一讀出 Ogg packet；跳過 OpusHead / OpusTags"""
+    partial = b""
+    while True:
+        header = f.read(OGG_PAGE_HEADER.size)
+        if len(header) < OGG_PAGE_HEADER.size:
+            return
+        capture, _, _, _, _, _, _, nsegs = OGG_PAGE_HEADER.unpack(header)
+        if capture != b"OggS":
+            raise ValueError("lost Ogg page sync")
+        lacing = f.read(nsegs)
+        body = f.read(sum(lacing))
+        pos = 0
+        for size in lacing:
+            partial += body[pos:pos + size]
+            pos += size
+            if size < 255:
+                if not partial.startswith((b"OpusHead", b"OpusTags")):
+                    yield partial
+                partial = b""
+
+
+# ------------------------------------------------------------
+# 解碼器：payload -> 44.1 kHz s16le PCM
+# ------------------------------------------------------------
+class PCMDecoder:
+    def decode(self, payload):
+        return payload
+
+
+class OpusDecoder:
+    """opuslib 解 48 kHz，再線性內插重取樣到 44.1 kHz（跨封包保留上一個 sample 避免接縫）"""
+
+    def __init__(self):
+        import numpy as np
+        import opuslib
+        self.np = np
+        self.decoder = opuslib.Decoder(OPUS_RATE, 1)
+        self.frame_size = OPUS_RATE * OPUS_FRAME_MS // 1000
+        self.last = 0.0
+        self.phase = 0.0
+
+    def decode(self, payload):
+        np = self.np
+        pcm = np.frombuffer(self.decoder.decode(bytes(payload), self.frame_size), dtype=np.int16)
+        src = np.concatenate(([self.last], pcm.astype(np.float32)))
+        step = OPUS_RATE / SAMPLE_RATE
+        positions = np.arange(self.phase, len(pcm), step)
+        out = np.interp(positions, np.arange(len(src)), src)
+        self.phase = positions[-1] + step - len(pcm)
+        self.last = src[-1]
+        return np.clip(out, -32768, 32767).astype(np.int16).tobytes()
+
+
+def make_decoder(codec_id: int):
+    if codec_id == CODEC_OPUS:
+        return OpusDecoder()
+    return PCMDecoder()
+
+
+class DecoderSet:
+    """依封包 header 的 codec 欄位挑解碼器；換串流時重建（Opus 解碼器有狀態）"""
+
+    def __init__(self):
+        self.stream_id = None
+        self.decoders = {}
+
+    def decode(self, codec_id, stream_id, payload):
+        if stream_id != self.stream_id:
+            self.stream_id = stream_id
+            self.decoders = {}
+        decoder = self.decoders.get(codec_id)
+        if decoder is None:
+            decoder = self.decoders[codec_id] = make_decoder(codec_id)
+        return decoder.decode(payload)
@@ -2,10 +2,38 @@
 """
 utils/encryptor.py
 -----------------------------------
-封裝訊息加密與解密功能 (AES-based Fernet)
-供 client / server 共用
+封裝訊息加密與解密功能，供 client / server 共用
+
+控制連線（AEAD session）：
+ - 連線後第一個 frame 是握手：client 送 HELLO（演算法 + X25519 臨時公鑰），server 回 HELLO（公鑰 + 確認碼）
+ - 兩邊以 HKDF（salt = 共用的 SECRET_KEY）從 ECDH 結果導出兩個方向各一把 key：
+   每條連線的 key 都不同，沒有 SECRET_KEY 的一方握手會失敗（確認碼驗不過）
+ - 之後每個 frame = 密文 + 16-byte tag，nonce 是各方向的訊息計數（不上線路，同 TLS 1.3）；
+   比 Fernet 少了 base64、IV、HMAC，一則指令的額外長度從 ~100 bytes 變成 16 bytes
+ - 演算法：AES-256-GCM（有 AES-NI 時最快，預設）或 ChaCha20-Poly1305（沒有 AES 指令的 CPU）
+
+UDP 音訊（見 utils/packet.py 的 SEALED_VERSION）：
+ - 每個加密頻道一把隨機 key（PacketSealer），經由控制連線（已加密）發給訂閱者；
+   一個封包只加密一次，unicast / multicast / P2P 中繼的每個收聽者都收同一份
+ - 12-byte 封包 header 本身就是 nonce（stream id + seq + timestamp 在同一把 key 下不重複），
+   篡改 header 會讓 tag 驗不過；每個封包只多 16-byte tag
+ - encrypt_into / decrypt_into 寫進預先配置的 buffer，不為每個封包建立新的 bytes
+
+舊版 client（第一個 frame 不是 HELLO）仍以共用 key 的 Fernet（encrypt_message / decrypt_message）通訊。
 """
+import base64
+import collections
+import os
+import struct
+
+from cryptography.exceptions import InvalidTag
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from utils.packet import HEADER_SIZE, VERSION
 
 # 你可以固定一組 key（或動態生成後寫入檔案）
 # 產生新 key 可用：
@@ -25,26 +53,219 @@ def decrypt_message(encrypted_data: bytes) -> str:
     """解密 bytes 為字串"""
     return cipher.decrypt(encrypted_data).decode()
 
-# ============================================================
-#  Large Message Split / Join Utilities
-# ============================================================
-
-def send_large(sock, data: bytes):
-    """傳送大封包：前置 10-byte 長度 header"""
-    length = len(data)
-    header = f"{length:<10}".encode()  # 固定 10 位，左對齊填空
-    sock.sendall(header + data)
-
-def recv_large(sock, buffer_size=1024):
-    """接收大封包：先讀 header，再根據長度讀完整內容"""
-    header = sock.recv(10)
-    if not header:
-        return b""
-    total_len = int(header.decode().strip())
-    data = b""
-    while len(data) < total_len:
-        chunk = sock.recv(buffer_size)
-        if not chunk:
-            break
-        data += chunk
-    return data
\ No newline at end of file
+# 訊框（長度 prefix）請見 utils/framing.py
+
+# ------------------------------------------------------------
+# AEAD
+# ------------------------------------------------------------
+ALGORITHMS = {"aes-gcm": AESGCM, "chacha20": ChaCha20Poly1305}
+ALGORITHM_IDS = {"aes-gcm": 0, "chacha20": 1}
+DEFAULT_ALGORITHM = "aes-gcm"
+TAG_SIZE = 16
+KEY_SIZE = 32
+
+HELLO_MAGIC = b"MDJ\x02"
+HELLO = struct.Struct("!4sB32s")           # magic, 演算法, X25519 公鑰
+COUNTER_NONCE = struct.Struct("!4xQ")      # 控制連線的 nonce：4 bytes 0 + 64-bit 訊息計數
+HKDF_INFO = b"mooddj control session v2"
+
+# 音訊封包的解密 slot（跟 client/udp_receiver.py 一樣：回傳的 view 在再收 SLOTS 個封包前有效）
+SLOTS = 256
+SLOT_SIZE = 2048
+HOLD_PACKETS = 64      # key 還沒到（控制連線的回覆比第一個封包晚）時先留著的加密封包，約 0.7 秒 PCM
+
+
+class HandshakeError(ValueError):
+    """握手 frame 格式不對、演算法不支援，或確認碼驗不過（雙方的 SECRET_KEY 不同）"""
+
+
+def _psk():
+    return base64.urlsafe_b64decode(SECRET_KEY)
+
+
+def _public_bytes(private):
+    return private.public_key().public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+
+
+def _derive(private, peer_public, transcript):
+    shared = private.exchange(X25519PublicKey.from_public_bytes(peer_public))
+    keys = HKDF(hashes.SHA256(), 2 * KEY_SIZE, salt=_psk(), info=HKDF_INFO + transcript).derive(shared)
+    return keys[:KEY_SIZE], keys[KEY_SIZE:]    # client → server, server → client
+
+
+def is_hello(frame) -> bool:
+    return len(frame) >= HELLO.size and bytes(frame[:4]) == HELLO_MAGIC
+
+
+def _parse_hello(frame):
+    if len(frame) < HELLO.size or not is_hello(frame):
+        raise HandshakeError("not a session hello")
+    _, algorithm_id, public = HELLO.unpack_from(frame)
+    for name, value in ALGORITHM_IDS.items():
+        if value == algorithm_id:
+            return name, public
+    raise HandshakeError(f"unsupported algorithm id {algorithm_id}")
+
+
+class SessionCipher:
+    """一條控制連線的 AEAD：各方向一把 key、各自的訊息計數當 nonce
+
+    訊息必須依送出順序解密（TCP 保證）；任何一個 frame 驗不過之後計數就對不上，呼叫端應該斷線。
+    """
+
+    def __init__(self, send_key, recv_key, algorithm=DEFAULT_ALGORITHM):
+        self.algorithm = algorithm
+        self.sender = ALGORITHMS[algorithm](send_key)
+        self.receiver = ALGORITHMS[algorithm](recv_key)
+        self.sent = 0
+        self.received = 0
+
+    def seal(self, message) -> bytes:
+        """str（或 bytes）→ 密文 + tag"""
+        data = message.encode() if isinstance(message, str) else message
+        nonce = COUNTER_NONCE.pack(self.sent)
+        self.sent += 1
+        return self.sender.encrypt(nonce, data, None)
+
+    def open_bytes(self, frame) -> bytes:
+        nonce = COUNTER_NONCE.pack(self.received)
+        try:
+            data = self.receiver.decrypt(nonce, frame, None)
+        except InvalidTag:
+            raise ValueError("control frame failed authentication") from None
+        self.received += 1
+        return data
+
+    def open(self, frame) -> str:
+        return self.open_bytes(frame).decode()
+
+
+def client_hello(algorithm=DEFAULT_ALGORITHM):
+    """client 端：回傳 (私鑰, 要送出的 HELLO frame)"""
+    private = X25519PrivateKey.generate()
+    return private, HELLO.pack(HELLO_MAGIC, ALGORITHM_IDS[algorithm], _public_bytes(private))
+
+
+def accept_hello(frame):
+    """server 端：收到 HELLO，回傳 (SessionCipher, 要回覆的 HELLO frame)"""
+    algorithm, client_public = _parse_hello(frame)
+    private = X25519PrivateKey.generate()
+    reply = HELLO.pack(HELLO_MAGIC, ALGORITHM_IDS[algorithm], _public_bytes(private))
+    c2s, s2c = _derive(private, client_public, bytes(frame[:HELLO.size]) + reply)
+    session = SessionCipher(s2c, c2s, algorithm)
+    # 確認碼：server → client 的第一個訊息（空字串），證明 server 也有 SECRET_KEY
+    return session, reply + session.seal(b"")
+
+
+def finish_hello(private, hello, reply):
+    """client 端：收到 server 的 HELLO，驗確認碼，回傳 SessionCipher"""
+    algorithm, server_public = _parse_hello(reply)
+    c2s, s2c = _derive(private, server_public, bytes(hello) + bytes(reply[:HELLO.size]))
+    session = SessionCipher(c2s, s2c, algorithm)
+    try:
+        session.open_bytes(reply[HELLO.size:])
+    except ValueError:
+        raise HandshakeError("server failed to confirm the session key (SECRET_KEY mismatch?)") from None
+    return session
+
+
+# ------------------------------------------------------------
+# UDP 音訊封包
+# ------------------------------------------------------------
+class PacketSealer:
+    """server 端：一個頻道的 key；seal 寫進重複使用的 buffer（送出前有效，sendmsg 後就可以覆寫）"""
+
+    def __init__(self, key=None, algorithm=DEFAULT_ALGORITHM, max_payload=SLOT_SIZE):
+        self.algorithm = algorithm
+        self.key = key or os.urandom(KEY_SIZE)
+        self.aead = ALGORITHMS[algorithm](self.key)
+        self.buf = bytearray(max_payload + TAG_SIZE)
+        self.view = memoryview(self.buf)
+        self.into = hasattr(self.aead, "encrypt_into")   # cryptography < 45 沒有 *_into
+
+    def seal(self, header, payload):
+        """header（nonce）+ payload → 密文 + tag 的 view"""
+        if not self.into:
+            return self.aead.encrypt(header, payload, None)
+        out = self.view[:len(payload) + TAG_SIZE]
+        self.aead.encrypt_into(header, payload, None, out)
+        return out
+
+    def announcement(self) -> str:
+        """控制連線上發給訂閱者的那一行（見 parse_stream_key）"""
+        return f"[server] Stream key: {self.algorithm} {self.key.hex()}"
+
+
+class PacketOpener:
+    """client 端：用 server 發的頻道 key 解開 SEALED_VERSION 的封包
+
+    open 回傳「header 改回一般版本 + 明文 payload」的 view，之後照舊交給 unpack_header；
+    解密寫進自己的 slot ring（跟 UdpReceiver 一樣的有效期），不另外複製；要留著的由使用端複製（jitter buffer 收下時複製）。
+    key 還沒到之前收到的加密封包用 hold 複製一份留著，set_key 之後 release 交還，頻道開頭不會少一段。
+    """
+
+    def __init__(self, slots=SLOTS, slot_size=SLOT_SIZE, hold=HOLD_PACKETS):
+        self.held = collections.deque(maxlen=hold)
+        self.slab = bytearray(slots * slot_size)
+        view = memoryview(self.slab)
+        self.views = [view[i * slot_size:(i + 1) * slot_size] for i in range(slots)]
+        self.index = 0
+        self.aead = None
+        self.algorithm = None
+        self.key = None
+        self.opened = 0
+
+    def set_key(self, algorithm, key):
+        if key != self.key:
+            self.algorithm, self.key = algorithm, key
+            self.aead = ALGORITHMS[algorithm](key)
+
+    def hold(self, data) -> bool:
+        """還沒有 key：留一份副本；留滿時最舊的被擠掉，回傳 False"""
+        full = len(self.held) == self.held.maxlen
+        self.held.append(bytes(data))
+        return not full
+
+    def release(self):
+        """有 key 之後：交還先前留著的封包（還沒 open）"""
+        if self.aead is None or not self.held:
+            return ()
+        held = list(self.held)
+        self.held.clear()
+        return held
+
+    def open(self, data):
+        """data：整個 datagram；驗不過 / 沒有 key 時丟 ValueError"""
+        if self.aead is None:
+            raise ValueError("sealed packet but no stream key")
+        n = len(data) - HEADER_SIZE - TAG_SIZE
+        if n < 0:
+            raise ValueError("sealed packet shorter than header + tag")
+        slot = self.views[self.index]
+        self.index = (self.index + 1) % len(self.views)
+        header = data[:HEADER_SIZE]
+        try:
+            if hasattr(self.aead, "decrypt_into"):
+                self.aead.decrypt_into(header, data[HEADER_SIZE:], None, slot[HEADER_SIZE:HEADER_SIZE + n])
+            else:
+                slot[HEADER_SIZE:HEADER_SIZE + n] = self.aead.decrypt(header, data[HEADER_SIZE:], None)
+        except InvalidTag:
+            raise ValueError("sealed packet failed authentication") from None
+        slot[:HEADER_SIZE] = header
+        slot[0] = VERSION
+        self.opened += 1
+        return slot[:HEADER_SIZE + n]
+
+
+def parse_stream_key(line):
+    """server 的 "[server] Stream key: <演算法> <hex>" → (演算法, key)；不是這種回覆時回傳 None"""
+    prefix = "[server] Stream key: "
+    if not line.startswith(prefix):
+        return None
+    try:
+        algorithm, key = line[len(prefix):].split()
+        if algorithm not in ALGORITHMS:
+            return None
+        return algorithm, bytes.fromhex(key)
+    except ValueError:
+        return None
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+utils/framing.py
+-----------------------------------
+控制連線的訊框格式（取代舊的 10-byte ASCII header 的 send_large / recv_large）
+
+每個 frame = 4-byte big-endian 長度 + payload（payload 是 session 的 AEAD 密文，舊版 client 是 Fernet 密文）
+
+ - encode_frame / send_frame：編碼與送出（大 payload 用 sendmsg 分散寫入，不先串接）
+ - FrameDecoder：增量解碼，內部是可重複使用的 bytearray + recv_into，
+   已知 frame 長度時一次把緩衝放大到足夠，不會有 data += chunk 的二次方成本
+   可餵 bytes（feed），也可直接從 blocking / non-blocking socket 讀（read_from）
+ - recv_frame：blocking socket 上讀一個 frame
+ - read_frame / write_frame：asyncio StreamReader / StreamWriter 版本
+ - 連線關閉一律回傳 None（長度 0 的 frame 是合法的，回傳 b""）
+ - 長度上限：握手 / 驗證通過之前用 HANDSHAKE_FRAME_SIZE（HELLO 與指令都很小，
+   還沒驗證的連線不能讓 server 配置 MAX_FRAME_SIZE 的緩衝），之後才放寬到 max_size
+"""
+import asyncio
+import struct
+
+HEADER = struct.Struct("!I")
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+HANDSHAKE_FRAME_SIZE = 4 * 1024
+RECV_CHUNK = 64 * 1024
+SCATTER_THRESHOLD = 64 * 1024
+SHRINK_ABOVE = 1024 * 1024
+
+
+class FrameError(ValueError):
+    """收到不合法的 frame（例如長度超過上限）"""
+
+
+def encode_frame(payload) -> bytes:
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"frame too large: {len(payload)} bytes")
+    return HEADER.pack(len(payload)) + bytes(payload)
+
+
+def send_frame(sock, payload):
+    """送出一個 frame（blocking socket）"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"frame too large: {len(payload)} bytes")
+    header = HEADER.pack(len(payload))
+    if len(payload) < SCATTER_THRESHOLD or not hasattr(sock, "sendmsg"):
+        sock.sendall(header + bytes(payload))
+        return
+    # 大 payload：header 與 payload 一起交給 kernel，不複製 payload
+    buffers = [memoryview(header), memoryview(payload).cast("B")]
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while sent and buffers:
+            if sent >= len(buffers[0]):
+                sent -= len(buffers[0])
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][sent:]
+                sent = 0
+
+
+class FrameDecoder:
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE, chunk_size=RECV_CHUNK):
+        self.max_frame_size = max_frame_size
+        self.chunk_size = chunk_size
+        self.buf = bytearray(chunk_size)
+        self.start = 0          # 尚未解碼資料的起點
+        self.end = 0            # 已收資料的終點
+        self.eof = False
+
+    def _needed(self):
+        """目前這個 frame 需要的總 bytes（header 還沒到時只要 header）"""
+        have = self.end - self.start
+        if have < HEADER_SIZE:
+            return HEADER_SIZE
+        (length,) = HEADER.unpack_from(self.buf, self.start)
+        if length > self.max_frame_size:
+            raise FrameError(f"frame too large: {length} bytes")
+        return HEADER_SIZE + length
+
+    def _reserve(self, size):
+        """確保 buf 在 end 之後至少還有 size bytes 可寫（必要時搬移 / 放大一次）"""
+        if len(self.buf) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if self.start and len(self.buf) - pending >= size:
+            self.buf[:pending] = self.buf[self.start:self.end]
+        else:
+            new = bytearray(max(len(self.buf) * 2, pending + size))
+            new[:pending] = self.buf[self.start:self.end]
+            self.buf = new
+        self.start, self.end = 0, pending
+
+    def feed(self, data):
+        n = len(data)
+        self._reserve(n)
+        self.buf[self.end:self.end + n] = data
+        self.end += n
+
+    def next_frame(self):
+        """回傳一個完整 frame 的 payload（bytes），不足一個 frame 時回傳 None"""
+        needed = self._needed()
+        if self.end - self.start < needed:
+            return None
+        payload = bytes(memoryview(self.buf)[self.start + HEADER_SIZE:self.start + needed])
+        self.start += needed
+        if self.start == self.end:
+            self.start = self.end = 0
+            if len(self.buf) > SHRINK_ABOVE:
+                self.buf = bytearray(self.chunk_size)   # 收過大 frame 後不要一直佔著記憶體
+        return payload
+
+    def frames(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def read_from(self, sock) -> int:
+        """從 socket 讀一次（recv_into 直接寫進 buf）；回傳讀到的 bytes，EOF 回傳 0
+
+        non-blocking socket 沒資料時會丟出 BlockingIOError，由呼叫端決定等待方式。
+        """
+        want = max(self.chunk_size, self._needed() - (self.end - self.start))
+        self._reserve(want)
+        n = sock.recv_into(memoryview(self.buf)[self.end:], want)
+        if n == 0:
+            self.eof = True
+        self.end += n
+        return n
+
+
+def recv_frame(sock, decoder=None):
+    """blocking socket 上讀一個 frame；連線關閉回傳 None
+
+    同一條連線要重複呼叫時請傳入同一個 decoder，才不會丟掉已讀但未解碼的資料。
+    長度上限是 decoder.max_frame_size（握手時可先設成 HANDSHAKE_FRAME_SIZE）。
+    """
+    decoder = decoder or FrameDecoder()
+    while True:
+        frame = decoder.next_frame()
+        if frame is not None:
+            return frame
+        if decoder.eof or decoder.read_from(sock) == 0:
+            return None
+
+
+async def read_frame(reader, max_size=MAX_FRAME_SIZE):
+    """從 asyncio.StreamReader 讀一個 frame；連線關閉回傳 None，長度超過 max_size 丟出 FrameError"""
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+        (length,) = HEADER.unpack(header)
+        if length > max_size:
+            raise FrameError(f"frame too large: {length} bytes")
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def write_frame(writer, payload):
+    writer.write(HEADER.pack(len(payload)))
+    writer.write(payload)
+    await writer.drain()
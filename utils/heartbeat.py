@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+utils/heartbeat.py
+-----------------------------------
+UDP 心跳封包格式（client/heartbeat.py 送 ping，server/liveness.py 回 pong）
+
+ping / pong：每個 datagram 固定 24 bytes
+    kind      2s   b"PI" = ping、b"PO" = pong
+    client_id u32  client 啟動時隨機產生，換 IP / port 也認得是同一個 client
+    seq       u32  ping 序號（pong 原樣帶回）
+    sent      f64  client 送出時的 monotonic 時間（pong 原樣帶回，client 用來算 RTT）
+    rtt_ms    u16  client 上一次量到的 RTT（毫秒），RTT_UNKNOWN 表示還沒量到
+    reserved  u16
+
+receiver report：player 每秒從收音訊的 socket 送一個 34-byte datagram 到同一個 port（不回覆），
+server/feedback.py 據此調整頻道的送法；來源位址就是 server 送音訊的 endpoint
+    kind        2s   b"RR"
+    client_id   u32  同 ping（client.py 用 Heartbeat 的 id）
+    stream_id   u16  正在播的串流（packet header 的 stream id）
+    highest_seq u32  收到過最大的 seq
+    received    u32  累計收到的封包數（含重複 / 太晚，server 用來算網路上的掉包率）
+    lost        u32  累計播放時補償掉的封包數（jitter buffer 的 lost）
+    underruns   u32  累計 underrun 次數（jitter buffer + ring buffer）
+    jitter_ms   f32  RFC 3550 interarrival jitter
+    buffer_ms   f32  目前緩衝的音訊長度（jitter buffer + ring buffer）
+    reserved    u16
+"""
+import struct
+
+HEARTBEAT_PORT = 5690
+PING = b"PI"
+PONG = b"PO"
+RTT_UNKNOWN = 0xFFFF
+FORMAT = struct.Struct("!2sIIdHH")
+SIZE = FORMAT.size
+REPORT = b"RR"
+REPORT_FORMAT = struct.Struct("!2sIHIIIIffH")
+REPORT_SIZE = REPORT_FORMAT.size
+
+
+def pack(kind: bytes, client_id: int, seq: int, sent: float, rtt_ms=None) -> bytes:
+    rtt = RTT_UNKNOWN if rtt_ms is None else min(int(rtt_ms), RTT_UNKNOWN - 1)
+    return FORMAT.pack(kind, client_id & 0xFFFFFFFF, seq & 0xFFFFFFFF, sent, rtt, 0)
+
+
+def unpack(data):
+    """回傳 (kind, client_id, seq, sent, rtt_ms 或 None)；格式不符時丟 ValueError"""
+    if len(data) != SIZE:
+        raise ValueError(f"heartbeat must be {SIZE} bytes, got {len(data)}")
+    kind, client_id, seq, sent, rtt, _ = FORMAT.unpack(data)
+    if kind not in (PING, PONG):
+        raise ValueError(f"unknown heartbeat kind {kind!r}")
+    return kind, client_id, seq, sent, (None if rtt == RTT_UNKNOWN else rtt)
+
+
+def pack_report(client_id, stream_id, highest_seq, received, lost, underruns, jitter_ms, buffer_ms) -> bytes:
+    return REPORT_FORMAT.pack(REPORT, client_id & 0xFFFFFFFF, stream_id & 0xFFFF, highest_seq & 0xFFFFFFFF,
+                              received & 0xFFFFFFFF, lost & 0xFFFFFFFF, underruns & 0xFFFFFFFF,
+                              jitter_ms, buffer_ms, 0)
+
+
+def is_report(data) -> bool:
+    return len(data) == REPORT_SIZE and data[:2] == REPORT
+
+
+def unpack_report(data):
+    """回傳 (client_id, stream_id, highest_seq, received, lost, underruns, jitter_ms, buffer_ms)；格式不符丟 ValueError"""
+    if not is_report(data):
+        raise ValueError(f"receiver report must be {REPORT_SIZE} bytes starting with {REPORT!r}")
+    return REPORT_FORMAT.unpack(data)[1:-1]
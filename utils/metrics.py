@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+utils/metrics.py
+-----------------------------------
+低成本的 metrics（server / client 共用）
+ - Counter：單調遞增的計數（封包數、bytes、丟包…）
+ - Histogram：固定的指數分桶（50 µs ~ 60 s），observe 只做一次 bisect + 兩個加法；
+   快照時由分桶估 p50 / p90 / p99
+ - Gauge：讀取時才呼叫的函式（jitter buffer 深度、在線 session 數…），熱路徑上完全沒有成本
+ - 所有 metric 註冊在 REGISTRY；serve() 開一個只綁 127.0.0.1 的 HTTP endpoint：
+     GET /metrics       Prometheus text format
+     GET /metrics.json  JSON 快照
+ - log_sampled()：熱路徑上的訊息同一個 key 每 interval 秒最多印一次，並附上期間被省略的次數
+"""
+import bisect
+import json
+import threading
+import time
+
+# 指數分桶上界（秒）：50 µs × 2^k，最後一格收所有更大的值
+BUCKETS = tuple(50e-6 * 2 ** k for k in range(21))   # 50 µs ~ 52 s
+SAMPLE_INTERVAL = 5.0
+
+
+class Counter:
+    __slots__ = ("name", "help", "value", "lock")
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+
+class Histogram:
+    def __init__(self, name, help="", buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def time(self):
+        """with hist.time(): ... 量一段程式的耗時"""
+        return _Timer(self)
+
+    def percentile(self, p):
+        """由分桶估百分位（回傳該桶的上界；落在最後一格時回傳 max）"""
+        with self.lock:
+            counts, total, peak = list(self.counts), self.count, self.max
+        if total == 0:
+            return 0.0
+        rank = p / 100 * total
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= rank and c:
+                return min(self.bounds[i], peak) if i < len(self.bounds) else peak
+        return peak
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            count, total, peak = self.count, self.sum, self.max
+        return {
+            "count": count,
+            "mean_ms": total / count * 1000 if count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p90_ms": self.percentile(90) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": peak * 1000,
+        }
+
+
+class _Timer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Gauge:
+    def __init__(self, name, fn, help=""):
+        self.name = name
+        self.fn = fn
+        self.help = help
+
+    def read(self):
+        try:
+            return float(self.fn())
+        except Exception:
+            return float("nan")
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name, factory):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help="") -> Counter:
+        return self._get(name, lambda: Counter(name, help))
+
+    def histogram(self, name, help="", buckets=BUCKETS) -> Histogram:
+        return self._get(name, lambda: Histogram(name, help, buckets))
+
+    def gauge(self, name, fn, help="") -> Gauge:
+        """同名 gauge 重新註冊時換成新的 fn（例如新的播放 session）"""
+        with self.lock:
+            gauge = self.metrics[name] = Gauge(name, fn, help)
+            return gauge
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        snap = {}
+        for m in metrics:
+            if isinstance(m, Counter):
+                snap[m.name] = m.value
+            elif isinstance(m, Histogram):
+                snap[m.name] = m.snapshot()
+            else:
+                snap[m.name] = m.read()
+        return snap
+
+    def render_text(self) -> str:
+        """Prometheus text exposition format"""
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        lines = []
+        for m in metrics:
+            if m.help:
+                lines.append(f"# HELP {m.name} {m.help}")
+            if isinstance(m, Counter):
+                lines.append(f"# TYPE {m.name} counter")
+                lines.append(f"{m.name} {m.value}")
+            elif isinstance(m, Histogram):
+                with m.lock:
+                    counts, count, total = list(m.counts), m.count, m.sum
+                lines.append(f"# TYPE {m.name} histogram")
+                cumulative = 0
+                for bound, c in zip(m.bounds, counts):
+                    cumulative += c
+                    lines.append(f'{m.name}_bucket{{le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{m.name}_bucket{{le="+Inf"}} {count}')
+                lines.append(f"{m.name}_sum {total:.6f}")
+                lines.append(f"{m.name}_count {count}")
+            else:
+                lines.append(f"# TYPE {m.name} gauge")
+                lines.append(f"{m.name} {m.read():g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+
+
+# ------------------------------------------------------------
+# HTTP endpoint（http.server 到 serve() 才 import，只用 counter 的 process 不必載入）
+# ------------------------------------------------------------
+class _Handler:
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, ctype = self.registry.render_text().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, ctype = json.dumps(self.registry.snapshot(), indent=1).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass   # 不要每個 scrape 都印一行
+
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """背景 thread 開 metrics endpoint；port 被佔用時印警告並回傳 None（metrics 照常累積）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    handler = type("Handler", (_Handler, BaseHTTPRequestHandler), {"registry": registry})
+    try:
+        httpd = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        print(f"[metrics] ⚠️ Cannot serve metrics on {host}:{port}: {e}")
+        return None
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"[metrics] Serving http://{host}:{httpd.server_address[1]}/metrics")
+    return httpd
+
+
+# ------------------------------------------------------------
+# 取樣 log
+# ------------------------------------------------------------
+SAMPLED_MAX = 1024   # _sampled 超過這麼多個 key 就清掉時間窗已經過了的（key 常帶 endpoint，不清會一直長）
+
+_sampled = {}    # key -> [下次可以印的時間, 期間省略的次數]
+_sampled_limit = SAMPLED_MAX
+_sampled_lock = threading.Lock()
+
+
+def _prune_sampled(now):
+    """清掉時間窗已經過了的 key（下次再出現就當第一次印）；清完還很多就把門檻加倍，平均每次呼叫仍是 O(1)"""
+    global _sampled_limit
+    for key in [k for k, state in _sampled.items() if now >= state[0]]:
+        del _sampled[key]
+    _sampled_limit = max(SAMPLED_MAX, 2 * len(_sampled))
+
+
+def log_sampled(key, message, interval=SAMPLE_INTERVAL):
+    """同一個 key 每 interval 秒最多印一次；回傳是否印出"""
+    now = time.monotonic()
+    with _sampled_lock:
+        state = _sampled.get(key)
+        if state is not None and now < state[0]:
+            state[1] += 1
+            return False
+        suppressed = state[1] if state is not None else 0
+        _sampled[key] = [now + interval, 0]
+        if len(_sampled) > _sampled_limit:
+            _prune_sampled(now)
+    print(message + (f" (+{suppressed} similar)" if suppressed else ""))
+    return True
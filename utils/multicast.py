@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+utils/multicast.py
+-----------------------------------
+IP multicast 傳送模式（server streamer / client player / peer relay 共用）
+ - 每個 mood channel 一個 multicast group（239.255.77.x，organization-local scope），
+   server 每個封包只送一次，同一個 LAN 上的 N 個 listener 由網路複製
+ - group 由頻道的 (mood, codec, secure) 算出（crc32），server 與 client 不需要另外同步對照表；
+   同一個 mood 的 pcm / opus / 加密頻道各有自己的 stream id，落在同一個 group 會讓 listener 收到交錯的串流，
+   所以分開。pcm 明文頻道只用 mood 名稱算，跟舊版 player 的 --multicast <mood> 一致
+ - TTL 預設 1（只在本網段）；IP_MULTICAST_LOOP 開著時同一台機器上的 listener 也收得到，
+   單機就能測
+ - 沒有 multicast 路由時（open_sender 丟 OSError）由呼叫端退回 unicast
+
+協商：client 在控制連線送 "/delivery multicast"，server 在 /prompt 的回覆中多一行
+"[server] Multicast: <group>:<port>"，client 收到後 join 該 group。
+"""
+import socket
+import struct
+import zlib
+
+GROUP_PREFIX = "239.255.77."
+DEFAULT_TTL = 1
+DELIVERY_MODES = ("unicast", "multicast")
+
+
+def group_for(mood: str, codec: str = "pcm", secure: bool = False) -> str:
+    """頻道 (mood, codec, secure) → multicast group（239.255.77.1 ~ 239.255.77.254）"""
+    name = mood.lower()
+    if codec != "pcm" or secure:
+        name += f"/{codec}" + ("/secure" if secure else "")
+    return GROUP_PREFIX + str(zlib.crc32(name.encode()) % 254 + 1)
+
+
+def is_multicast(ip: str) -> bool:
+    try:
+        return 224 <= int(ip.split(".")[0]) <= 239
+    except ValueError:
+        return False
+
+
+def open_sender(group: str, port: int, ttl: int = DEFAULT_TTL, loop: bool = True, interface: str = None):
+    """送往 group 的 socket；沒有 multicast 路由時丟 OSError（讓呼叫端退回 unicast）"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1 if loop else 0)
+        if interface:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        # UDP connect 只做路由查詢、不送任何封包：查不到路由就在這裡失敗
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect((group, port))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def join(sock, group: str, interface: str = "0.0.0.0"):
+    membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface or "0.0.0.0"))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+
+def leave(sock, group: str, interface: str = "0.0.0.0"):
+    membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface or "0.0.0.0"))
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, membership)
+    except OSError:
+        pass
+
+
+def open_listener(group: str, port: int, interface: str = None):
+    """綁定 port 並 join group；SO_REUSEADDR 讓同一台機器上的多個 listener 都收得到"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        # Linux 綁 group 位址才不會收到同 port 其他 group 的封包；其他平台綁不上就綁 any
+        try:
+            sock.bind((group, port))
+        except OSError:
+            sock.bind(("", port))
+        join(sock, group, interface)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def parse_announcement(line: str):
+    """"[server] Multicast: 239.255.77.9:5680" → ("239.255.77.9", 5680)；不是公告時回傳 None"""
+    marker = "Multicast: "
+    start = line.find(marker)
+    if start == -1:
+        return None
+    group, _, port = line[start + len(marker):].strip().partition(":")
+    if not is_multicast(group) or not port.isdigit():
+        return None
+    return group, int(port)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+utils/packet.py
+-----------------------------------
+UDP 音訊封包格式（server streamer / client player / peer relay 共用）
+
+每個 datagram = 12-byte header + payload
+    version   u8   1 = 明文 payload；2 = 加密頻道（payload = AEAD 密文 + 16-byte tag，nonce 就是這個 header，
+                   見 utils/encryptor.py 的 PacketSealer / PacketOpener）
+    codec     u8   payload 格式（0 = PCM s16le、1 = Opus，見 utils/codec.py）
+    stream_id u16  每次廣播隨機產生，換歌 / 換串流時 client 會重置
+    seq       u32  封包序號（wrap around）
+    timestamp u32  媒體時間，單位為 sample（wrap around）
+"""
+import struct
+
+VERSION = 1
+SEALED_VERSION = 2
+CODEC_PCM = 0
+CODEC_OPUS = 1
+HEADER = struct.Struct("!BBHII")
+HEADER_SIZE = HEADER.size
+SEQ_MOD = 1 << 32
+
+
+def pack_header(stream_id: int, seq: int, timestamp: int, codec: int = CODEC_PCM, version: int = VERSION) -> bytes:
+    return HEADER.pack(version, codec, stream_id & 0xFFFF, seq % SEQ_MOD, timestamp % SEQ_MOD)
+
+
+def is_sealed(data) -> bool:
+    return len(data) > 0 and data[0] == SEALED_VERSION
+
+
+def unpack_header(data):
+    """回傳 (codec, stream_id, seq, timestamp, payload)；格式不符時丟 ValueError
+
+    加密的封包（SEALED_VERSION）也丟 ValueError：要先用 PacketOpener.open 解開，不會把密文當 PCM 播
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("datagram shorter than header")
+    version, codec, stream_id, seq, timestamp = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"unsupported packet version {version}")
+    return codec, stream_id, seq, timestamp, data[HEADER_SIZE:]
+
+
+def peek_header(data):
+    """只讀 header，回傳 (version, codec, stream_id, seq, timestamp)；明文與加密封包都接受，不解密
+
+    中繼轉送用：加密封包的 header 本身是明文（就是 AEAD 的 nonce），去重、轉送不需要頻道 key
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("datagram shorter than header")
+    header = HEADER.unpack_from(data)
+    if header[0] not in (VERSION, SEALED_VERSION):
+        raise ValueError(f"unsupported packet version {header[0]}")
+    return header
+
+
+def seq_diff(a: int, b: int) -> int:
+    """a - b（考慮 32-bit wrap around），結果落在 [-2^31, 2^31)"""
+    return (a - b + (1 << 31)) % SEQ_MOD - (1 << 31)
+
+
+def send_packet(sock, header: bytes, payload, target):
+    """header + payload 一起送出；支援 sendmsg 時不需先串接（payload 可為 memoryview）"""
+    if hasattr(sock, "sendmsg"):
+        return sock.sendmsg([header, payload], [], 0, target)
+    return sock.sendto(header + bytes(payload), target)